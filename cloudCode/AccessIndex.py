@@ -0,0 +1,257 @@
+import json
+import boto3
+import gzip
+import os
+import time as clock
+from bisect import bisect_left, bisect_right, insort
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from urllib.parse import unquote_plus
+from botocore.exceptions import ClientError
+from S3Keys import day_prefix, parse_key, to_datetime
+
+# Getting bucket ready
+s3 = boto3.client('s3')
+s3_name = 'smartsafe-logs'
+
+CAMERAS = ('picamera1', 'picamera2')
+
+# Clips starting this many seconds before an open or after a close still belong to it
+SLACK = 5
+# Upper bound on a clip length, limits how far back the join has to look
+MAX_CLIP = 600
+# Days a "last N" query walks back before giving up
+MAX_DAYS = int(os.environ.get('ACCESS_MAX_DAYS', '30'))
+# Day manifests a "last N" query fetches at once
+READERS = 7
+
+# Per-device, per-day manifest:
+#   status:   [[time, 1 open / 0 closed], ...] sorted by time
+#   clips:    [[start, end, camera, key], ...] sorted by start
+#   episodes: [[open, close, duration, [clip keys]], ...], open or close is None
+#             when the episode crosses midnight, query() stitches those back together
+
+def manifest_key(device, day):
+    return day_prefix('index', device, day) + 'manifest.json'
+
+
+def empty_manifest(device, day):
+    return {"v": 1, "device": device, "day": day, "status": [], "clips": [], "episodes": []}
+
+
+def load_manifest(device, day):
+    """Returns (manifest, etag), etag is None if the manifest does not exist yet."""
+    try:
+        obj = s3.get_object(Bucket=s3_name, Key=manifest_key(device, day))
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return empty_manifest(device, day), None
+        raise
+    return json.loads(obj['Body'].read()), obj['ETag']
+
+
+def save_manifest(manifest, etag):
+    # Conditional write, fails if another invocation updated the manifest meanwhile
+    condition = {"IfMatch": etag} if etag else {"IfNoneMatch": '*'}
+    s3.put_object(
+        Bucket=s3_name,
+        Key=manifest_key(manifest['device'], manifest['day']),
+        Body=json.dumps(manifest, separators=(',', ':')),
+        ContentType='application/json',
+        **condition
+    )
+
+
+def add_status(manifest, samples):
+    times = [s[0] for s in manifest['status']]
+    for sample in samples:
+        i = bisect_left(times, sample[0])
+        if i < len(times) and times[i] == sample[0]:
+            manifest['status'][i] = sample
+        else:
+            times.insert(i, sample[0])
+            manifest['status'].insert(i, sample)
+
+
+def add_clip(manifest, clip):
+    start, end, camera, key = clip
+    for existing in manifest['clips']:
+        if existing[3] == key:
+            # Segment manifests are re-uploaded as segments arrive, keep the latest end
+            existing[1] = max(existing[1], end)
+            return
+    insort(manifest['clips'], clip)
+
+
+def build_episodes(manifest):
+    # Collapse status samples (transitions plus heartbeats) into open/close pairs
+    episodes = []
+    state = None
+    for t, status in manifest['status']:
+        if status == state:
+            continue
+        if status == 1:
+            episodes.append([t, None, None, []])
+        elif episodes and episodes[-1][1] is None and episodes[-1][0] is not None:
+            episodes[-1][1] = t
+        elif state is None:
+            episodes.append([None, t, None, []])  # May close an episode from the day before
+        state = status
+
+    # Join clips by time window, clips are sorted by start
+    starts = [c[0] for c in manifest['clips']]
+    day_end = (to_datetime(datetime.fromisoformat(manifest['day'])) + timedelta(days=1)).timestamp()
+    for episode in episodes:
+        opened = episode[0] if episode[0] is not None else day_end - 86400
+        closed = episode[1] if episode[1] is not None else day_end
+        if episode[0] is not None and episode[1] is not None:
+            episode[2] = episode[1] - episode[0]
+        lo = bisect_left(starts, opened - SLACK - MAX_CLIP)
+        hi = bisect_right(starts, closed + SLACK)
+        episode[3] = [c[3] for c in manifest['clips'][lo:hi] if c[1] >= opened - SLACK]
+    manifest['episodes'] = episodes
+
+
+def read_status_samples(key):
+    # processed_data holds one status dict, batch_data gzip NDJSON rows
+    if not key.endswith(('.json', '.ndjson.gz')):
+        return []
+    body = s3.get_object(Bucket=s3_name, Key=key)['Body'].read()
+    if key.endswith('.gz'):
+        rows = [json.loads(line) for line in gzip.decompress(body).splitlines() if line]
+    else:
+        rows = [json.loads(body)]
+    return [[int(r['time']), 1 if r.get('status') == 'open' else 0] for r in rows if r.get('time')]
+
+
+def clip_end(key, start, event_time):
+    """
+    Recorded end of a clip: the "ended" object metadata of a whole clip, or the
+    last segment of a session manifest. Not the upload time, spooled clips can
+    arrive hours late. Clips without either are capped at MAX_CLIP.
+    """
+    if key.endswith('/manifest.json'):
+        session = json.loads(s3.get_object(Bucket=s3_name, Key=key)['Body'].read())
+        ends = [s['start'] + s['duration'] for s in session.get('segments', [])]
+        return max([start] + ends)
+    ended = s3.head_object(Bucket=s3_name, Key=key).get('Metadata', {}).get('ended')
+    if ended is not None:
+        return max(start, float(ended))
+    return max(start, min(event_time, start + MAX_CLIP))
+
+
+def index_object(key, event_time):
+    """Fold one new S3 object into its device/day manifest."""
+    info = parse_key(key)
+    if info is None:
+        return False
+    if info['kind'] in CAMERAS:
+        # Whole clips (.h264 when the device could not remux), or the manifest
+        # of a segmented session (not its segments, one folder further down)
+        whole = key.count('/') == 5 and key.endswith(('.mp4', '.h264'))
+        if not (whole or key.endswith('/manifest.json')):
+            return False
+        clip = [info['time'], clip_end(key, info['time'], event_time), info['kind'], key]
+        update = lambda m: add_clip(m, clip)
+    elif info['kind'] in ('processed_data', 'batch_data'):
+        samples = read_status_samples(key)
+        if not samples:
+            return False
+        update = lambda m: add_status(m, samples)
+    else:
+        return False
+
+    # Optimistic concurrency: reload and reapply if another invocation won the race
+    for _ in range(5):
+        manifest, etag = load_manifest(info['device'], info['day'])
+        update(manifest)
+        build_episodes(manifest)
+        try:
+            save_manifest(manifest, etag)
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                raise
+    raise RuntimeError(f'Could not update manifest for {key}')
+
+
+def index_handler(event, context):
+    # S3 ObjectCreated notifications for raw_data/, processed_data/, batch_data/ and picamera*/
+    indexed = 0
+    for record in event.get('Records', []):
+        key = unquote_plus(record['s3']['object']['key'])
+        event_time = datetime.fromisoformat(record['eventTime'].replace('Z', '+00:00')).timestamp()
+        indexed += index_object(key, event_time)
+    return {
+        'statusCode': 200,
+        "body": json.dumps(f'Indexed {indexed} objects')
+    }
+
+
+def stitch(episodes):
+    # Join an episode left open at midnight with the close at the start of the next day
+    stitched = []
+    for episode in episodes:
+        if episode[0] is None and stitched and stitched[-1][1] is None:
+            previous = stitched[-1]
+            previous[1] = episode[1]
+            previous[2] = episode[1] - previous[0]
+            previous[3] = previous[3] + [k for k in episode[3] if k not in previous[3]]
+        else:
+            stitched.append(list(episode))
+    return stitched
+
+
+def to_access(episode):
+    opened, closed, duration, clips = episode
+    return {"open": opened, "close": closed, "duration": duration, "clips": clips}
+
+
+def query(device, last=None, start=None, end=None):
+    """
+    Access episodes of one device, read from the day manifests only.
+
+    :param last: Return the last N accesses, newest first.
+    :param start: With end, return the accesses opened between start and end (epoch seconds).
+    """
+    if last is not None:
+        episodes = []
+        today = datetime.now(timezone.utc).date()
+        days = [(today - timedelta(days=i)).isoformat() for i in range(MAX_DAYS)]
+        # READERS days back at a time, most queries are answered by the first batch
+        with ThreadPoolExecutor(READERS) as pool:
+            for i in range(0, len(days), READERS):
+                for manifest, _ in pool.map(lambda day: load_manifest(device, day), days[i:i + READERS]):
+                    episodes = manifest['episodes'] + episodes
+                # One extra episode, the oldest may be the tail of an episode from the day before
+                if len([e for e in episodes if e[0] is not None]) > last:
+                    break
+        episodes = [e for e in stitch(episodes) if e[0] is not None]
+        return [to_access(e) for e in reversed(episodes[-last:])]
+
+    episodes = []
+    day = to_datetime(start).date()
+    while day <= to_datetime(end).date() + timedelta(days=1):
+        episodes += load_manifest(device, day.isoformat())[0]['episodes']
+        day += timedelta(days=1)
+    return [to_access(e) for e in stitch(episodes) if e[0] is not None and start <= e[0] <= end]
+
+
+def query_handler(event, context):
+    # {"device": ..., "last": N} or {"device": ..., "start": t1, "end": t2}
+    begin = clock.perf_counter()
+    try:
+        device = event['device']
+        if event.get('last') is not None:
+            accesses = query(device, last=int(event['last']))
+        else:
+            accesses = query(device, start=float(event['start']), end=float(event['end']))
+    except (KeyError, ValueError) as e:
+        return {
+            'statusCode': 400,
+            'body': json.dumps('Invalid input: ' + str(e))
+        }
+    return {
+        'statusCode': 200,
+        "body": json.dumps({"accesses": accesses, "ms": round((clock.perf_counter() - begin) * 1000, 2)})
+    }
@@ -1,11 +1,48 @@
 import json
 import boto3
+import base64
+import gzip
+import io
+import os
+import time as clock
+from S3Keys import object_key
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 # Getting bucket ready
 s3 = boto3.client('s3')
 s3_name = 'smartsafe-logs'
 
+# Batch output format, 'ndjson' (gzip) or 'parquet' (needs pyarrow)
+BATCH_FORMAT = os.environ.get('BATCH_FORMAT', 'ndjson')
+
+# Field order of the compact array form sent by the device (schema v1)
+FIELDS = ("time", "status", "cam1", "cam2", "last opened")
+SCHEMA_VERSION = 1
+
 def lambda_handler(event, context):
+    # Binary (cbor/msgpack) payloads arrive base64 encoded from the IoT rule
+    # SELECT encode(*, 'base64') AS data FROM 'smartsafe/#'
+    if isinstance(event, dict) and set(event) == {'data'}:
+        try:
+            event = decode_payload(base64.b64decode(event['data']))
+        except Exception as e:
+            return {
+                'statusCode': 400,
+                'body': json.dumps('Invalid input: ' + str(e))
+            }
+
+    # Batches (lists, SQS/Kinesis records, device batch messages) go to batch_handler
+    if is_batch(event):
+        return batch_handler(event, context)
+
+    # Snapshot alerts: a status record plus the event id and snapshot key
+    if 'alert' in event:
+        return alert_handler(event, context)
+
     try:
         # Extracting data from input
         time = event.get('time')
@@ -13,6 +50,7 @@ def lambda_handler(event, context):
         cam1 = event.get('cam1')
         cam2 = event.get('cam2')
         last_opened = event.get('last opened')
+        device = event.get('device') or 'smartsafe'
 
     except Exception as e:
         return {
@@ -38,18 +76,189 @@ def lambda_handler(event, context):
     # Saving raw data to S3
     s3.put_object(
         Bucket=s3_name,
-        Key=f"raw_data/smartsafe_raw_{time}.json",
+        Key=object_key("raw_data", device, time),
         Body=json.dumps(event)
     )
     
     # Saving processed result to S3
     s3.put_object(
         Bucket=s3_name,
-        Key=f"processed_data/smartsafe_processed_{time}.json",
+        Key=object_key("processed_data", device, time),
         Body=json.dumps(processed_result) 
     )
     
     return {
         'statusCode': 200,
         "body": json.dumps(f'Data processed and saved with duration: {duration}')
-    }
\ No newline at end of file
+    }
+
+
+def alert_handler(event, context):
+    # The snapshot object carries the same event id and key in its metadata
+    alert = event['alert']
+    device = event.get('device') or 'smartsafe'
+    status = {k: event[k] for k in ("time", "status", "cam1", "cam2", "last opened") if k in event}
+    s3.put_object(
+        Bucket=s3_name,
+        Key=object_key("alerts", device, status.get('time')),
+        Body=json.dumps(dict(status, **alert, device=device))
+    )
+    return {
+        'statusCode': 200,
+        "body": json.dumps(f"Alert saved for {alert.get('snapshot')}")
+    }
+
+
+def is_batch(event):
+    return isinstance(event, list) or 'Records' in event or 'events' in event or 'e' in event
+
+
+def decode_payload(body):
+    # A device message, JSON or one of the binary telemetry encodings told apart by the first byte
+    if isinstance(body, str):
+        body = body.encode()
+    first = body.lstrip()[:1]
+    if first in (b'{', b'['):
+        return json.loads(body)
+    if first and (0x80 <= first[0] <= 0x8f or first[0] in (0xde, 0xdf)):
+        # msgpack map
+        import msgpack
+        return msgpack.unpackb(body)
+    if first and 0xa0 <= first[0] <= 0xbf:
+        # CBOR map
+        import cbor2
+        return cbor2.loads(body)
+    raise ValueError('payload is not JSON, CBOR or msgpack')
+
+
+def extract_events(event):
+    # Flatten every supported input shape into a list of status dicts
+    if isinstance(event, list):
+        events = []
+        for item in event:
+            events += extract_events(item)
+        return events
+    if 'Records' in event:
+        events = []
+        for record in event['Records']:
+            if 'kinesis' in record:
+                body = base64.b64decode(record['kinesis']['data'])
+            else:
+                body = record.get('body', '{}')
+                if body[:1] not in ('{', '['):
+                    # SQS bodies are text, binary messages are queued base64 encoded
+                    body = base64.b64decode(body)
+            events += extract_events(decode_payload(body))
+        return events
+    if 'events' in event:
+        return [dict(e, device=e.get('device', event.get('device'))) for e in event['events']]
+    if 'e' in event:
+        if event.get('v', SCHEMA_VERSION) != SCHEMA_VERSION:
+            raise ValueError(f"unsupported schema version {event.get('v')}")
+        return [dict(zip(FIELDS, row), device=event.get('device')) for row in event['e']]
+    return [event]
+
+
+def compute_durations(times, last_opened):
+    # duration = time - last opened, or 0 when the safe was never opened
+    if np is not None:
+        t = np.asarray(times, dtype=np.int64)
+        opened = np.asarray(last_opened, dtype=np.int64)
+        return np.where(opened != 0, t - opened, 0).tolist()
+    return [t - o if o != 0 else 0 for t, o in zip(times, last_opened)]
+
+
+def encode_rows(rows):
+    if BATCH_FORMAT == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        buffer = io.BytesIO()
+        pq.write_table(pa.Table.from_pylist(rows), buffer, compression='zstd')
+        return buffer.getvalue(), 'parquet'
+    body = "\n".join(json.dumps(row, separators=(',', ':')) for row in rows) + "\n"
+    return gzip.compress(body.encode(), compresslevel=6), 'ndjson.gz'
+
+
+def batch_handler(event, context):
+    try:
+        events = extract_events(event)
+        # Columnar pass over the whole batch
+        times = [int(e.get('time', 0)) for e in events]
+        last_opened = [int(e.get('last opened', 0) or 0) for e in events]
+        devices = [e.get('device') or 'smartsafe' for e in events]
+    except Exception as e:
+        return {
+            'statusCode': 400,
+            'body': json.dumps('Invalid input: ' + str(e))
+        }
+
+    durations = compute_durations(times, last_opened)
+
+    # Group rows by device and hour, one object per partition
+    partitions = {}
+    for i, e in enumerate(events):
+        hour = times[i] // 3600
+        row = {
+            "device": devices[i],
+            "time": times[i],
+            "status": e.get('status'),
+            "cam1": e.get('cam1'),
+            "cam2": e.get('cam2'),
+            "last opened": last_opened[i],
+            "duration": durations[i],
+        }
+        partitions.setdefault((devices[i], hour), []).append(row)
+
+    for (device, hour), rows in partitions.items():
+        body, extension = encode_rows(rows)
+        s3.put_object(
+            Bucket=s3_name,
+            Key=object_key("batch_data", device, rows[0]['time'], extension),
+            Body=body
+        )
+
+    return {
+        'statusCode': 200,
+        "body": json.dumps(f'Batch of {len(events)} events saved to {len(partitions)} objects')
+    }
+
+
+if __name__ == '__main__':
+    # Local benchmark: 10k synthetic events from 20 safes, single-event vs batched ingestion.
+    # PUTs are counted, not sent; events/s adds a typical in-region PUT latency per object.
+    PUT_LATENCY = 0.02
+
+    class CountingS3:
+        def __init__(self):
+            self.objects = 0
+            self.bytes = 0
+
+        def put_object(self, Bucket, Key, Body):
+            self.objects += 1
+            self.bytes += len(Body)
+
+    start_time = 1_760_000_000
+    events = [{
+        "device": f"safe-{i % 20:02d}",
+        "time": start_time + i,
+        "status": "open" if i % 7 else "closed",
+        "cam1": "recording" if i % 3 else "standby",
+        "cam2": "standby",
+        "last opened": start_time + i - (i % 60),
+    } for i in range(10_000)]
+
+    s3 = CountingS3()
+    begin = clock.perf_counter()
+    for e in events:
+        lambda_handler(e, None)
+    elapsed = clock.perf_counter() - begin + s3.objects * PUT_LATENCY
+    print(f"single: {len(events) / elapsed:,.0f} events/s, {s3.objects} objects, {s3.bytes} bytes per 10k events")
+
+    for batch_size in (100, 1000):
+        s3 = CountingS3()
+        begin = clock.perf_counter()
+        for i in range(0, len(events), batch_size):
+            lambda_handler({"Records": [{"body": json.dumps(e)} for e in events[i:i + batch_size]]}, None)
+        elapsed = clock.perf_counter() - begin + s3.objects * PUT_LATENCY
+        print(f"batch {batch_size}: {len(events) / elapsed:,.0f} events/s, {s3.objects} objects, "
+              f"{s3.bytes} bytes per 10k events")
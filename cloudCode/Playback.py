@@ -0,0 +1,119 @@
+import json
+import boto3
+import os
+import subprocess
+import tempfile
+from urllib.parse import unquote_plus
+from botocore.exceptions import ClientError
+from S3Keys import parse_key
+
+# Getting bucket ready
+s3 = boto3.client('s3')
+s3_name = 'smartsafe-logs'
+
+CAMERAS = ('picamera1', 'picamera2')
+# Static ffmpeg build, e.g. from a Lambda layer
+FFMPEG = os.environ.get('FFMPEG', '/opt/bin/ffmpeg')
+
+# The device uploads raw H.264 (Annex B): the segments of a session, and whole clips
+# whose MP4 remux failed on the device. Neither plays in a browser, so this Lambda
+# remuxes them, without re-encoding, into {clip key without extension}/playback.mp4:
+#
+#   picamera1/.../picam1_<ms>_<id>/manifest.json  ->  picam1_<ms>_<id>/playback.mp4
+#   picamera1/.../picam1_<ms>_<id>.h264           ->  picam1_<ms>_<id>/playback.mp4
+#
+# Segments start with a keyframe and SPS/PPS, so they concatenate into one stream.
+# One folder below the clip, the access index does not pick the MP4 up as a clip.
+
+def playback_key(key):
+    """Key of the playable MP4 for a session manifest or whole-clip key."""
+    if key.endswith('/manifest.json'):
+        return key[:-len('manifest.json')] + 'playback.mp4'
+    return os.path.splitext(key)[0] + '/playback.mp4'
+
+
+def exists(key):
+    try:
+        s3.head_object(Bucket=s3_name, Key=key)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return False
+        raise
+    return True
+
+
+def remux(raw, framerate, output):
+    # -framerate because raw H.264 carries no timestamps, faststart for progressive playback
+    result = subprocess.run([FFMPEG, '-y', '-loglevel', 'error', '-framerate', str(framerate), '-i', raw,
+                             '-c', 'copy', '-movflags', '+faststart', output], capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg exit code {result.returncode}: {result.stderr.decode(errors='replace')}")
+
+
+def build(sources, framerate, key):
+    """Concatenate raw H.264 objects, remux them to MP4 and store it under key."""
+    with tempfile.TemporaryDirectory() as directory:
+        raw = os.path.join(directory, 'clip.h264')
+        with open(raw, 'wb') as f:
+            for source in sources:
+                f.write(s3.get_object(Bucket=s3_name, Key=source)['Body'].read())
+        output = os.path.join(directory, 'playback.mp4')
+        remux(raw, framerate, output)
+        with open(output, 'rb') as f:
+            s3.put_object(Bucket=s3_name, Key=key, Body=f.read(), ContentType='video/mp4')
+
+
+def session_sources(manifest_key):
+    """Segment keys in order once the session is complete and every segment is in S3, else None."""
+    session = json.loads(s3.get_object(Bucket=s3_name, Key=manifest_key)['Body'].read())
+    if not session.get('complete'):
+        return None, None
+    keys = [s['key'] for s in sorted(session.get('segments', []), key=lambda s: s['index'])]
+    # Segments and the manifest are spooled separately, the last segment may still be uploading
+    if not keys or not all(exists(k) for k in keys):
+        return None, None
+    return keys, session.get('framerate') or 30
+
+
+def playback_object(key):
+    """Build the playback MP4 for a new S3 object if it completes a clip, returns its key or None."""
+    info = parse_key(key)
+    if info is None or info['kind'] not in CAMERAS:
+        return None
+    if key.endswith('.h264') and key.count('/') == 5:
+        metadata = s3.head_object(Bucket=s3_name, Key=key).get('Metadata', {})
+        sources, framerate, clip = [key], metadata.get('framerate') or 30, key
+    elif key.endswith('.h264') or key.endswith('/manifest.json'):
+        # A segment or the manifest, whichever arrives last completes the session
+        clip = key if key.endswith('/manifest.json') else key.rsplit('/', 1)[0] + '/manifest.json'
+        if not exists(clip):
+            return None
+        sources, framerate = session_sources(clip)
+        if sources is None:
+            return None
+    else:
+        return None
+
+    target = playback_key(clip)
+    if exists(target):
+        return None
+    build(sources, framerate, target)
+    return target
+
+
+def playback_handler(event, context):
+    # S3 ObjectCreated notifications for picamera*/ objects
+    built = []
+    for record in event.get('Records', []):
+        key = unquote_plus(record['s3']['object']['key'])
+        try:
+            target = playback_object(key)
+        except RuntimeError as e:
+            print(f"playback of {key} failed: {e}")
+            continue
+        if target:
+            built.append(target)
+    return {
+        'statusCode': 200,
+        "body": json.dumps(f'Built {len(built)} playback files')
+    }
@@ -0,0 +1,313 @@
+import json
+import boto3
+import gzip
+import os
+import time as clock
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from botocore.exceptions import ClientError
+from S3Keys import day_prefix, list_device_day, parse_key, shard, to_datetime
+
+# Getting bucket ready, S3_ENDPOINT_URL points the job at a local stand-in
+s3 = boto3.client('s3', endpoint_url=os.environ.get('S3_ENDPOINT_URL'))
+s3_name = 'smartsafe-logs'
+
+# Status objects rolled up: single events and batch objects from ArgusBoxLambda
+SOURCES = ('raw_data', 'batch_data')
+# Objects arriving this many days late (journal replay) are still picked up
+LATE_DAYS = int(os.environ.get('ROLLUP_LATE_DAYS', '3'))
+# Raw objects older than this many days are packed into archives, 0 keeps them
+ARCHIVE_DAYS = int(os.environ.get('ROLLUP_ARCHIVE_DAYS', '0'))
+# A status holds until the next sample, but never longer than this (device offline)
+MAX_GAP = 900
+# Parallel GETs when reading raw objects
+READERS = 32
+
+CHECKPOINT_KEY = 'rollup/checkpoint.json'
+
+def get_json(key, default=None):
+    try:
+        return json.loads(s3.get_object(Bucket=s3_name, Key=key)['Body'].read())
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return default
+        raise
+
+
+def put_json(key, body):
+    s3.put_object(Bucket=s3_name, Key=key, Body=json.dumps(body, separators=(',', ':')),
+                  ContentType='application/json')
+
+
+def list_objects(prefix, start_after=None):
+    params = {"Bucket": s3_name, "Prefix": prefix}
+    if start_after:
+        params["StartAfter"] = start_after
+    for page in s3.get_paginator('list_objects_v2').paginate(**params):
+        for obj in page.get('Contents', []):
+            yield obj
+
+
+def list_prefixes(prefix):
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=s3_name, Prefix=prefix, Delimiter='/'):
+        for common in page.get('CommonPrefixes', []):
+            yield common['Prefix']
+
+
+def list_devices(kind):
+    # {kind}/{shard}/{device}/..., one delimiter listing per shard
+    devices = set()
+    for shard_prefix in list_prefixes(f"{kind}/"):
+        for device_prefix in list_prefixes(shard_prefix):
+            devices.add(device_prefix.rstrip('/').rsplit('/', 1)[1])
+    return devices
+
+
+def read_rows(key):
+    body = s3.get_object(Bucket=s3_name, Key=key)['Body'].read()
+    if key.endswith('.ndjson.gz'):
+        return [json.loads(line) for line in gzip.decompress(body).splitlines() if line]
+    if key.endswith('.json'):
+        return [json.loads(body)]
+    return []  # Parquet batches are left to Athena
+
+
+def hourly_key(device, hour_start):
+    moment = to_datetime(hour_start)
+    return f"{day_prefix('rollup_hourly', device, moment)}{moment.strftime('%H')}.json"
+
+
+def daily_key(device, day):
+    return f"{day_prefix('rollup_daily', device, day)}rollup.json"
+
+
+def aggregate(device, hour_start, rows):
+    """Hourly rollup of one device's status rows, computed over column arrays."""
+    times = np.fromiter((int(r['time']) for r in rows), dtype=np.int64, count=len(rows))
+    order = np.argsort(times, kind='stable')
+    times = times[order]
+    opened = np.array([r.get('status') == 'open' for r in rows])[order]
+    cam1 = np.array([r.get('cam1') == 'recording' for r in rows])[order]
+    cam2 = np.array([r.get('cam2') == 'recording' for r in rows])[order]
+    last_opened = np.fromiter((int(r.get('last opened') or 0) for r in rows), dtype=np.int64, count=len(rows))
+
+    # Seconds each sample's state lasted, until the next sample or the end of the hour
+    hour_end = hour_start + 3600
+    held = np.minimum(np.diff(times, append=hour_end), MAX_GAP)
+    held = np.clip(held, 0, None)
+
+    # An open is identified by its 'last opened' time
+    opens = np.unique(last_opened[(last_opened >= hour_start) & (last_opened < hour_end)]).size
+    open_seconds = int(held[opened].sum())
+    return {
+        "device": device,
+        "hour": to_datetime(hour_start).strftime('%Y-%m-%dT%H'),
+        "samples": int(times.size),
+        "opens": int(opens),
+        "open_seconds": open_seconds,
+        "mean_open_seconds": open_seconds / opens if opens else 0,
+        "cam1_seconds": int(held[cam1].sum()),
+        "cam2_seconds": int(held[cam2].sum()),
+    }
+
+
+def rollup_day(device, day):
+    # Daily totals from the hourly rollups, so a late hour only costs 24 small GETs
+    hours = [get_json(o['Key']) for o in list_device_day(s3, s3_name, 'rollup_hourly', device, day)]
+    columns = {f: np.array([h[f] for h in hours], dtype=np.int64)
+               for f in ("samples", "opens", "open_seconds", "cam1_seconds", "cam2_seconds")}
+    daily = {f: int(column.sum()) for f, column in columns.items()}
+    daily.update(device=device, day=day, hours=len(hours),
+                 mean_open_seconds=daily["open_seconds"] / daily["opens"] if daily["opens"] else 0)
+    put_json(daily_key(device, day), daily)
+
+
+def rollup_device(device, since, now, pool):
+    """
+    Recompute every hour of device that received objects modified after since.
+    Whole hours are recomputed, so re-running over the same objects is harmless.
+
+    :return: Newest LastModified seen (epoch seconds), hours rewritten, objects read.
+    """
+    window = (to_datetime(since) - timedelta(days=LATE_DAYS)).strftime('%Y-%m-%d') if since else None
+    hours = {}
+    dirty = set()
+    newest = since or 0
+    for kind in SOURCES:
+        root = f"{kind}/{shard(device)}/{device}/"
+        for obj in list_objects(root, root + window if window else None):
+            info = parse_key(obj['Key'])
+            modified = obj['LastModified'].timestamp()
+            if info is None or modified > now:
+                continue  # Written while this run lists, picked up next time
+            hour = f"{info['day']}T{info['hour']}"
+            hours.setdefault(hour, []).append(obj['Key'])
+            if modified > (since or 0):
+                dirty.add(hour)
+                newest = max(newest, modified)
+
+    read = 0
+    days = set()
+    for hour in sorted(dirty):
+        keys = hours[hour]
+        rows = [row for batch in pool.map(read_rows, keys) for row in batch]
+        read += len(keys)
+        hour_start = datetime.strptime(hour, '%Y-%m-%dT%H').replace(tzinfo=timezone.utc).timestamp()
+        rows = [r for r in rows if r.get('time') and hour_start <= int(r['time']) < hour_start + 3600]
+        if rows:
+            put_json(hourly_key(device, hour_start), aggregate(device, hour_start, rows))
+            days.add(hour[:10])
+
+    for day in sorted(days):
+        rollup_day(device, day)
+    return newest, len(dirty), read
+
+
+def archive_device(device, cutoff, pool):
+    """Pack raw objects from days before cutoff into one gzip NDJSON archive per day, then delete them."""
+    packed = 0
+    for kind in SOURCES:
+        root = f"{kind}/{shard(device)}/{device}/"
+        days = {}
+        for obj in list_objects(root):
+            info = parse_key(obj['Key'])
+            if info is None:
+                continue
+            if info['day'] >= cutoff:
+                break  # Keys sort by day
+            days.setdefault(info['day'], []).append(obj['Key'])
+
+        for day, keys in sorted(days.items()):
+            archive_key = f"{day_prefix('archive', device, day)}{kind}.ndjson.gz"
+            # Merge with an archive left by a run that stopped before deleting
+            lines = {}
+            try:
+                body = s3.get_object(Bucket=s3_name, Key=archive_key)['Body'].read()
+                for line in gzip.decompress(body).splitlines():
+                    lines[json.loads(line)['key']] = line
+            except ClientError as e:
+                if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+                    raise
+            for key, rows in zip(keys, pool.map(read_rows, keys)):
+                lines[key] = json.dumps({"key": key, "rows": rows}, separators=(',', ':')).encode()
+            s3.put_object(Bucket=s3_name, Key=archive_key,
+                          Body=gzip.compress(b"\n".join(lines.values()) + b"\n", compresslevel=9))
+            for i in range(0, len(keys), 1000):
+                s3.delete_objects(Bucket=s3_name,
+                                  Delete={"Objects": [{"Key": k} for k in keys[i:i + 1000]], "Quiet": True})
+            packed += len(keys)
+    return packed
+
+
+def run(now=None):
+    """One incremental pass over every device, checkpointed per device so it resumes after a crash."""
+    # Objects from the last minute wait for the next run, LastModified has one second resolution
+    now = now or clock.time() - 60
+    checkpoint = get_json(CHECKPOINT_KEY, {"devices": {}})
+    devices = set().union(*(list_devices(kind) for kind in SOURCES))
+    stats = {"devices": len(devices), "hours": 0, "read": 0, "archived": 0}
+    with ThreadPoolExecutor(READERS) as pool:
+        for device in sorted(devices):
+            since = checkpoint["devices"].get(device)
+            newest, hours, read = rollup_device(device, since, now, pool)
+            if ARCHIVE_DAYS:
+                cutoff = (to_datetime(now) - timedelta(days=max(ARCHIVE_DAYS, LATE_DAYS + 1))).strftime('%Y-%m-%d')
+                stats["archived"] += archive_device(device, cutoff, pool)
+            stats["hours"] += hours
+            stats["read"] += read
+            if newest != since:
+                checkpoint["devices"][device] = newest
+                put_json(CHECKPOINT_KEY, checkpoint)
+    return stats
+
+
+def rollup_handler(event, context):
+    # Scheduled (e.g. hourly EventBridge rule)
+    begin = clock.perf_counter()
+    stats = run()
+    stats["seconds"] = round(clock.perf_counter() - begin, 2)
+    return {
+        'statusCode': 200,
+        "body": json.dumps(stats)
+    }
+
+
+if __name__ == '__main__':
+    # Local benchmark: a month of change-driven telemetry from 5 safes (20 opens a day
+    # plus 5 minute heartbeats) in an in-memory S3 stand-in. Full run, incremental
+    # run after one new hour, then an idempotent re-run.
+    import io
+    import random
+    from S3Keys import object_key
+
+    class MemoryS3:
+        def __init__(self):
+            self.objects = {}
+            self.gets = 0
+            self.lists = 0
+
+        def put_object(self, Bucket, Key, Body, **kwargs):
+            body = Body.encode() if isinstance(Body, str) else Body
+            self.objects[Key] = (body, datetime.now(timezone.utc))
+
+        def get_object(self, Bucket, Key):
+            self.gets += 1
+            if Key not in self.objects:
+                raise ClientError({"Error": {"Code": "NoSuchKey"}}, 'GetObject')
+            return {"Body": io.BytesIO(self.objects[Key][0])}
+
+        def delete_objects(self, Bucket, Delete):
+            for obj in Delete["Objects"]:
+                self.objects.pop(obj["Key"], None)
+
+        def get_paginator(self, name):
+            return self
+
+        def paginate(self, Bucket, Prefix, StartAfter='', Delimiter=None):
+            self.lists += 1
+            keys = sorted(k for k in self.objects if k.startswith(Prefix) and k > StartAfter)
+            if Delimiter:
+                prefixes = sorted({Prefix + k[len(Prefix):].split(Delimiter)[0] + Delimiter for k in keys})
+                yield {"CommonPrefixes": [{"Prefix": p} for p in prefixes]}
+                return
+            for i in range(0, len(keys), 1000):
+                yield {"Contents": [{"Key": k, "LastModified": self.objects[k][1]} for k in keys[i:i + 1000]]}
+
+    def emit(device, t, status, last_opened):
+        event = {"device": device, "time": t, "status": status, "last opened": last_opened,
+                 "cam1": "recording" if status == "open" else "standby", "cam2": "standby"}
+        s3.put_object(Bucket=s3_name, Key=object_key('raw_data', device, t), Body=json.dumps(event))
+
+    random.seed(1)
+    s3 = MemoryS3()
+    end = int(clock.time()) // 86400 * 86400 - 86400
+    start = end - 30 * 86400
+    for d in range(5):
+        device = f"safe-{d:02d}"
+        opens = sorted(random.sample(range(start, end, 60), 600))
+        t, i, last = start, 0, 0
+        while t < end:
+            if i < len(opens) and opens[i] <= t:
+                last = opens[i]
+                emit(device, last, "open", last)
+                emit(device, last + random.randint(10, 120), "closed", last)
+                i += 1
+            emit(device, t, "closed", last)
+            t += 300
+    print(f"{len(s3.objects)} raw objects")
+
+    for label in ("full", "incremental", "re-run"):
+        if label == "incremental":
+            emit("safe-00", end + 10, "open", end + 10)
+            emit("safe-00", end + 70, "closed", end + 10)
+        s3.gets = s3.lists = 0
+        begin = clock.perf_counter()
+        stats = run(now=clock.time() + 1)
+        elapsed = clock.perf_counter() - begin
+        print(f"{label}: {elapsed:.2f} s, {stats['hours']} hours rewritten, {stats['read']} objects read, "
+              f"{s3.gets} GETs, {s3.lists} LISTs")
+
+    day = get_json(daily_key("safe-00", start + 15 * 86400))
+    print(f"safe-00 {day['day']}: {day['opens']} opens, mean open {day['mean_open_seconds']:.0f} s, "
+          f"cam1 {day['cam1_seconds'] / 60:.0f} min")
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Cloud modules import each other by file name, as when deployed as a Lambda bundle
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
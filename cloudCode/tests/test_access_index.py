@@ -0,0 +1,63 @@
+import io
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("boto3")
+from botocore.exceptions import ClientError
+import AccessIndex
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+        self.gets = []
+        self.lock = threading.Lock()
+
+    def get_object(self, Bucket, Key):
+        with self.lock:
+            self.gets.append(Key)
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        return {"Body": io.BytesIO(self.objects[Key]), "ETag": '"1"'}
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    s3 = FakeS3()
+    monkeypatch.setattr(AccessIndex, "s3", s3)
+    return s3
+
+
+def add_day(s3, days_ago, opens):
+    day = datetime.now(timezone.utc).date() - timedelta(days=days_ago)
+    midnight = datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp()
+    manifest = AccessIndex.empty_manifest("safe-01", day.isoformat())
+    manifest["episodes"] = [[midnight + t, midnight + t + 60, 60, []] for t in opens]
+    s3.objects[AccessIndex.manifest_key("safe-01", day.isoformat())] = json.dumps(manifest).encode()
+    return midnight
+
+
+def test_last_is_answered_by_the_first_batch(s3):
+    midnight = add_day(s3, 0, [100, 200, 300])
+    accesses = AccessIndex.query("safe-01", last=2)
+    assert [a["open"] for a in accesses] == [midnight + 300, midnight + 200]
+    assert len(s3.gets) == AccessIndex.READERS
+
+
+def test_last_walks_back_in_batches(s3):
+    today = add_day(s3, 0, [100])
+    older = add_day(s3, 10, [100, 200])
+    accesses = AccessIndex.query("safe-01", last=2)
+    assert [a["open"] for a in accesses] == [today + 100, older + 200]
+    assert len(s3.gets) == 2 * AccessIndex.READERS
+
+
+def test_last_stops_at_max_days(s3, monkeypatch):
+    monkeypatch.setattr(AccessIndex, "MAX_DAYS", 10)
+    add_day(s3, 0, [100])
+    add_day(s3, 12, [100])
+    assert len(AccessIndex.query("safe-01", last=5)) == 1
+    assert len(s3.gets) == 10
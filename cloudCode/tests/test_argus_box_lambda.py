@@ -0,0 +1,95 @@
+import base64
+import gzip
+import json
+
+import pytest
+
+pytest.importorskip("boto3")
+import ArgusBoxLambda
+
+TIME = 1_760_000_000
+ROWS = [[TIME, "open", "recording", "standby", TIME - 30],
+        [TIME + 5, "closed", "standby", "standby", TIME - 30]]
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[Key] = Body
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    s3 = FakeS3()
+    monkeypatch.setattr(ArgusBoxLambda, "s3", s3)
+    return s3
+
+
+def iot_rule(body):
+    # What the IoT rule SELECT encode(*, 'base64') AS data hands the Lambda
+    return {"data": base64.b64encode(body).decode()}
+
+
+def batch_rows(s3):
+    rows = []
+    for key, body in sorted(s3.objects.items()):
+        assert key.startswith("batch_data/")
+        rows += [json.loads(line) for line in gzip.decompress(body).splitlines()]
+    return rows
+
+
+def check_rows(rows):
+    assert [(r["device"], r["time"], r["status"], r["cam1"], r["duration"]) for r in rows] == [
+        ("safe-01", TIME, "open", "recording", 30),
+        ("safe-01", TIME + 5, "closed", "standby", 35),
+    ]
+
+
+def test_msgpack_batch(s3):
+    msgpack = pytest.importorskip("msgpack")
+    body = msgpack.packb({"v": 1, "device": "safe-01", "e": ROWS})
+    assert ArgusBoxLambda.lambda_handler(iot_rule(body), None)["statusCode"] == 200
+    check_rows(batch_rows(s3))
+
+
+def test_cbor_batch(s3):
+    cbor2 = pytest.importorskip("cbor2")
+    body = cbor2.dumps({"v": 1, "device": "safe-01", "e": ROWS})
+    assert ArgusBoxLambda.lambda_handler(iot_rule(body), None)["statusCode"] == 200
+    check_rows(batch_rows(s3))
+
+
+def test_binary_kinesis_and_sqs_records(s3):
+    msgpack = pytest.importorskip("msgpack")
+    cbor2 = pytest.importorskip("cbor2")
+    event = {"Records": [
+        {"kinesis": {"data": base64.b64encode(msgpack.packb({"v": 1, "device": "safe-01", "e": ROWS[:1]})).decode()}},
+        {"body": base64.b64encode(cbor2.dumps({"v": 1, "device": "safe-01", "e": ROWS[1:]})).decode()},
+    ]}
+    assert ArgusBoxLambda.lambda_handler(event, None)["statusCode"] == 200
+    check_rows(batch_rows(s3))
+
+
+def test_binary_alert(s3):
+    cbor2 = pytest.importorskip("cbor2")
+    alert = {"event": "safe-01_cam1_1760000000000", "camera": "cam1", "snapshot": "snapshots/x.jpg"}
+    body = cbor2.dumps(dict(zip(ArgusBoxLambda.FIELDS, ROWS[0]), v=1, device="safe-01", alert=alert))
+    assert ArgusBoxLambda.lambda_handler(iot_rule(body), None)["statusCode"] == 200
+    (key, stored), = s3.objects.items()
+    assert key.startswith("alerts/")
+    assert json.loads(stored) == dict(zip(ArgusBoxLambda.FIELDS, ROWS[0]), **alert, device="safe-01")
+
+
+def test_json_through_binary_rule(s3):
+    body = json.dumps({"v": 1, "device": "safe-01", "e": ROWS}).encode()
+    assert ArgusBoxLambda.lambda_handler(iot_rule(body), None)["statusCode"] == 200
+    check_rows(batch_rows(s3))
+
+
+def test_rejects_unknown_payloads(s3):
+    assert ArgusBoxLambda.lambda_handler(iot_rule(b"\x01\x02"), None)["statusCode"] == 400
+    body = json.dumps({"v": 2, "device": "safe-01", "e": ROWS}).encode()
+    assert ArgusBoxLambda.lambda_handler(iot_rule(body), None)["statusCode"] == 400
+    assert s3.objects == {}
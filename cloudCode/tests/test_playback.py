@@ -0,0 +1,111 @@
+import io
+import json
+import os
+import re
+import shutil
+import subprocess
+
+import pytest
+
+pytest.importorskip("boto3")
+from botocore.exceptions import ClientError
+import Playback
+
+FFMPEG = shutil.which(Playback.FFMPEG)
+pytestmark = pytest.mark.skipif(FFMPEG is None, reason="needs ffmpeg, set FFMPEG")
+
+FOLDER = "picamera1/ab/safe-01/2025-10-09/08/picam1_1760000000000_0123abcd"
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        return {"Body": io.BytesIO(self.objects[Key])}
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        return {"Metadata": {}}
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    s3 = FakeS3()
+    monkeypatch.setattr(Playback, "s3", s3)
+    return s3
+
+
+def h264(tmp_path, seconds):
+    # A raw stream starting with a keyframe and SPS/PPS, no B-frames, like each device segment
+    path = tmp_path / f"{len(os.listdir(tmp_path))}.h264"
+    subprocess.run([FFMPEG, "-v", "error", "-f", "lavfi", "-i", "testsrc=size=160x120:rate=10",
+                    "-t", str(seconds), "-c:v", "libx264", "-bf", "0", "-f", "h264", str(path)], check=True)
+    return path.read_bytes()
+
+
+def frames(tmp_path, mp4):
+    path = tmp_path / "out.mp4"
+    path.write_bytes(mp4)
+    result = subprocess.run([FFMPEG, "-i", str(path), "-f", "null", "-"], capture_output=True, text=True)
+    return int(re.findall(r"frame= *(\d+)", result.stderr)[-1])
+
+
+def add_session(s3, tmp_path, complete=True, missing=()):
+    segments = []
+    for index in range(3):
+        key = f"{FOLDER}/picam1_log_{index:05d}.h264"
+        if index not in missing:
+            s3.objects[key] = h264(tmp_path, 1)
+        segments.append({"key": key, "index": index, "start": 0, "duration": 1.0, "size": 0})
+    manifest = {"framerate": 10, "format": "h264", "complete": complete, "segments": segments[::-1]}
+    s3.objects[f"{FOLDER}/manifest.json"] = json.dumps(manifest).encode()
+
+
+def notify(*keys):
+    return {"Records": [{"s3": {"object": {"key": key}}} for key in keys]}
+
+
+def test_complete_session_becomes_one_mp4(s3, tmp_path):
+    add_session(s3, tmp_path)
+    Playback.playback_handler(notify(f"{FOLDER}/manifest.json"), None)
+    mp4 = s3.objects[f"{FOLDER}/playback.mp4"]
+    assert mp4[4:8] == b"ftyp"
+    assert mp4.index(b"moov") < mp4.index(b"mdat")
+    assert frames(tmp_path, mp4) == 30
+
+
+def test_waits_for_completion_and_the_last_segment(s3, tmp_path):
+    add_session(s3, tmp_path, complete=False)
+    Playback.playback_handler(notify(f"{FOLDER}/manifest.json"), None)
+    assert f"{FOLDER}/playback.mp4" not in s3.objects
+
+    last = f"{FOLDER}/picam1_log_00002.h264"
+    del s3.objects[last]
+    add_session(s3, tmp_path, missing=(2,))
+    Playback.playback_handler(notify(f"{FOLDER}/manifest.json"), None)
+    assert f"{FOLDER}/playback.mp4" not in s3.objects
+
+    s3.objects[last] = h264(tmp_path, 1)
+    Playback.playback_handler(notify(last), None)
+    assert frames(tmp_path, s3.objects[f"{FOLDER}/playback.mp4"]) == 30
+
+
+def test_whole_raw_clip(s3, tmp_path):
+    key = FOLDER + ".h264"
+    s3.objects[key] = h264(tmp_path, 2)
+    Playback.playback_handler(notify(key), None)
+    assert Playback.playback_key(key) == f"{FOLDER}/playback.mp4"
+    assert frames(tmp_path, s3.objects[f"{FOLDER}/playback.mp4"]) == 20
+
+
+def test_ignores_other_objects(s3, tmp_path):
+    s3.objects[FOLDER + ".mp4"] = b"mp4"
+    assert Playback.playback_handler(notify(FOLDER + ".mp4", "batch_data/ab/safe-01/x.json"), None)["statusCode"] == 200
+    assert set(s3.objects) == {FOLDER + ".mp4"}
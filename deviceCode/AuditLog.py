@@ -0,0 +1,334 @@
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+# Segment header: magic, version, records per segment, segment number
+HEADER = struct.Struct('<4sIII')
+HEADER_SIZE = 64
+MAGIC = b'SSA1'
+VERSION = 1
+
+# Record: sequence, wall time, monotonic time, event type, small argument,
+# value, data (zero padded), crc32 of the preceding bytes
+RECORD = struct.Struct('<QddHHi20sI')
+CRC = struct.Struct('<I')
+CRC_OFFSET = RECORD.size - CRC.size
+
+# Bulk export: magic, version, record size, then raw records
+EXPORT_HEADER = struct.Struct('<4sHH')
+EXPORT_MAGIC = b'SSAX'
+
+# One time index entry per this many records
+INDEX_EVERY = 64
+
+# Event types
+PIN_ACCEPTED = 1
+PIN_REJECTED = 2
+OPENED = 3
+CLOSED = 4
+SOLENOID = 5
+RECORDING_STARTED = 6
+RECORDING_STOPPED = 7
+PIN_LOCKED = 8
+
+EVENT_NAMES = {
+    PIN_ACCEPTED: "pin_accepted",
+    PIN_REJECTED: "pin_rejected",
+    OPENED: "opened",
+    CLOSED: "closed",
+    SOLENOID: "solenoid",
+    RECORDING_STARTED: "recording_started",
+    RECORDING_STOPPED: "recording_stopped",
+    PIN_LOCKED: "pin_locked",
+}
+
+Event = namedtuple('Event', ['seq', 'time', 'monotonic', 'type', 'arg', 'value', 'data'])
+
+
+def decode_record(buf, offset, seq=None):
+    """Event at offset, or None if the CRC or the expected sequence does not match."""
+    fields = RECORD.unpack_from(buf, offset)
+    if seq is not None and fields[0] != seq:
+        return None
+    if fields[-1] != zlib.crc32(buf[offset:offset + CRC_OFFSET]):
+        return None
+    return Event(*fields[:6], fields[6].rstrip(b'\0'))
+
+
+def decode_export(blob):
+    """Events from an export() blob, records failing their CRC are dropped."""
+    magic, version, size = EXPORT_HEADER.unpack_from(blob, 0)
+    if magic != EXPORT_MAGIC or version != VERSION or size != RECORD.size:
+        raise ValueError('not an audit log export')
+    events = []
+    for offset in range(EXPORT_HEADER.size, len(blob) - size + 1, size):
+        event = decode_record(blob, offset)
+        if event is not None:
+            events.append(event)
+    return events
+
+
+class Segment:
+    def __init__(self, path, number, capacity, create=False):
+        """One preallocated, memory-mapped file of capacity record slots."""
+        self.path = path
+        self.number = number
+        size = HEADER_SIZE + capacity * RECORD.size
+        fresh = create and not (os.path.exists(path) and os.path.getsize(path) == size)
+        self.fd = os.open(path, os.O_RDWR | (os.O_CREAT if create else 0))
+        if fresh:
+            os.ftruncate(self.fd, size)
+        elif os.fstat(self.fd).st_size != size:
+            os.close(self.fd)
+            raise ValueError(f'{path}: wrong size for {capacity} records')
+        self.map = mmap.mmap(self.fd, size)
+        self.view = memoryview(self.map)
+        if fresh:
+            HEADER.pack_into(self.map, 0, MAGIC, VERSION, capacity, number)
+            self.map.flush(0, min(mmap.PAGESIZE, size))
+        elif HEADER.unpack_from(self.map, 0) != (MAGIC, VERSION, capacity, number):
+            self.close()
+            raise ValueError(f'{path}: bad header')
+
+    def close(self):
+        self.view.release()
+        self.map.close()
+        os.close(self.fd)
+
+
+class AuditLog:
+    def __init__(self, directory, capacity=8192, max_segments=8, sync=True):
+        """
+        Access events as fixed-width, CRC-checked records in preallocated
+        memory-mapped segment files. Segment n holds sequences n * capacity up to
+        (n + 1) * capacity, the oldest segment is deleted beyond max_segments.
+        A torn record from a crash fails its CRC and is overwritten on restart.
+
+        :param directory: Segment directory, created if missing.
+        :param capacity: Records per segment file.
+        :param max_segments: Segment files kept.
+        :param sync: msync every record, so events survive a power cut and not just a crash.
+        """
+        self.directory = directory
+        self.capacity = capacity
+        self.max_segments = max_segments
+        self.sync = sync
+        self.lock = threading.Lock()
+        self.segments = {}
+
+        # Sparse time index: at every INDEX_EVERY-th sequence, the latest wall time of
+        # all records before it. Kept non-decreasing, so it stays sorted if the clock steps back.
+        self.index_times = []
+        self.index_seqs = []
+        self.latest = 0.0
+        # Last sequence written with a time before an earlier record's, times only rise after it
+        self.stepped_back = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self.synced_path = os.path.join(directory, 'synced')
+        self.synced = 0
+        if os.path.exists(self.synced_path):
+            with open(self.synced_path) as f:
+                self.synced = int(f.read().strip() or 0)
+
+        numbers = sorted(int(name[6:-4]) for name in os.listdir(directory)
+                         if name.startswith('audit_') and name.endswith('.log') and name[6:-4].isdigit())
+        self.first = numbers[0] * capacity if numbers else 0
+        self.head = self.first
+        for number in numbers:
+            self.recover(number)
+        self.current = self.segment(self.head // capacity, create=True)
+
+    def path(self, number):
+        return os.path.join(self.directory, f'audit_{number:06d}.log')
+
+    def segment(self, number, create=False):
+        segment = self.segments.get(number)
+        if segment is None:
+            segment = self.segments[number] = Segment(self.path(number), number, self.capacity, create)
+        return segment
+
+    def recover(self, number):
+        # Valid records continue the sequence until the first empty or torn slot
+        try:
+            segment = self.segment(number)
+        except ValueError as e:
+            print(f"audit: skipping {e}")
+            return
+        seq = number * self.capacity
+        if seq != self.head:
+            return
+        for slot in range(self.capacity):
+            event = decode_record(segment.view, HEADER_SIZE + slot * RECORD.size, seq)
+            if event is None:
+                break
+            self.indexed(seq, event.time)
+            seq += 1
+        self.head = seq
+
+    def indexed(self, seq, wall):
+        if seq % INDEX_EVERY == 0:
+            self.index_times.append(self.latest)
+            self.index_seqs.append(seq)
+        if wall > self.latest:
+            self.latest = wall
+        elif wall < self.latest:
+            self.stepped_back = seq
+
+    def append(self, event_type, value=0, arg=0, data=b''):
+        """
+        Store one event and return its sequence number. O(1), records are packed
+        straight into the mapped file.
+
+        :param event_type: One of the event type constants.
+        :param value: Signed 32-bit number, e.g. a PIN length.
+        :param arg: Unsigned 16-bit number, e.g. a camera index.
+        :param data: Up to 20 bytes, longer data is cut.
+        """
+        with self.lock:
+            seq = self.head
+            if seq // self.capacity != self.current.number:
+                self.rotate(seq // self.capacity)
+            offset = HEADER_SIZE + (seq % self.capacity) * RECORD.size
+            wall = time.time()
+            RECORD.pack_into(self.current.map, offset, seq, wall, time.monotonic(), event_type, arg, value, data, 0)
+            CRC.pack_into(self.current.map, offset + CRC_OFFSET,
+                          zlib.crc32(self.current.view[offset:offset + CRC_OFFSET]))
+            if self.sync:
+                # msync wants a page-aligned start
+                start = offset - offset % mmap.PAGESIZE
+                self.current.map.flush(start, offset + RECORD.size - start)
+            self.head = seq + 1
+            self.indexed(seq, wall)
+            return seq
+
+    def rotate(self, number):
+        self.current = self.segment(number, create=True)
+        # Drop segments beyond max_segments, with their index entries
+        first = (number - self.max_segments + 1) * self.capacity
+        for old in [n for n in self.segments if n * self.capacity < first]:
+            self.segments.pop(old).close()
+        for name in os.listdir(self.directory):
+            if name.startswith('audit_') and name.endswith('.log') and name[6:-4].isdigit():
+                if int(name[6:-4]) * self.capacity < first:
+                    os.remove(os.path.join(self.directory, name))
+        if first > self.first:
+            self.first = first
+            drop = bisect.bisect_left(self.index_seqs, first)
+            del self.index_times[:drop]
+            del self.index_seqs[:drop]
+
+    def events(self, start, end=None):
+        """Events with sequence numbers from start up to end (exclusive), oldest first."""
+        with self.lock:
+            start = max(start, self.first)
+            end = self.head if end is None else min(end, self.head)
+            events = []
+            for seq in range(start, end):
+                segment = self.segment(seq // self.capacity)
+                event = decode_record(segment.view, HEADER_SIZE + (seq % self.capacity) * RECORD.size, seq)
+                if event is not None:
+                    events.append(event)
+            return events
+
+    def query(self, start=None, end=None, types=None):
+        """
+        Events with wall time in [start, end], found through the time index.
+
+        :param start: Epoch seconds, None for the oldest record kept.
+        :param end: Epoch seconds, None for now.
+        :param types: Optional set of event types to keep.
+        """
+        with self.lock:
+            seq = self.first
+            if start is not None:
+                # Last index entry with every earlier record before start
+                i = bisect.bisect_left(self.index_times, start) - 1
+                if i >= 0:
+                    seq = max(seq, self.index_seqs[i])
+            head = self.head
+            stepped_back = self.stepped_back
+        events = []
+        while seq < head:
+            batch = self.events(seq, min(head, seq + INDEX_EVERY))
+            seq += INDEX_EVERY
+            for event in batch:
+                if end is not None and event.time > end:
+                    if event.seq >= stepped_back:
+                        return events
+                    continue
+                if (start is None or event.time >= start) and (types is None or event.type in types):
+                    events.append(event)
+        return events
+
+    def last(self, seconds, types=None):
+        """Events from the last seconds, e.g. last(3600) for the last hour."""
+        return self.query(time.time() - seconds, types=types)
+
+    def export(self, since=0, limit=65536):
+        """
+        Raw records for bulk sync: a small header, then CRC-checked records as stored.
+
+        :param since: First sequence number to include.
+        :return: (next sequence to export, blob), the blob has no records when caught up.
+        """
+        with self.lock:
+            since = max(since, self.first)
+            end = min(self.head, since + limit)
+            parts = [EXPORT_HEADER.pack(EXPORT_MAGIC, VERSION, RECORD.size)]
+            for seq in range(since, end):
+                segment = self.segment(seq // self.capacity)
+                offset = HEADER_SIZE + (seq % self.capacity) * RECORD.size
+                parts.append(segment.view[offset:offset + RECORD.size].tobytes())
+        return end, b''.join(parts)
+
+    def mark_synced(self, seq):
+        """Record that everything before seq has been exported and stored elsewhere."""
+        with self.lock:
+            if seq <= self.synced:
+                return
+            self.synced = seq
+            tmp = self.synced_path + '.tmp'
+            with open(tmp, 'w') as f:
+                f.write(str(seq))
+            os.replace(tmp, self.synced_path)
+
+    def close(self):
+        with self.lock:
+            for segment in self.segments.values():
+                segment.close()
+            self.segments = {}
+
+
+if __name__ == '__main__':
+    # Append cost and a last-hour query over a full log (python AuditLog.py [records])
+    import sys
+    import tempfile
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 60000
+    directory = tempfile.mkdtemp(prefix='audit_bench_')
+    for sync in (False, True):
+        log = AuditLog(os.path.join(directory, f'sync{int(sync)}'), sync=sync)
+        n = count if not sync else count // 10
+        start = time.perf_counter()
+        for i in range(n):
+            log.append(OPENED if i % 2 else CLOSED, i, 1, b'bench')
+        per = (time.perf_counter() - start) / n
+        print(f"append (sync={sync}): {per * 1e6:.1f} us/record, {n} records")
+        start = time.perf_counter()
+        recent = log.last(3600)
+        print(f"last hour: {len(recent)} events in {(time.perf_counter() - start) * 1000:.1f} ms")
+        start = time.perf_counter()
+        recent = log.query(time.time() - 0.001)
+        print(f"last ms: {len(recent)} events in {(time.perf_counter() - start) * 1000:.2f} ms")
+        next_seq, blob = log.export(log.synced)
+        assert len(decode_export(blob)) == next_seq - max(log.synced, log.first)
+        log.close()
+        reopened = AuditLog(os.path.join(directory, f'sync{int(sync)}'), sync=sync)
+        print(f"reopened: head {reopened.head}, first {reopened.first}, export {len(blob)} bytes")
+        reopened.close()
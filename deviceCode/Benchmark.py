@@ -0,0 +1,222 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import Simulation
+
+# End-to-end latency benchmark on simulated hardware. Scripts an access (code
+# entry, safe opened, safe closed) against the full SmartSafe and reports
+# key-to-LCD and trigger-to-record latency, process CPU, I2C traffic and upload
+# throughput. Results are JSON so runs can be saved and compared:
+#
+#   python Benchmark.py --save baseline.json
+#   python Benchmark.py --compare baseline.json
+#
+# CPU includes the simulators (frame generation, fake I2C timing), so compare
+# runs made on the same machine only.
+
+KEY_HOLD = 0.15  # Long enough for one keypad poll, short enough not to repeat
+
+
+def summary(latencies):
+    """p50, p95 and max of a list of seconds, in milliseconds."""
+    if not latencies:
+        return None
+    values = sorted(latencies)
+    return {"n": len(values),
+            "p50_ms": round(1000 * values[len(values) // 2], 2),
+            "p95_ms": round(1000 * values[min(len(values) - 1, int(len(values) * 0.95))], 2),
+            "max_ms": round(1000 * values[-1], 2)}
+
+
+class Phase:
+    def __init__(self, sim):
+        """Process CPU and I2C transactions over one part of the scenario."""
+        self.sim = sim
+        self.wall = time.monotonic()
+        self.cpu = time.process_time()
+        self.i2c = sim.bus.transactions
+
+    def result(self):
+        wall = time.monotonic() - self.wall
+        return {"seconds": round(wall, 2),
+                "cpu_pct": round(100 * (time.process_time() - self.cpu) / wall, 1),
+                "i2c_per_sec": round((self.sim.bus.transactions - self.i2c) / wall, 1)}
+
+
+def wait_until(condition, timeout, interval=0.001):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(interval)
+    return True
+
+
+def enter_code(sim, code):
+    """Type code on the keypad, returns the key-to-LCD latency of each key that changed the screen."""
+    latencies = []
+    buffer = ""
+    for key in code:
+        if key == '#':
+            expected = lambda lines: lines[1].rstrip() == "Access Granted"
+        else:
+            buffer += key
+            expected = lambda lines, text=buffer: lines[0].rstrip() == "Enter Password:" and lines[1].rstrip() == text
+        pressed = time.monotonic()
+        sim.keypad.press(key)
+        shown = sim.lcd.wait_for(expected, pressed, timeout=2.0)
+        time.sleep(max(0.0, pressed + KEY_HOLD - time.monotonic()))
+        sim.keypad.release(key)
+        if shown is None:
+            print(f"Key {key}: display never updated")
+        else:
+            latencies.append(shown - pressed)
+        time.sleep(0.1)
+    return latencies
+
+
+def run(keypad_mode="interrupt", segment_seconds=0, idle_seconds=3.0, open_seconds=3.0,
+        s3_bandwidth=2_000_000, instrumented=False, camera_open_seconds=0.0):
+    int_pin = 22 if keypad_mode == "interrupt" else None
+    sim = Simulation.install(keypad_int_pin=int_pin, s3_bandwidth=s3_bandwidth)
+    Simulation.SimPicamera2.open_delay = camera_open_seconds
+    workdir = tempfile.mkdtemp(prefix='smartsafe_bench_')
+    os.chdir(workdir)
+    os.environ['SMARTSAFE_SPOOL_DIR'] = os.path.join(workdir, 'spool')
+    os.environ['SMARTSAFE_AUDIT_DIR'] = os.path.join(workdir, 'audit')
+    os.environ['SMARTSAFE_CREDENTIALS'] = os.path.join(workdir, 'credentials.json')
+    os.environ['SMARTSAFE_PIN_INDEX_KEY'] = os.path.join(workdir, 'pin_index.key')
+    os.environ['SMARTSAFE_DEFAULT_PIN'] = "12345678"
+
+    from SmartSafe import SmartSafe
+    from Telemetry import Telemetry
+    from Metrics import metrics
+    if instrumented:
+        metrics.enable()
+
+    smartsafe = SmartSafe(keypad_int_pin=int_pin, clip_seconds=2, quiet_period=1, max_session=30,
+                          segment_seconds=segment_seconds, device_id='bench')
+    telemetry = Telemetry(lambda payload: sim.mqtt.publish('devices/smartsafe/status', payload, 1)[0],
+                          device=smartsafe.device_id, coalesce=0.1, report_interval=3600)
+    smartsafe.on_snapshot = telemetry.alert
+    smartsafe.loop.add_listener(lambda event, data: telemetry.update(
+        smartsafe.get_state(), smartsafe.get_cam1(), smartsafe.get_cam2()))
+    threading.Thread(target=telemetry.run, daemon=True).start()
+    smartsafe.start()
+    threading.Thread(target=smartsafe.loop.run, daemon=True).start()
+
+    def cameras_idle():
+        return smartsafe.camera_idle(smartsafe.cam1_future) and smartsafe.camera_idle(smartsafe.cam2_future)
+
+    results = {"config": {"keypad": keypad_mode, "segment_seconds": segment_seconds,
+                          "s3_bandwidth": s3_bandwidth, "metrics": instrumented,
+                          "camera_open_seconds": camera_open_seconds}}
+    i2c_start = sim.bus.transactions
+    sim.lcd.wait_for(lambda lines: lines[0].startswith("Enter Password:"), timeout=5.0)
+
+    phase = Phase(sim)
+    time.sleep(idle_seconds)
+    results["idle"] = phase.result()
+
+    phase = Phase(sim)
+    results["key_to_lcd"] = summary(enter_code(sim, "12345678#"))
+    results["solenoid_unlocked"] = wait_until(sim.solenoid_on, 1.0)
+    results["keypad"] = phase.result()
+
+    # Key presses start camera 1, the open is measured from idle cameras
+    smartsafe.startup.wait("cameras", 30.0)
+    wait_until(cameras_idle, 30.0, 0.05)
+    phase = Phase(sim)
+    tilted = time.monotonic()
+    sim.tilt(True)
+    record = []
+    for camera in (smartsafe.camera1, smartsafe.camera2):
+        if wait_until(lambda: camera.recording, 5.0):
+            record.append(time.monotonic() - tilted)
+    results["trigger_to_record"] = summary(record)
+    time.sleep(open_seconds)
+    sim.tilt(False)
+    results["camera_trigger_latency"] = summary([camera.trigger_latency
+                                                 for camera in (smartsafe.camera1, smartsafe.camera2)
+                                                 if camera.trigger_latency is not None])
+    wait_until(cameras_idle, 30.0, 0.05)
+    wait_until(lambda: smartsafe.spool.stats()["pending"] == 0, 60.0, 0.05)
+    results["open"] = phase.result()
+
+    results["i2c_transactions"] = sim.bus.transactions - i2c_start
+    results["upload"] = {"objects": sim.s3.uploads, "bytes": sim.s3.bytes,
+                         "throughput_kib_s": round(sim.s3.throughput() / 1024, 1),
+                         "snapshot_to_s3": summary(smartsafe.snapshot_latencies)}
+    results["mqtt_messages"] = len(sim.mqtt.messages)
+    results["audit_events"] = len(smartsafe.audit.last(3600))
+    report = smartsafe.startup.report()
+    results["startup"] = {"accepting_keys_s": round(report["milestones"]["accepting_keys"], 3),
+                          "target_met": report["met"],
+                          "stages_s": {name: round(stage["seconds"], 3)
+                                       for name, stage in report["stages"].items() if stage["seconds"] is not None}}
+    if instrumented:
+        spans = json.loads(metrics.to_message())["spans"]
+        results["spans"] = {name: {"n": span["n"], "mean_ms": round(1000 * span["s"] / span["n"], 3)}
+                            for name, span in spans.items()}
+
+    smartsafe.cleanup()
+    return results
+
+
+def flatten(results, prefix=""):
+    values = {}
+    for name, value in results.items():
+        if isinstance(value, dict):
+            values.update(flatten(value, f"{prefix}{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[prefix + name] = value
+    return values
+
+
+def compare(baseline, current):
+    # Settings are not metrics
+    old, new = (flatten({k: v for k, v in r.items() if k != "config"}) for r in (baseline, current))
+    for name in sorted(set(old) | set(new)):
+        if name not in old or name not in new:
+            print(f"{name}: {old.get(name, '-')} -> {new.get(name, '-')}")
+            continue
+        change = f"{100 * (new[name] - old[name]) / old[name]:+.1f}%" if old[name] else ""
+        print(f"{name}: {old[name]} -> {new[name]} {change}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="SmartSafe benchmark on simulated hardware")
+    parser.add_argument('--keypad', choices=('interrupt', 'poll'), default='interrupt')
+    parser.add_argument('--segment-seconds', type=float, default=0)
+    parser.add_argument('--idle-seconds', type=float, default=3.0)
+    parser.add_argument('--open-seconds', type=float, default=3.0)
+    parser.add_argument('--s3-bandwidth', type=int, default=2_000_000, help="Simulated uplink, bytes/second")
+    parser.add_argument('--metrics', action='store_true', help="Run with Metrics instrumentation enabled")
+    parser.add_argument('--camera-open-seconds', type=float, default=0.0,
+                        help="Simulated time to open each camera")
+    parser.add_argument('--save', help="Write the results to this JSON file")
+    parser.add_argument('--compare', help="Baseline JSON file to compare against")
+    args = parser.parse_args()
+
+    # Output paths are relative to where the benchmark was started, it runs in a temp directory
+    save = os.path.abspath(args.save) if args.save else None
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    results = run(args.keypad, args.segment_seconds, args.idle_seconds, args.open_seconds, args.s3_bandwidth,
+                  args.metrics, args.camera_open_seconds)
+    json.dump(results, sys.stdout, indent=2)
+    print()
+    if save:
+        with open(save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if baseline:
+        compare(baseline, results)
+    # Device threads (keypad, telemetry) do not stop on their own
+    os._exit(0)
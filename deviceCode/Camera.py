@@ -0,0 +1,248 @@
+import os
+import subprocess
+import threading
+import time
+import simplejpeg
+from picamera2 import Picamera2
+from picamera2.encoders import H264Encoder
+from picamera2.outputs import FfmpegOutput
+from PreRollOutput import PreRollOutput
+from Encoding import Profile, PROFILES
+
+# simplejpeg colorspace for each Picamera2 main stream format
+JPEG_COLORSPACES = {"XBGR8888": "RGBX", "XRGB8888": "BGRX", "BGR888": "RGB", "RGB888": "BGR"}
+
+class Camera:
+    def __init__(self, camera_num, size=(1920, 1080), framerate=30,
+                 preroll_seconds=0, preroll_max_bytes=16 * 1024 * 1024, segmented=False, lores_size=None,
+                 profile=None):
+        """
+        One Picamera2 with its H.264 encoder.
+
+        :param camera_num: Picamera2 camera index.
+        :param preroll_seconds: Seconds kept in memory before a trigger, 0 disables pre-roll.
+        :param preroll_max_bytes: Memory cap for the pre-roll ring.
+        :param segmented: Prepare the encoder for clips cut into segments.
+        :param lores_size: Size of a small YUV420 stream for motion detection, None disables it.
+                           The camera then runs continuously and clips only start the encoder.
+        :param profile: Name of an Encoding.PROFILES entry, replaces size and framerate.
+        """
+        self.lores_size = lores_size
+        self.segmented = segmented
+        self.picam = Picamera2(camera_num=camera_num)
+
+        self.recording = False
+        self.filename = None
+        self.output = None
+
+        # Session state, a session stays open while triggers keep extending it
+        self.session_lock = threading.Lock()
+        self.session_start = 0.0
+        self.session_end = 0.0
+        self.sessions = 0
+        self.extensions = 0
+        self.encoder_starts = 0
+        # Frames and bytes from per-clip outputs that have been closed
+        self.closed_frames = 0
+        self.closed_bytes = 0
+
+        # Time from start_clip() to the first frame in the clip
+        self.trigger_latency = None
+
+        self.preroll = None
+        if preroll_seconds > 0:
+            self.preroll = PreRollOutput(preroll_seconds, preroll_max_bytes)
+
+        # Profile changes requested during a clip wait until it stops
+        self.pending_profile = None
+        self.configure(PROFILES[profile] if profile else Profile("default", size, framerate, None, None))
+        self.start_stream()
+
+    def configure(self, profile):
+        self.profile = profile
+        self.framerate = profile.framerate
+        main = {"size": profile.size}
+        controls = {"FrameRate": profile.framerate}
+        if self.lores_size:
+            self.video_config = self.picam.create_video_configuration(
+                main=main, lores={"size": self.lores_size, "format": "YUV420"}, controls=controls)
+        else:
+            self.video_config = self.picam.create_video_configuration(main=main, controls=controls)
+        self.picam.configure(self.video_config)
+
+        if self.preroll or self.segmented:
+            # Keyframe every second with repeated headers, so the ring can be
+            # trimmed tightly and every segment decodes on its own
+            self.encoder = H264Encoder(bitrate=profile.bitrate, iperiod=profile.framerate, repeat=True)
+        else:
+            self.encoder = H264Encoder(bitrate=profile.bitrate, iperiod=profile.iperiod)
+
+    def start_stream(self):
+        # Pre-roll keeps the encoder running, a lores stream keeps the camera running
+        if self.preroll:
+            self.picam.start_recording(self.encoder, self.preroll)
+        elif self.lores_size:
+            self.picam.start()
+
+    def stop_stream(self):
+        if self.preroll:
+            self.picam.stop_recording()
+            self.preroll.reset()
+        elif self.lores_size:
+            self.picam.stop()
+
+    def set_profile(self, name):
+        """Switch to an Encoding.PROFILES entry now, or when the current clip stops."""
+        with self.session_lock:
+            if self.recording:
+                self.pending_profile = name
+                return
+            self.pending_profile = None
+            if name != self.profile.name:
+                self.stop_stream()
+                self.configure(PROFILES[name])
+                self.start_stream()
+
+    def encoding(self):
+        """True while the encoder output is counted by encoded() and running."""
+        return self.preroll is not None or (self.segmented and self.recording)
+
+    def start_clip(self, filename, writer=None):
+        """
+        Start a clip and open a recording session.
+
+        :param filename: Clip filename, also used as the session name.
+        :param writer: Optional sink such as a SegmentWriter, replaces the single .mp4 file.
+        :return: The Profile the clip is recorded with.
+        """
+        self.filename = filename
+        self.output = writer
+        trigger = time.monotonic()
+        with self.session_lock:
+            self.recording = True
+            self.session_start = trigger
+            self.session_end = trigger
+            self.sessions += 1
+        if self.preroll:
+            self.preroll.start_clip(writer or self.raw_filename())
+        elif writer:
+            self.output = PreRollOutput(0)
+            self.output.start_clip(writer)
+            self.start_encoder(self.output)
+            self.encoder_starts += 1
+            self.trigger_latency = time.monotonic() - trigger
+        else:
+            output = FfmpegOutput(filename, audio=False)
+            self.start_encoder(output)
+            self.encoder_starts += 1
+            # Without pre-roll the clip waits for encoder start-up
+            self.trigger_latency = time.monotonic() - trigger
+        return self.profile
+
+    def extend(self, seconds):
+        """Push the end of the open session to at least seconds from now."""
+        with self.session_lock:
+            if self.recording:
+                self.session_end = max(self.session_end, time.monotonic() + seconds)
+                self.extensions += 1
+
+    def wait_until_quiet(self, max_seconds):
+        """Block until the session end passes without a new trigger, or max_seconds elapse."""
+        while True:
+            with self.session_lock:
+                end = min(self.session_end, self.session_start + max_seconds)
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def stop_clip(self):
+        """
+        Finish the clip and return the path of the .mp4 file, or None for segmented clips.
+        If remuxing the pre-roll stream fails, the path of the raw .h264 file instead.
+        """
+        filename = self.filename
+        if self.preroll:
+            self.preroll.stop_clip()
+            self.trigger_latency = self.preroll.first_frame_latency
+            if self.output is None:
+                filename = self.remux(self.raw_filename(), self.filename)
+            else:
+                filename = None
+        else:
+            self.stop_encoder()
+            if self.output is not None:
+                self.output.stop_clip()
+                self.closed_frames += self.output.frames
+                self.closed_bytes += self.output.bytes
+                filename = None
+        self.output = None
+        self.recording = False
+        if self.pending_profile:
+            self.set_profile(self.pending_profile)
+        return filename
+
+    def start_encoder(self, output):
+        # With a lores stream the camera keeps running between clips for motion detection
+        if self.lores_size:
+            self.picam.start_encoder(self.encoder, output)
+        else:
+            self.picam.start_recording(self.encoder, output)
+
+    def stop_encoder(self):
+        if self.lores_size:
+            self.picam.stop_encoder()
+        else:
+            self.picam.stop_recording()
+
+    def encoded(self):
+        """
+        Frames and bytes out of the encoder so far. Only counted for pre-roll and
+        segmented clips, FfmpegOutput does not report them.
+        """
+        frames, size = self.closed_frames, self.closed_bytes
+        for output in (self.preroll, self.output):
+            if isinstance(output, PreRollOutput):
+                frames += output.frames
+                size += output.bytes
+        return frames, size
+
+    def snapshot(self, quality=80):
+        """
+        JPEG of the current main stream frame. The camera must be running, i.e.
+        pre-roll or lores enabled, or a clip started.
+        """
+        frame = self.picam.capture_array('main')
+        colorspace = JPEG_COLORSPACES.get(self.video_config["main"].get("format", "XBGR8888"), "RGBX")
+        return simplejpeg.encode_jpeg(frame, quality=quality, colorspace=colorspace, fastdct=True)
+
+    def capture_lores(self):
+        """Latest lores frame as a greyscale (Y plane) array."""
+        frame = self.picam.capture_array('lores')
+        return frame[:self.lores_size[1], :self.lores_size[0]]
+
+    def raw_filename(self):
+        return os.path.splitext(self.filename)[0] + '.h264'
+
+    def remux(self, raw, filename):
+        # Wrap the raw H.264 stream in an MP4 container without re-encoding.
+        # Returns the file to upload, the raw stream is kept if ffmpeg fails.
+        try:
+            result = subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-framerate', str(self.framerate),
+                                     '-i', raw, '-c', 'copy', filename])
+            error = f"exit code {result.returncode}" if result.returncode else None
+        except OSError as e:
+            error = str(e)
+        if error is None and os.path.exists(filename):
+            os.remove(raw)
+            return filename
+        print(f"remux of {raw} failed ({error or 'no output'}), keeping the raw stream")
+        if os.path.exists(filename):
+            os.remove(filename)
+        return raw
+
+    def stop(self):
+        try:
+            self.picam.stop_recording()
+        except:
+            pass
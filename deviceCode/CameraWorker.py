@@ -0,0 +1,403 @@
+import itertools
+import math
+import multiprocessing
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from multiprocessing import shared_memory
+import numpy as np
+from Segments import SegmentWriter
+
+# Shared block per camera: status, then the latest lores Y frame at FRAME_OFFSET.
+# Status: sequence (odd while being written), frame time, recording,
+# trigger latency (NaN if unknown), encoded frames, encoded bytes
+STATUS = struct.Struct('<QdBdQQ')
+SEQUENCE = struct.Struct('<Q')
+FRAME_OFFSET = 64
+
+# Seconds a call waits for its reply, on top of any time the call itself blocks for
+CALL_TIMEOUT = 10.0
+
+
+class Publisher:
+    def __init__(self, camera, block, interval):
+        """Worker side: writes a camera's status and lores frames to its shared block."""
+        self.camera = camera
+        self.block = block
+        self.interval = interval
+        self.seq = 0
+        self.lock = threading.Lock()
+        self.frame = None
+        if camera.lores_size:
+            width, height = camera.lores_size
+            self.frame = np.ndarray((height, width), np.uint8, buffer=block.buf, offset=FRAME_OFFSET)
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def publish(self, frame=None):
+        with self.lock:
+            frames, size = self.camera.encoded()
+            latency = self.camera.trigger_latency
+            # Seqlock: readers retry while the sequence is odd or changed under them
+            self.seq += 1
+            STATUS.pack_into(self.block.buf, 0, self.seq, time.monotonic(), self.camera.recording,
+                             math.nan if latency is None else latency, frames, size)
+            if frame is not None:
+                self.frame[:] = frame
+            self.seq += 1
+            SEQUENCE.pack_into(self.block.buf, 0, self.seq)
+
+    def run(self):
+        while self.running:
+            try:
+                self.publish(self.camera.capture_lores() if self.frame is not None else None)
+            except Exception as e:
+                print(f"Camera publish failed: {e}")
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+
+def worker_main(conn, configs, block_names, camera_class, interval):
+    # Runs in the camera process, owns the Picamera2 instances and encoders
+    if camera_class is None:
+        from Camera import Camera as camera_class
+    cameras = [camera_class(**config) for config in configs]
+    blocks = [shared_memory.SharedMemory(name=name) for name in block_names]
+    publishers = [Publisher(camera, block, interval) for camera, block in zip(cameras, blocks)]
+
+    send_lock = threading.Lock()
+    def send(message):
+        with send_lock:
+            conn.send(message)
+
+    def call(req_id, index, method, args):
+        try:
+            if method == 'start_clip':
+                filename, segments = args
+                writer = None
+                if segments:
+                    # Segments are cut here, the main process is told about each finished file
+                    writer = SegmentWriter(*segments, lambda segment: send(('segment', index, segment)))
+                result = cameras[index].start_clip(filename, writer)
+            else:
+                result = getattr(cameras[index], method)(*args)
+            publishers[index].publish()
+            send(('reply', req_id, result, None))
+        except Exception as e:
+            send(('reply', req_id, None, repr(e)))
+
+    # wait_until_quiet blocks, so calls run on a pool instead of the receive loop
+    pool = ThreadPoolExecutor(max_workers=4 * len(cameras), thread_name_prefix="camera-call")
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        if message is None:
+            break
+        pool.submit(call, *message)
+
+    pool.shutdown(wait=False)
+    for publisher in publishers:
+        publisher.stop()
+    for camera in cameras:
+        camera.stop()
+    for block in blocks:
+        block.close()
+
+
+class RemoteCamera:
+    def __init__(self, worker, index, config, block):
+        """Main side stand-in for a Camera owned by the camera process, same interface."""
+        self.worker = worker
+        self.index = index
+        self.block = block
+        self.picam = None
+        self.framerate = config.get('framerate', 30)
+        self.lores_size = config.get('lores_size')
+        self.prerolling = config.get('preroll_seconds', 0) > 0
+        self.segmented = config.get('segmented', False)
+        self.on_segment = None
+
+    def read(self, with_frame=False):
+        while True:
+            status = STATUS.unpack_from(self.block.buf, 0)
+            if status[0] % 2 == 0:
+                frame = None
+                if with_frame:
+                    width, height = self.lores_size
+                    frame = np.ndarray((height, width), np.uint8, buffer=self.block.buf,
+                                       offset=FRAME_OFFSET).copy()
+                if SEQUENCE.unpack_from(self.block.buf, 0)[0] == status[0]:
+                    return status, frame
+            time.sleep(0)
+
+    @property
+    def recording(self):
+        return bool(self.read()[0][2])
+
+    @property
+    def trigger_latency(self):
+        latency = self.read()[0][3]
+        return None if math.isnan(latency) else latency
+
+    def encoded(self):
+        status = self.read()[0]
+        return status[4], status[5]
+
+    def encoding(self):
+        return self.prerolling or (self.segmented and self.recording)
+
+    def capture_lores(self):
+        return self.read(with_frame=True)[1]
+
+    def start_clip(self, filename, writer=None):
+        segments = None
+        if writer is not None:
+            # The writer itself stays here, only its settings cross to the camera process
+            self.on_segment = writer.on_segment
+            segments = (writer.basename, writer.segment_seconds)
+        profile = self.worker.call(self.index, 'start_clip', filename, segments)
+        if profile is not None:
+            self.framerate = profile.framerate
+        return profile
+
+    def extend(self, seconds):
+        # Called from the event loop on every trigger, not worth waiting for
+        self.worker.cast(self.index, 'extend', seconds)
+
+    def set_profile(self, name):
+        self.worker.cast(self.index, 'set_profile', name)
+
+    def snapshot(self, quality=80):
+        return self.worker.call(self.index, 'snapshot', quality)
+
+    def wait_until_quiet(self, max_seconds):
+        self.worker.call(self.index, 'wait_until_quiet', max_seconds, timeout=max_seconds + CALL_TIMEOUT)
+
+    def stop_clip(self):
+        return self.worker.call(self.index, 'stop_clip')
+
+    def stop(self):
+        try:
+            self.worker.call(self.index, 'stop')
+        except RuntimeError:
+            pass
+
+
+class CameraWorker:
+    def __init__(self, configs, camera_class=None, status_interval=0.1):
+        """
+        Runs the cameras and their encoders in a separate process, so encoding
+        does not compete with the keypad and display for the GIL. Status and lores
+        frames come back through shared memory, commands go over a pipe.
+
+        :param configs: One dict of Camera keyword arguments per camera.
+        :param camera_class: Camera implementation to run, Camera when None.
+        :param status_interval: Seconds between status and lores frame updates.
+        """
+        ctx = multiprocessing.get_context('spawn')
+        self.blocks = []
+        for config in configs:
+            width, height = config.get('lores_size') or (0, 0)
+            self.blocks.append(shared_memory.SharedMemory(create=True, size=FRAME_OFFSET + width * height))
+        for block in self.blocks:
+            STATUS.pack_into(block.buf, 0, 0, 0.0, 0, math.nan, 0, 0)
+
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=worker_main, daemon=True,
+                                   args=(child, configs, [b.name for b in self.blocks], camera_class,
+                                         status_interval))
+        self.process.start()
+        child.close()
+
+        self.closing = False
+        self.exited = False
+        self.pending = {}
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+        self.cameras = [RemoteCamera(self, i, config, block)
+                        for i, (config, block) in enumerate(zip(configs, self.blocks))]
+        self.receiver = threading.Thread(target=self.receive, daemon=True)
+        self.receiver.start()
+
+    def send(self, index, method, args):
+        # Returns the request id and a future completed by receive()
+        future = Future()
+        with self.lock:
+            if self.exited:
+                raise RuntimeError('camera process is not running')
+            req_id = next(self.ids)
+            self.pending[req_id] = future
+            try:
+                self.conn.send((req_id, index, method, args))
+            except OSError:
+                del self.pending[req_id]
+                raise RuntimeError('camera process is not running')
+        return req_id, future
+
+    def call(self, index, method, *args, timeout=CALL_TIMEOUT):
+        """Call a camera method in the camera process and wait for the result."""
+        req_id, future = self.send(index, method, args)
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            with self.lock:
+                self.pending.pop(req_id, None)
+            raise RuntimeError(f'camera call {method} timed out after {timeout} s')
+
+    def cast(self, index, method, *args):
+        """Call without waiting for the result, failures are only logged."""
+        def done(future):
+            if future.exception() is not None:
+                print(f"camera call {method} failed: {future.exception()}")
+        try:
+            self.send(index, method, args)[1].add_done_callback(done)
+        except RuntimeError as e:
+            print(f"camera call {method} failed: {e}")
+
+    def receive(self):
+        while True:
+            try:
+                message = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            if message[0] == 'segment':
+                camera = self.cameras[message[1]]
+                if camera.on_segment:
+                    try:
+                        camera.on_segment(message[2])
+                    except Exception as e:
+                        print(f"Segment callback failed: {e}")
+                continue
+            _, req_id, result, error = message
+            with self.lock:
+                future = self.pending.pop(req_id, None)
+            if future is None:
+                continue
+            if error:
+                future.set_exception(RuntimeError(error))
+            else:
+                future.set_result(result)
+
+        # Camera process gone, fail everything still waiting on it and any later call
+        if not self.closing:
+            print("Camera process exited")
+        with self.lock:
+            self.exited = True
+            for future in self.pending.values():
+                future.set_exception(RuntimeError('camera process exited'))
+            self.pending.clear()
+
+    def shutdown(self):
+        self.closing = True
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.terminate()
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+
+
+class BenchCamera:
+    def __init__(self, camera_num=0, framerate=30, lores_size=None, **kwargs):
+        """
+        Stand-in for Camera in the __main__ benchmark: "encodes" continuously with a
+        per-frame load of Python work (GIL held, like picamera2's request and output
+        handling) plus compression (GIL released, like the hardware encoder wait).
+        """
+        self.framerate = framerate
+        self.lores_size = lores_size
+        self.recording = True
+        self.trigger_latency = None
+        self.frames = 0
+        self.bytes = 0
+        self.payload = np.random.default_rng(camera_num).integers(0, 64, 256 * 1024, dtype=np.uint8).tobytes()
+        self.running = True
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        next_frame = time.monotonic()
+        while self.running:
+            total = 0
+            for i in range(150000):
+                total += i & 7
+            self.bytes += len(zlib.compress(self.payload, 1))
+            self.frames += 1
+            next_frame = max(next_frame + 1.0 / self.framerate, time.monotonic())
+            time.sleep(max(0.0, next_frame - time.monotonic()))
+
+    def encoded(self):
+        return self.frames, self.bytes
+
+    def encoding(self):
+        return True
+
+    def capture_lores(self):
+        return None
+
+    def set_profile(self, name):
+        pass
+
+    def start_clip(self, filename, writer=None):
+        return None
+
+    def extend(self, seconds):
+        pass
+
+    def wait_until_quiet(self, max_seconds):
+        pass
+
+    def stop_clip(self):
+        return None
+
+    def stop(self):
+        self.running = False
+
+
+if __name__ == '__main__':
+    # Key latency on the event loop and encoded frames/s with both cameras active,
+    # cameras in this process versus in the camera process. Uses BenchCamera, so it
+    # runs without camera hardware.
+    from CameraWorker import BenchCamera
+    from EventLoop import EventLoop
+
+    def measure(cameras, seconds=5.0):
+        loop = EventLoop(workers=2, report_interval=0)
+        latencies = []
+        loop.register('key', lambda sent: latencies.append(time.perf_counter() - sent))
+        threading.Thread(target=loop.run, daemon=True).start()
+        time.sleep(0.5)
+        start_frames = sum(c.encoded()[0] for c in cameras)
+        begin = time.monotonic()
+        while time.monotonic() - begin < seconds:
+            loop.post('key', time.perf_counter())
+            time.sleep(0.02)
+        fps = (sum(c.encoded()[0] for c in cameras) - start_frames) / (time.monotonic() - begin)
+        loop.stop()
+        latencies.sort()
+        return (1000 * latencies[len(latencies) // 2], 1000 * latencies[int(len(latencies) * 0.99)],
+                1000 * latencies[-1], fps)
+
+    cameras = [BenchCamera(0), BenchCamera(1)]
+    single = measure(cameras)
+    for camera in cameras:
+        camera.stop()
+
+    worker = CameraWorker([{"camera_num": 0}, {"camera_num": 1}], camera_class=BenchCamera)
+    multi = measure(worker.cameras)
+    worker.shutdown()
+
+    for label, (p50, p99, worst, fps) in (("single-process", single), ("multi-process", multi)):
+        print(f"{label}: key latency p50 {p50:.2f} ms, p99 {p99:.2f} ms, max {worst:.2f} ms, "
+              f"encoded {fps:.1f} frames/s (target 60)")
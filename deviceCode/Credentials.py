@@ -0,0 +1,384 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+
+# Slow hash for PINs, PBKDF2-HMAC-SHA256 at ITERATIONS. About 0.1 s on a Pi 4,
+# calibrate() finds the count for another board or budget.
+ITERATIONS = 100_000
+SALT_BYTES = 16
+
+Credential = namedtuple('Credential', ['id', 'name', 'salt', 'iterations', 'hash', 'tag', 'totp'])
+
+# Outcome of verify(). method is 'pin' or 'totp', retry_after is the lockout
+# remaining in seconds when the source is locked out, else 0.
+Result = namedtuple('Result', ['accepted', 'user', 'method', 'retry_after'])
+
+
+def hash_pin(pin, salt, iterations):
+    return hashlib.pbkdf2_hmac('sha256', pin.encode(), salt, iterations)
+
+
+def totp(secret, step, digits):
+    """RFC 6238 code for one time step (HMAC-SHA1, dynamic truncation)."""
+    digest = hmac.new(secret, struct.pack('>Q', step), hashlib.sha1).digest()
+    offset = digest[-1] & 0x0F
+    value = struct.unpack_from('>I', digest, offset)[0] & 0x7FFFFFFF
+    return f"{value % 10 ** digits:0{digits}d}"
+
+
+def calibrate(budget, max_bucket=2):
+    """PBKDF2 iterations that keep max_bucket hashes within budget seconds on this machine."""
+    start = time.perf_counter()
+    hash_pin("00000000", b'\0' * SALT_BYTES, 20_000)
+    per_iteration = (time.perf_counter() - start) / 20_000
+    return max(10_000, int(budget / max_bucket / per_iteration))
+
+
+class CredentialEngine:
+    def __init__(self, path, key_path, iterations=ITERATIONS, tag_bits=20, max_bucket=2, totp_digits=8,
+                 totp_step=30, totp_window=1, lockout_after=3, lockout_base=30.0, lockout_max=3600.0,
+                 failure_window=900.0, min_length=4):
+        """
+        Per-user PINs and time-based one-time codes with per-source lockout.
+
+        PINs are stored as salted PBKDF2 hashes. Each credential also carries a
+        short tag, a keyed HMAC of the PIN cut to tag_bits, computed when it is
+        enrolled. The tags index the credentials at load, so a verify hashes only
+        the credentials in one tag bucket: one hash, at most max_bucket, whatever
+        the number of users. The index key lives in its own file. With it and the
+        credential file together, an attacker can rule out most PINs quickly, so
+        keep the key file readable by the safe's user only.
+
+        :param path: Credential JSON file.
+        :param key_path: Index key file, created if missing.
+        :param iterations: PBKDF2 iterations for new PINs.
+        :param tag_bits: Tag length. More bits give smaller buckets but say more about the PIN.
+        :param max_bucket: Most credentials per tag, enrollment refuses a PIN beyond it.
+        :param totp_digits: One-time code length.
+        :param totp_step: One-time code period in seconds.
+        :param totp_window: Steps accepted either side of the current one, for clock drift.
+        :param lockout_after: Failed attempts from one source before it is locked out.
+        :param lockout_base: First lockout in seconds, doubled on every further failure.
+        :param lockout_max: Lockout cap in seconds.
+        :param failure_window: Seconds without a failure, counted from the end of any
+                               lockout, after which a source's failure count starts over.
+        :param min_length: Shortest PIN. Shorter entries, e.g. a stray '#', are rejected
+                           without counting as a failed attempt.
+        """
+        self.path = path
+        self.key_path = key_path
+        self.iterations = iterations
+        self.tag_bits = tag_bits
+        self.max_bucket = max_bucket
+        self.totp_digits = totp_digits
+        self.totp_step = totp_step
+        self.totp_window = totp_window
+        self.lockout_after = lockout_after
+        self.lockout_base = lockout_base
+        self.lockout_max = lockout_max
+        self.failure_window = failure_window
+        self.min_length = min_length
+
+        self.lock = threading.Lock()
+        self.index_key = self.load_key()
+        # Misses are hashed against this so they take as long as hits
+        self.dummy_salt = os.urandom(SALT_BYTES)
+
+        self.users = {}
+        self.index = {}
+        self.totp_users = {}
+        # step -> {code: [user ids]}, for the steps around now
+        self.totp_cache = {}
+        self.totp_used = {}
+        self.refresher = None
+
+        # Lockouts and used one-time codes are kept on disk, a power cycle
+        # neither resets a lockout nor makes a used code good again
+        self.lockout_path = os.path.splitext(path)[0] + '.lockout.json'
+        self.failures = {}
+        self.load()
+
+    def load_key(self):
+        try:
+            with open(self.key_path, 'rb') as f:
+                return bytes.fromhex(f.read().decode().strip())
+        except FileNotFoundError:
+            pass
+        key = os.urandom(32)
+        fd = os.open(self.key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(key.hex())
+        return key
+
+    def tag(self, pin):
+        digest = hmac.new(self.index_key, pin.encode(), hashlib.sha256).digest()
+        return int.from_bytes(digest[:4], 'big') >> (32 - self.tag_bits)
+
+    def load(self):
+        users = []
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get("tag_bits", self.tag_bits) != self.tag_bits:
+                raise ValueError(f'{self.path}: tags are {data["tag_bits"]} bits, expected {self.tag_bits}')
+            users = data["users"]
+        with self.lock:
+            self.users = {}
+            for user in users:
+                self.users[user["id"]] = Credential(
+                    user["id"], user.get("name"),
+                    bytes.fromhex(user["salt"]) if user.get("salt") else None,
+                    user.get("iterations", ITERATIONS),
+                    bytes.fromhex(user["hash"]) if user.get("hash") else None,
+                    user.get("tag"),
+                    base64.b32decode(user["totp"]) if user.get("totp") else None)
+            self.build_index()
+        if os.path.exists(self.lockout_path):
+            with open(self.lockout_path) as f:
+                state = json.load(f)
+            self.failures = state.get("failures", {})
+            self.totp_used = state.get("totp_used", {})
+
+    def build_index(self):
+        # O(users) once at load, lookups are dict hits from then on
+        self.index = {}
+        self.totp_users = {}
+        for user in self.users.values():
+            self.add_to_index(user)
+
+    def add_to_index(self, user):
+        if user.hash is not None:
+            self.index.setdefault(user.tag, []).append(user)
+        if user.totp is not None:
+            self.totp_users[user.id] = user.totp
+            self.totp_cache = {}
+        if self.totp_users and self.refresher is None:
+            self.refresher = threading.Thread(target=self.refresh, daemon=True, name="totp-refresh")
+            self.refresher.start()
+
+    def remove_from_index(self, user):
+        bucket = self.index.get(user.tag, [])
+        if user in bucket:
+            bucket.remove(user)
+            if not bucket:
+                del self.index[user.tag]
+        if self.totp_users.pop(user.id, None) is not None:
+            self.totp_cache = {}
+
+    def save(self):
+        with self.lock:
+            users = [{"id": u.id, "name": u.name,
+                      "salt": u.salt.hex() if u.salt else None, "iterations": u.iterations,
+                      "hash": u.hash.hex() if u.hash else None, "tag": u.tag,
+                      "totp": base64.b32encode(u.totp).decode() if u.totp else None}
+                     for u in self.users.values()]
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({"version": 1, "tag_bits": self.tag_bits, "users": users}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def enroll(self, user_id, pin=None, name=None, totp_secret=None, save=True):
+        """
+        Add or replace a user. PINs must be unique across users.
+
+        :param pin: Digits only, None for a one-time-code-only user.
+        :param totp_secret: Raw secret bytes for one-time codes, None for PIN only.
+        :raises ValueError: The PIN is taken or its tag bucket is full, pick another.
+        """
+        if pin is not None and not pin.isdigit():
+            raise ValueError('PIN must be digits')
+        if pin is not None and len(pin) < self.min_length:
+            raise ValueError(f'PIN must be at least {self.min_length} digits')
+        salt = digest = tag = None
+        if pin is not None:
+            tag = self.tag(pin)
+            with self.lock:
+                bucket = [u for u in self.index.get(tag, []) if u.id != user_id]
+            for user in bucket:
+                if hmac.compare_digest(hash_pin(pin, user.salt, user.iterations), user.hash):
+                    raise ValueError('PIN already in use')
+            if len(bucket) >= self.max_bucket:
+                raise ValueError('PIN rejected, choose another')
+            salt = os.urandom(SALT_BYTES)
+            digest = hash_pin(pin, salt, self.iterations)
+        with self.lock:
+            if user_id in self.users:
+                self.remove_from_index(self.users[user_id])
+            self.users[user_id] = Credential(user_id, name, salt, self.iterations, digest, tag, totp_secret)
+            self.add_to_index(self.users[user_id])
+        if save:
+            self.save()
+
+    def remove(self, user_id, save=True):
+        with self.lock:
+            user = self.users.pop(user_id, None)
+            if user is not None:
+                self.remove_from_index(user)
+        if save:
+            self.save()
+
+    def codes_for(self, step):
+        codes = self.totp_cache.get(step)
+        if codes is None:
+            codes = {}
+            for user_id, secret in self.totp_users.items():
+                codes.setdefault(totp(secret, step, self.totp_digits), []).append(user_id)
+            self.totp_cache[step] = codes
+        return codes
+
+    def refresh(self):
+        # Codes for the next step are ready before it starts, so verify never computes them
+        while True:
+            with self.lock:
+                step = int(time.time() // self.totp_step)
+                for old in [s for s in self.totp_cache if s < step - self.totp_window]:
+                    del self.totp_cache[old]
+                for s in range(step - self.totp_window, step + self.totp_window + 2):
+                    self.codes_for(s)
+            time.sleep(self.totp_step - time.time() % self.totp_step + 0.01)
+
+    def check_totp(self, code, now):
+        step = int(now // self.totp_step)
+        for s in range(step - self.totp_window, step + self.totp_window + 1):
+            for user_id in self.codes_for(s).get(code, ()):
+                # A code is good once, also within its window
+                if self.totp_used.get(user_id, -1) < s:
+                    self.totp_used[user_id] = s
+                    return self.users[user_id]
+        return None
+
+    def retry_after(self, source, now):
+        until = self.failures.get(source, (0, 0.0))[1]
+        return max(0.0, until - now)
+
+    def record(self, source, accepted, now):
+        """Update the failure count of source, True if the lockout state changed."""
+        if accepted:
+            return self.failures.pop(source, None) is not None
+        # [count, locked until, last failure], older saved state lacks the last failure
+        entry = self.failures.get(source, [0, 0.0])
+        count, until = entry[:2]
+        last = entry[2] if len(entry) > 2 else until
+        if now - max(last, until) >= self.failure_window:
+            count = 0
+        count += 1
+        if count >= self.lockout_after:
+            until = now + min(self.lockout_max, self.lockout_base * 2 ** (count - self.lockout_after))
+        self.failures[source] = [count, until, now]
+        return True
+
+    def save_state(self):
+        tmp = self.lockout_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({"failures": self.failures, "totp_used": self.totp_used}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.lockout_path)
+
+    def verify(self, code, source='keypad', now=None):
+        """
+        Check a PIN or one-time code. Costs one PBKDF2 hash (at most max_bucket)
+        plus dict lookups, independent of the number of users.
+
+        :param source: Where the attempt came from, lockouts are per source.
+        :return: Result.
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            retry = self.retry_after(source, now)
+            if retry > 0 or len(code) < self.min_length:
+                return Result(False, None, None, retry)
+            bucket = list(self.index.get(self.tag(code), ())) if code.isdigit() else []
+
+        user = None
+        method = None
+        for candidate in bucket:
+            if hmac.compare_digest(hash_pin(code, candidate.salt, candidate.iterations), candidate.hash):
+                user, method = candidate, 'pin'
+        if not bucket:
+            hash_pin(code, self.dummy_salt, self.iterations)
+
+        with self.lock:
+            if user is None and self.totp_users and len(code) == self.totp_digits:
+                user = self.check_totp(code, now)
+                method = 'totp' if user else None
+            # A used one-time code is on disk before the safe opens
+            if self.record(source, user is not None, now) or method == 'totp':
+                self.save_state()
+            retry = self.retry_after(source, now)
+        return Result(user is not None, user, method, retry)
+
+
+if __name__ == '__main__':
+    # Verify latency for 10 to 10k enrolled users (python Credentials.py [iterations]).
+    # Users are enrolled at low iterations to keep set-up short, the verify cost
+    # scales with iterations but not with users.
+    import sys
+    import tempfile
+
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    directory = tempfile.mkdtemp(prefix='credentials_bench_')
+
+    def percentiles(values):
+        values = sorted(values)
+        return 1000 * values[len(values) // 2], 1000 * values[int(len(values) * 0.95)]
+
+    start = time.perf_counter()
+    for _ in range(10):
+        hash_pin("12345678", b'\0' * SALT_BYTES, iterations)
+    single = (time.perf_counter() - start) / 10 * 1000
+    print(f"one PBKDF2 hash at {iterations} iterations: {single:.1f} ms, "
+          f"suggested iterations for a 250 ms budget: {calibrate(0.25)}")
+
+    for count in (10, 100, 1000, 10000):
+        path = os.path.join(directory, f'users_{count}.json')
+        engine = CredentialEngine(path, os.path.join(directory, 'index.key'), iterations=iterations,
+                                  lockout_after=10 ** 9)
+        pins = {}
+        n = 0
+        while len(pins) < count:
+            pin = f"{(n * 7919 + 12345) % 10 ** 8:08d}"
+            n += 1
+            try:
+                engine.enroll(f"user{len(pins)}", pin, totp_secret=os.urandom(20) if len(pins) % 10 == 0 else None,
+                              save=False)
+            except ValueError:
+                continue
+            pins[f"user{len(pins)}"] = pin
+        engine.save()
+
+        start = time.perf_counter()
+        engine = CredentialEngine(path, os.path.join(directory, 'index.key'), iterations=iterations,
+                                  lockout_after=10 ** 9)
+        load = time.perf_counter() - start
+
+        good, bad, codes = [], [], []
+        users = list(pins.items())
+        for i in range(20):
+            user_id, pin = users[i * len(users) // 20]
+            start = time.perf_counter()
+            assert engine.verify(pin).user.id == user_id
+            good.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            engine.verify(f"{(int(pin) + 1) % 10 ** 8:08d}")
+            bad.append(time.perf_counter() - start)
+        now = time.time()
+        for user_id, secret in list(engine.totp_users.items())[:10]:
+            code = totp(secret, int(now // engine.totp_step), engine.totp_digits)
+            start = time.perf_counter()
+            result = engine.verify(code, now=now)
+            codes.append(time.perf_counter() - start)
+            assert result.accepted and result.method in ('pin', 'totp')
+        print(f"{count} users: load {load * 1000:.0f} ms, "
+              f"good PIN p50/p95 {'/'.join(f'{v:.1f}' for v in percentiles(good))} ms, "
+              f"wrong PIN {'/'.join(f'{v:.1f}' for v in percentiles(bad))} ms, "
+              f"one-time code {'/'.join(f'{v:.1f}' for v in percentiles(codes))} ms, "
+              f"a linear scan would hash {count} times ({count * single / 1000:.1f} s)")
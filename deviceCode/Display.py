@@ -0,0 +1,130 @@
+import threading
+import time
+
+class Overlay:
+    def __init__(self, line1, line2, duration=None, blink=None, priority=0):
+        """
+        Timed message drawn on top of the base screen.
+
+        :param duration: Seconds before the overlay expires, None to keep it until hidden.
+        :param blink: Blink period in seconds for line 2, None for steady text.
+        :param priority: Highest priority overlay wins, ties go to the newest.
+        """
+        self.lines = (line1, line2)
+        self.duration = duration
+        self.blink = blink
+        self.priority = priority
+        self.start = time.monotonic()
+        self.deadline = self.start + duration if duration is not None else None
+
+    def expired(self, now):
+        return self.deadline is not None and now >= self.deadline
+
+    def frame(self, now):
+        if self.blink and int((now - self.start) / self.blink) % 2:
+            return (self.lines[0], "")
+        return self.lines
+
+    def next_change(self, now):
+        # Next blink edge or expiry, whichever comes first
+        change = self.deadline
+        if self.blink:
+            edge = self.start + (int((now - self.start) / self.blink) + 1) * self.blink
+            change = edge if change is None else min(change, edge)
+        return change
+
+
+class Display:
+    def __init__(self, lcd, max_fps=10):
+        """
+        Compositor that owns the LCD. Callers only update state, a single
+        render thread turns it into frames at no more than max_fps.
+
+        :param lcd: LCD instance, must not be written to by anything else.
+        :param max_fps: Refresh rate cap.
+        """
+        self.lcd = lcd
+        self.min_interval = 1.0 / max_fps
+
+        self.screen = ("", "")
+        self.overlays = {}
+        self.current = None
+
+        self.cond = threading.Condition()
+        self.dirty = True
+        self.running = True
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def set_screen(self, line1, line2=""):
+        """Set the base screen shown when no overlay is active."""
+        with self.cond:
+            if self.screen != (line1, line2):
+                self.screen = (line1, line2)
+                self.dirty = True
+                self.cond.notify()
+
+    def show(self, name, line1, line2="", duration=None, blink=None, priority=0):
+        """Show an overlay, replacing any overlay with the same name."""
+        with self.cond:
+            self.overlays[name] = Overlay(line1, line2, duration, blink, priority)
+            self.dirty = True
+            self.cond.notify()
+
+    def hide(self, name):
+        with self.cond:
+            if self.overlays.pop(name, None):
+                self.dirty = True
+                self.cond.notify()
+
+    def overlay_active(self):
+        now = time.monotonic()
+        with self.cond:
+            return any(not o.expired(now) for o in self.overlays.values())
+
+    def compose(self, now):
+        # Drop expired overlays and return (frame, next change time)
+        for name in [n for n, o in self.overlays.items() if o.expired(now)]:
+            del self.overlays[name]
+
+        if not self.overlays:
+            return self.screen, None
+
+        top = max(self.overlays.values(), key=lambda o: (o.priority, o.start))
+        changes = [o.next_change(now) for o in self.overlays.values()]
+        changes = [c for c in changes if c is not None]
+        return top.frame(now), min(changes) if changes else None
+
+    def run(self):
+        last_render = 0.0
+        wake_at = None
+        while True:
+            with self.cond:
+                while self.running and not self.dirty:
+                    timeout = None if wake_at is None else wake_at - time.monotonic()
+                    if timeout is not None and timeout <= 0:
+                        break
+                    self.cond.wait(timeout)
+                if not self.running:
+                    return
+                self.dirty = False
+                frame, wake_at = self.compose(time.monotonic())
+
+            # Only this thread touches the LCD, so lines can never tear
+            if frame != self.current:
+                self.lcd.message(frame[0], 1)
+                self.lcd.message(frame[1], 2)
+                self.current = frame
+
+            # Cap the refresh rate
+            delay = last_render + self.min_interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            last_render = time.monotonic()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        self.thread.join(timeout=1)
@@ -0,0 +1,176 @@
+import os
+import threading
+import time
+from collections import namedtuple
+
+# Encoder settings for one camera. bitrate is in bits/second, iperiod is the
+# GOP length in frames. None leaves the encoder default.
+Profile = namedtuple('Profile', ['name', 'size', 'framerate', 'bitrate', 'iperiod'])
+
+PROFILES = {
+    "high": Profile("high", (1920, 1080), 30, 8_000_000, 30),
+    "medium": Profile("medium", (1280, 720), 25, 4_000_000, 25),
+    "low": Profile("low", (960, 540), 15, 1_500_000, 15),
+    "minimal": Profile("minimal", (640, 360), 10, 600_000, 10),
+}
+
+# Best to worst, the controller moves one step at a time
+LADDER = ("high", "medium", "low", "minimal")
+
+class CpuSampler:
+    def __init__(self):
+        """System-wide CPU% from /proc/stat deltas, load average where that is missing."""
+        self.last = self.read()
+
+    def read(self):
+        try:
+            with open('/proc/stat') as f:
+                fields = [int(v) for v in f.readline().split()[1:]]
+        except OSError:
+            return None
+        idle = fields[3] + fields[4]  # idle + iowait
+        return sum(fields), idle
+
+    def percent(self):
+        current = self.read()
+        if current is None or self.last is None:
+            return 100.0 * os.getloadavg()[0] / os.cpu_count()
+        total, idle = current[0] - self.last[0], current[1] - self.last[1]
+        self.last = current
+        return 100.0 * (1 - idle / total) if total else 0.0
+
+
+class EncodingController:
+    def __init__(self, cameras, spool=None, start="high", interval=5.0, cpu_high=85.0, cpu_low=50.0,
+                 drop_high=0.05, backlog_high=256 * 1024 * 1024, backlog_low=32 * 1024 * 1024, up_after=6):
+        """
+        Steps every camera down the profile ladder under load and back up once it clears.
+
+        :param cameras: Cameras to control, each needs set_profile(), encoded() and encoding().
+        :param spool: Upload Spool, its pending bytes count as upload backlog.
+        :param start: Initial profile.
+        :param interval: Seconds between samples.
+        :param cpu_high: System CPU% that steps quality down.
+        :param cpu_low: CPU% below which quality may step up again.
+        :param drop_high: Fraction of frames missing from the encoder output that steps down.
+        :param backlog_high: Pending upload bytes that step down.
+        :param backlog_low: Pending upload bytes below which quality may step up again.
+        :param up_after: Consecutive calm samples needed before stepping up.
+        """
+        self.cameras = cameras
+        self.spool = spool
+        self.interval = interval
+        self.cpu_high = cpu_high
+        self.cpu_low = cpu_low
+        self.drop_high = drop_high
+        self.backlog_high = backlog_high
+        self.backlog_low = backlog_low
+        self.up_after = up_after
+
+        self.level = LADDER.index(start)
+        self.calm = 0
+        self.cpu = CpuSampler()
+        self.last_frames = [camera.encoded()[0] for camera in cameras]
+        self.last_encoding = [camera.encoding() for camera in cameras]
+        self.last_sample = time.monotonic()
+        self.changes = 0
+        self.apply()
+
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    @property
+    def profile(self):
+        return PROFILES[LADDER[self.level]]
+
+    def apply(self):
+        for camera in self.cameras:
+            camera.set_profile(self.profile.name)
+
+    def sample(self):
+        """Returns the current CPU%, frame drop fraction and upload backlog bytes."""
+        now = time.monotonic()
+        elapsed = now - self.last_sample
+        self.last_sample = now
+
+        # Frames the encoder should have produced, for cameras encoding through the whole interval
+        expected = produced = 0
+        for i, camera in enumerate(self.cameras):
+            frames = camera.encoded()[0]
+            encoding = camera.encoding()
+            if encoding and self.last_encoding[i]:
+                expected += self.profile.framerate * elapsed
+                produced += frames - self.last_frames[i]
+            self.last_frames[i] = frames
+            self.last_encoding[i] = encoding
+        drop = max(0.0, 1 - produced / expected) if expected else 0.0
+
+        backlog = self.spool.stats()["pending_bytes"] if self.spool else 0
+        return self.cpu.percent(), drop, backlog
+
+    def step(self, cpu, drop, backlog):
+        if cpu > self.cpu_high or drop > self.drop_high or backlog > self.backlog_high:
+            self.calm = 0
+            if self.level < len(LADDER) - 1:
+                self.level += 1
+                return True
+        elif cpu < self.cpu_low and drop < self.drop_high / 5 and backlog < self.backlog_low:
+            self.calm += 1
+            if self.calm >= self.up_after and self.level > 0:
+                self.calm = 0
+                self.level -= 1
+                return True
+        else:
+            self.calm = 0
+        return False
+
+    def run(self):
+        while self.running:
+            time.sleep(self.interval)
+            cpu, drop, backlog = self.sample()
+            if self.step(cpu, drop, backlog):
+                self.changes += 1
+                print(f"encoding: {self.profile.name} (cpu {cpu:.0f}%, drop {drop * 100:.1f}%, "
+                      f"backlog {backlog / 1024 / 1024:.0f} MB)")
+                self.apply()
+
+    def stop(self):
+        self.running = False
+
+
+class CountingSink:
+    def __init__(self):
+        """Clip sink that only counts, for the benchmark."""
+        self.frames = 0
+        self.bytes = 0
+
+    def write(self, frame, keyframe, captured):
+        self.frames += 1
+        self.bytes += len(frame)
+
+    def close(self):
+        pass
+
+
+if __name__ == '__main__':
+    # Records from camera 0 with each profile for 30 s (python Encoding.py [seconds])
+    # and reports process CPU%, dropped frames and MB/minute. Needs the camera.
+    import sys
+    from Camera import Camera
+
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 30.0
+    camera = Camera(0, segmented=True)
+    for name in LADDER:
+        camera.set_profile(name)
+        sink = CountingSink()
+        camera.start_clip(f'bench_{name}', sink)
+        wall, cpu = time.monotonic(), time.process_time()
+        time.sleep(seconds)
+        wall, cpu = time.monotonic() - wall, time.process_time() - cpu
+        camera.stop_clip()
+        expected = camera.framerate * wall
+        print(f"{name}: {camera.framerate} fps {camera.profile.size[0]}x{camera.profile.size[1]}, "
+              f"cpu {100 * cpu / wall:.0f}%, dropped {max(0, expected - sink.frames):.0f} of {expected:.0f} frames, "
+              f"{sink.bytes / wall * 60 / 1024 / 1024:.1f} MB/min")
+    camera.stop()
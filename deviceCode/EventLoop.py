@@ -0,0 +1,151 @@
+import heapq
+import itertools
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+class EventLoop:
+    def __init__(self, workers=4, report_interval=60):
+        """
+        Single dispatcher for keypad, tilt-switch and timer events.
+
+        :param workers: Size of the fixed worker pool used instead of ad-hoc threads.
+        :param report_interval: Seconds between idle CPU / event rate reports (0 disables).
+        """
+        self.events = queue.Queue()
+        self.handlers = {}
+        self.listeners = []
+
+        # Timers are kept in a heap of (deadline, seq, event, data)
+        self.timers = []
+        self.timer_lock = threading.Lock()
+        self.timer_seq = itertools.count()
+
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="safe-worker")
+
+        self.running = False
+        self.report_interval = report_interval
+
+        # Statistics
+        self.event_count = 0
+        self.idle_time = 0.0
+        self.start_wall = time.monotonic()
+        self.start_cpu = time.process_time()
+        self.last_report = self.start_wall
+
+    def register(self, event, handler):
+        """Register the handler called for an event type."""
+        self.handlers[event] = handler
+
+    def add_listener(self, listener):
+        """Register a callback run after every dispatched event."""
+        self.listeners.append(listener)
+
+    def post(self, event, data=None):
+        """Queue an event. Safe to call from any thread or gpiozero callback."""
+        self.events.put((event, data))
+
+    def call_later(self, delay, event, data=None):
+        """Post an event after delay seconds."""
+        with self.timer_lock:
+            heapq.heappush(self.timers, (time.monotonic() + delay, next(self.timer_seq), event, data))
+        # Wake the dispatcher so it recomputes its sleep deadline
+        self.events.put(None)
+
+    def submit(self, fn, *args):
+        """Run fn on the fixed worker pool. Exceptions are logged, callers may still check the future."""
+        future = self.pool.submit(fn, *args)
+        future.add_done_callback(self._log_failure)
+        return future
+
+    @staticmethod
+    def _log_failure(future):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            print(f"loop: worker task failed: {error!r}")
+            traceback.print_exception(type(error), error, error.__traceback__)
+
+    def _next_timeout(self):
+        with self.timer_lock:
+            if not self.timers:
+                return None
+            return max(0.0, self.timers[0][0] - time.monotonic())
+
+    def _fire_timers(self):
+        now = time.monotonic()
+        with self.timer_lock:
+            while self.timers and self.timers[0][0] <= now:
+                _, _, event, data = heapq.heappop(self.timers)
+                self.events.put((event, data))
+
+    def dispatch(self, item):
+        event, data = item
+        handler = self.handlers.get(event)
+        # A failing handler must not stop the loop, the safe would stop responding
+        if handler:
+            try:
+                handler(data)
+            except Exception as e:
+                print(f"loop: {event} handler failed: {e!r}")
+                traceback.print_exc()
+        for listener in self.listeners:
+            try:
+                listener(event, data)
+            except Exception as e:
+                print(f"loop: {event} listener failed: {e!r}")
+                traceback.print_exc()
+        self.event_count += 1
+
+    def run(self):
+        """Block dispatching events until stop() is called."""
+        self.running = True
+        while self.running:
+            timeout = self._next_timeout()
+            if self.report_interval:
+                until_report = self.last_report + self.report_interval - time.monotonic()
+                timeout = until_report if timeout is None else min(timeout, until_report)
+                timeout = max(0.0, timeout)
+
+            idle_start = time.monotonic()
+            try:
+                item = self.events.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            self.idle_time += time.monotonic() - idle_start
+
+            self._fire_timers()
+            if item is not None:
+                self.dispatch(item)
+
+            if self.report_interval and time.monotonic() - self.last_report >= self.report_interval:
+                self.report()
+
+    def stop(self):
+        self.running = False
+        self.events.put(None)
+        self.pool.shutdown(wait=False)
+
+    def stats(self):
+        """
+        Returns loop statistics since start.
+
+        :return: Dict with event count, events/second, idle percentage and process CPU percentage.
+        """
+        wall = max(time.monotonic() - self.start_wall, 1e-9)
+        cpu = time.process_time() - self.start_cpu
+        return {
+            "events": self.event_count,
+            "events_per_sec": self.event_count / wall,
+            "idle_pct": 100.0 * self.idle_time / wall,
+            "cpu_pct": 100.0 * cpu / wall,
+        }
+
+    def report(self):
+        self.last_report = time.monotonic()
+        s = self.stats()
+        print(f"loop: {s['events']} events ({s['events_per_sec']:.2f}/s), "
+              f"idle {s['idle_pct']:.1f}%, cpu {s['cpu_pct']:.1f}%")
@@ -0,0 +1,149 @@
+import smbus
+import threading
+import time
+import bisect
+
+# Upper bounds (seconds) of the latency histogram buckets, the last bucket is open ended
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+class FairLock:
+    def __init__(self):
+        """Ticket lock, waiters are served strictly in arrival order."""
+        self.cond = threading.Condition()
+        self.next_ticket = 0
+        self.serving = 0
+
+    def acquire(self):
+        with self.cond:
+            ticket = self.next_ticket
+            self.next_ticket += 1
+            while ticket != self.serving:
+                self.cond.wait()
+
+    def release(self):
+        with self.cond:
+            self.serving += 1
+            self.cond.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class DeviceStats:
+    def __init__(self):
+        self.transactions = 0
+        self.bytes = 0
+        self.latency_total = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def record(self, nbytes, latency):
+        self.transactions += 1
+        self.bytes += nbytes
+        self.latency_total += latency
+        self.histogram[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+
+    def as_dict(self):
+        return {
+            "transactions": self.transactions,
+            "bytes": self.bytes,
+            "mean_latency": self.latency_total / self.transactions if self.transactions else 0.0,
+            "histogram": list(self.histogram),
+        }
+
+
+class I2CBus:
+    # One manager per bus number, shared by every driver in the process
+    buses = {}
+    buses_lock = threading.Lock()
+
+    # Max data bytes per SMBus block write (plus the command byte)
+    BLOCK_SIZE = 32
+
+    @classmethod
+    def get(cls, bus_number=1):
+        """Returns the shared manager for a bus, opening it on first use."""
+        with cls.buses_lock:
+            if bus_number not in cls.buses:
+                cls.buses[bus_number] = cls(bus_number)
+            return cls.buses[bus_number]
+
+    def __init__(self, bus_number=1):
+        self.bus_number = bus_number
+        self.bus = smbus.SMBus(bus_number)
+        self.lock = FairLock()
+
+        # Raw writes waiting to be merged, address -> list of [data, done]
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+
+        self.stats = {}
+
+    def record(self, addr, nbytes, latency):
+        if addr not in self.stats:
+            self.stats[addr] = DeviceStats()
+        self.stats[addr].record(nbytes, latency)
+
+    def transfer(self, addr, nbytes, fn, *args):
+        with self.lock:
+            start = time.perf_counter()
+            result = fn(*args)
+            self.record(addr, nbytes, time.perf_counter() - start)
+        return result
+
+    def write_byte(self, addr, value):
+        self.transfer(addr, 1, self.bus.write_byte, addr, value)
+
+    def write_byte_data(self, addr, register, value):
+        self.transfer(addr, 2, self.bus.write_byte_data, addr, register, value)
+
+    def read_byte_data(self, addr, register):
+        return self.transfer(addr, 2, self.bus.read_byte_data, addr, register)
+
+    def read_i2c_block_data(self, addr, register, length):
+        return self.transfer(addr, 1 + length, self.bus.read_i2c_block_data, addr, register, length)
+
+    def write_i2c_block_data(self, addr, register, data):
+        self.transfer(addr, 1 + len(data), self.bus.write_i2c_block_data, addr, register, data)
+
+    def write_raw(self, addr, data):
+        """
+        Write a byte stream to a device that has no register map (such as a
+        PCF8574 backpack). Streams queued for the same device while the bus
+        is busy are merged and sent by whichever caller gets the bus first.
+
+        :param addr: 7-bit device address.
+        :param data: Bytes to write, in order.
+        """
+        item = [list(data), False]
+        with self.pending_lock:
+            self.pending.setdefault(addr, []).append(item)
+
+        with self.lock:
+            if item[1]:
+                return  # Already sent by an earlier lock holder
+            with self.pending_lock:
+                queued = self.pending.pop(addr, [])
+
+            merged = []
+            for entry in queued:
+                merged += entry[0]
+                entry[1] = True
+
+            for start in range(0, len(merged), self.BLOCK_SIZE + 1):
+                chunk = merged[start:start + self.BLOCK_SIZE + 1]
+                begin = time.perf_counter()
+                self.bus.write_i2c_block_data(addr, chunk[0], chunk[1:])
+                self.record(addr, len(chunk), time.perf_counter() - begin)
+
+    def get_stats(self):
+        """Returns per-device transaction counts, bytes and latency histograms keyed by address."""
+        return {addr: stats.as_dict() for addr, stats in self.stats.items()}
+
+    def report(self):
+        for addr, stats in sorted(self.get_stats().items()):
+            print(f"i2c-{self.bus_number} 0x{addr:02X}: {stats['transactions']} transactions, "
+                  f"{stats['bytes']} bytes, mean {stats['mean_latency'] * 1000:.2f} ms")
@@ -0,0 +1,114 @@
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+# Header: magic, version, capacity, next sequence to write, first sequence not yet acknowledged
+HEADER = struct.Struct('<4sIIQQ')
+HEADER_SIZE = 64
+MAGIC = b'SSJ1'
+VERSION = 1
+
+# Record: sequence, time, last opened, status, cam1, cam2, crc32 of the preceding bytes
+RECORD = struct.Struct('<QIIBBBxI')
+
+class Journal:
+    def __init__(self, path, capacity=65536):
+        """
+        Append-only ring of fixed-size status records in a memory-mapped file.
+        When full, the oldest records are overwritten, so the file never grows.
+
+        :param path: Journal file, created and preallocated if missing.
+        :param capacity: Number of records kept.
+        """
+        self.path = path
+        self.capacity = capacity
+        self.lost = 0
+        self.lock = threading.Lock()
+        size = HEADER_SIZE + capacity * RECORD.size
+
+        exists = os.path.exists(path) and os.path.getsize(path) == size
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT)
+        if not exists:
+            os.ftruncate(self.fd, size)
+        self.map = mmap.mmap(self.fd, size)
+
+        magic, version, stored_capacity, head, committed = HEADER.unpack_from(self.map, 0)
+        if exists and magic == MAGIC and version == VERSION and stored_capacity == capacity:
+            self.head = head
+            self.committed = committed
+            # Only records are synced on append, the stored head may be behind the last valid one
+            while self.valid(self.head):
+                self.head += 1
+            if self.head - self.committed > self.capacity:
+                self.committed = self.head - self.capacity
+        else:
+            self.head = 0
+            self.committed = 0
+            self.write_header()
+
+    def write_header(self):
+        HEADER.pack_into(self.map, 0, MAGIC, VERSION, self.capacity, self.head, self.committed)
+
+    def sync(self, offset, size):
+        # msync just the written range, msync wants a page-aligned start
+        start = offset - offset % mmap.PAGESIZE
+        self.map.flush(start, offset + size - start)
+
+    def valid(self, seq):
+        offset = self.offset(seq)
+        stored_seq, *_, crc = RECORD.unpack_from(self.map, offset)
+        return stored_seq == seq and crc == zlib.crc32(self.map[offset:offset + RECORD.size - 4])
+
+    def offset(self, seq):
+        return HEADER_SIZE + (seq % self.capacity) * RECORD.size
+
+    def append(self, time, status, cam1, cam2, last_opened):
+        """Store one record and return its sequence number."""
+        with self.lock:
+            seq = self.head
+            offset = self.offset(seq)
+            RECORD.pack_into(self.map, offset, seq, time, last_opened, status, cam1, cam2, 0)
+            crc = zlib.crc32(self.map[offset:offset + RECORD.size - 4])
+            struct.pack_into('<I', self.map, offset + RECORD.size - 4, crc)
+            self.head += 1
+            if self.head - self.committed > self.capacity:
+                # Ring wrapped over records that were never acknowledged
+                self.lost += self.head - self.capacity - self.committed
+                self.committed = self.head - self.capacity
+            self.write_header()
+            self.sync(offset, RECORD.size)
+            return seq
+
+    def read(self, start, limit):
+        """
+        Returns up to limit (seq, (time, status, cam1, cam2, last_opened)) from start on.
+        Records that fail their CRC check are skipped.
+        """
+        records = []
+        with self.lock:
+            start = max(start, self.head - self.capacity)
+            for seq in range(start, min(self.head, start + limit)):
+                offset = self.offset(seq)
+                if not self.valid(seq):
+                    continue
+                _, time, last_opened, status, cam1, cam2, _ = RECORD.unpack_from(self.map, offset)
+                records.append((seq, (time, status, cam1, cam2, last_opened)))
+        return records
+
+    def commit(self, seq):
+        """Mark every record before seq as acknowledged."""
+        with self.lock:
+            if seq > self.committed:
+                self.committed = min(seq, self.head)
+                self.write_header()
+                self.sync(0, HEADER.size)
+
+    def backlog(self):
+        with self.lock:
+            return self.head - self.committed
+
+    def close(self):
+        self.map.close()
+        os.close(self.fd)
@@ -1,12 +1,24 @@
-import smbus
 import time
 import threading
+import queue
+from collections import namedtuple
+from gpiozero import Button
+from I2CBus import I2CBus
+from Metrics import metrics
+
+# Key event pushed to the queue in interrupt mode, timestamp is time.monotonic()
+KeyEvent = namedtuple('KeyEvent', ['key', 'pressed', 'timestamp'])
 
 class Keypad:
-    def __init__(self, address=0x27, bus_number=1):
+    def __init__(self, address=0x27, bus_number=1, int_pin=None, queue_size=64, debounce=0.005):
         # MCP23017 Register Addresses
         self.MCP23017_IODIRA = 0x00  # GPIO direction (A)
         self.MCP23017_IODIRB = 0x01  # GPIO direction (B)
+        self.MCP23017_GPINTENA = 0x04  # Interrupt-on-change enable (A)
+        self.MCP23017_GPINTENB = 0x05  # Interrupt-on-change enable (B)
+        self.MCP23017_INTCONA = 0x08   # Interrupt control (A)
+        self.MCP23017_INTCONB = 0x09   # Interrupt control (B)
+        self.MCP23017_IOCON = 0x0A     # Configuration (shared)
         self.MCP23017_GPPUA = 0x0C   # Pull-up resistor (A)
         self.MCP23017_GPPUB = 0x0D   # Pull-up resistor (B)
         self.MCP23017_GPIOA = 0x12   # GPIO input/output (A)
@@ -15,8 +27,8 @@ class Keypad:
         # MCP23017 I2C Address
         self.MCP23017_ADDRESS = address  # Adjust as needed for your setup
 
-        # Initialize I2C bus
-        self.bus = smbus.SMBus(1)
+        # Shared I2C bus manager
+        self.bus = I2CBus.get(bus_number)
 
         # Configure MCP23017
         # Set all A pins (0-7) as inputs
@@ -37,10 +49,42 @@ class Keypad:
 
         self.key_pressed = None
 
-        self.thread = threading.Thread(target=self.run, daemon=True)
+        # Optional callback for event-driven mode, called with each key
+        self.on_key = None
+
+        # Interrupt mode state
+        self.int_pin = int_pin
+        self.debounce = debounce
+        self.events = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.stable = 0  # Debounced bitmask of pressed keys, bit i = key_mapping[i]
+        self.wake = threading.Event()
+
+        if int_pin is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+        else:
+            self.setup_interrupts()
+            self.thread = threading.Thread(target=self.run_interrupt, daemon=True)
         self.thread.start()
 
+    def setup_interrupts(self):
+        # MIRROR=1 so INTA covers both ports, active-low push-pull output,
+        # BANK=0 and SEQOP=0 so GPIOA/GPIOB can be read in one block
+        self.bus.write_byte_data(self.MCP23017_ADDRESS, self.MCP23017_IOCON, 0x40)
+        # Interrupt on any change compared to the previous pin value
+        self.bus.write_byte_data(self.MCP23017_ADDRESS, self.MCP23017_INTCONA, 0x00)
+        self.bus.write_byte_data(self.MCP23017_ADDRESS, self.MCP23017_INTCONB, 0x00)
+        self.bus.write_byte_data(self.MCP23017_ADDRESS, self.MCP23017_GPINTENA, 0xFF)
+        self.bus.write_byte_data(self.MCP23017_ADDRESS, self.MCP23017_GPINTENB, 0x0F)
+
+        self.int_line = Button(self.int_pin, pull_up=True)
+        self.int_line.when_pressed = self.wake.set
+
+        # Reading the ports clears any interrupt left pending from before setup
+        self.stable = self.read_ports()
+
 
+    @metrics.timed('keypad_read')
     def read_keypad(self):
 
         # Read GPIOA and GPIOB
@@ -51,16 +95,79 @@ class Keypad:
         for i in range(8):  # Pins 0-7 (Port A)
             if not (gpioa & (1 << i)):
                 #print(f"Button {self.key_mapping[i]} pressed pin A{i}")
-                self.key_pressed = self.key_mapping[i]
+                self.set_key(self.key_mapping[i])
                 time.sleep(0.1)
 
         for i in range(4):  # Pins 8-11 (Port B, mapped as 0-3)
             if not (gpiob & (1 << i)):
                 #print(f"Button {self.key_mapping[i + 8]} pressed pin B{i}")
-                self.key_pressed = self.key_mapping[i + 8]
+                self.set_key(self.key_mapping[i + 8])
                 time.sleep(0.1)
 
 
+    def set_key(self, key):
+        metrics.count('keys')
+        if self.on_key:
+            self.on_key(key)
+        else:
+            self.key_pressed = key
+
+
+    def read_ports(self):
+        # GPIOA and GPIOB in one sequential read, returns bitmask of pressed keys (active LOW)
+        gpioa, gpiob = self.bus.read_i2c_block_data(self.MCP23017_ADDRESS, self.MCP23017_GPIOA, 2)
+        return ~(gpioa | (gpiob << 8)) & 0x0FFF
+
+    @metrics.timed('keypad_scan')
+    def scan(self):
+        # Debounce state machine: accept a reading once two samples
+        # taken self.debounce apart agree, then emit one event per changed key
+        timestamp = time.monotonic()
+        raw = self.read_ports()
+        for _ in range(10):
+            time.sleep(self.debounce)
+            confirm = self.read_ports()
+            if confirm == raw:
+                break
+            raw = confirm
+            timestamp = time.monotonic()
+        else:
+            return
+
+        changed = raw ^ self.stable
+        self.stable = raw
+        for i in range(len(self.key_mapping)):
+            if changed & (1 << i):
+                self.push_event(KeyEvent(self.key_mapping[i], bool(raw & (1 << i)), timestamp))
+
+    def push_event(self, event):
+        if event.pressed:
+            metrics.count('keys')
+        if self.on_key:
+            if event.pressed:
+                self.on_key(event.key)
+            return
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            # Keep the newest events, count what was lost
+            self.events.get_nowait()
+            self.dropped += 1
+            self.events.put_nowait(event)
+
+    def run_interrupt(self, resync=5.0):
+        try:
+            while True:
+                # No I2C traffic until INTA fires, the timeout resyncs after a missed edge
+                self.wake.wait(resync)
+                self.wake.clear()
+                self.scan()
+                # INTA still low means a change arrived during the scan
+                if self.int_line.is_pressed:
+                    self.wake.set()
+        except KeyboardInterrupt:
+            print("\nExiting program")
+
     def run(self):
         try:
             while True:
@@ -72,9 +179,26 @@ class Keypad:
 
 
     def get_key(self):
+        if self.int_pin is not None:
+            while True:
+                event = self.get_event(timeout=0)
+                if event is None or event.pressed:
+                    return event and event.key
         key = self.key_pressed
         self.key_pressed = None
         return key
+
+    def get_event(self, timeout=None):
+        """
+        Returns the next KeyEvent in interrupt mode.
+
+        :param timeout: Seconds to wait, 0 for non-blocking, None to block.
+        :return: KeyEvent, or None if the timeout expired.
+        """
+        try:
+            return self.events.get(timeout=timeout) if timeout != 0 else self.events.get_nowait()
+        except queue.Empty:
+            return None
         
 #"""    
 
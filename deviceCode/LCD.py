@@ -1,5 +1,6 @@
-import smbus
 import time
+from I2CBus import I2CBus
+from Metrics import metrics
 
 class LCD:
     def __init__(self, pi_rev = 2, i2c_addr = 0x3F, backlight = True):
@@ -26,14 +27,24 @@ class LCD:
         # Timing constants
         self.E_PULSE = 0.0005
         self.E_DELAY = 0.0005
+        self.CLEAR_DELAY = 0.002 # Clear display needs 1.52ms to execute
 
-        # Open I2C interface
+        # Shadow framebuffer of what the display shows, None = unknown
+        self.shadow = [None, None]
+
+        # Bus traffic counters, last_* cover the most recent message() call
+        self.bytes_sent = 0
+        self.transactions = 0
+        self.last_bytes = 0
+        self.last_transactions = 0
+
+        # Open I2C interface through the shared bus manager
         if pi_rev == 2:
             # Rev 2 Pi uses 1
-            self.bus = smbus.SMBus(1)
+            self.bus = I2CBus.get(1)
         elif pi_rev == 1:
             # Rev 1 Pi uses 0
-            self.bus = smbus.SMBus(0)
+            self.bus = I2CBus.get(0)
         else:
             raise ValueError('pi_rev param must be 1 or 2')
 
@@ -44,6 +55,8 @@ class LCD:
         self.lcd_byte(0x0C, self.LCD_CMD) # 001100 Display On,Cursor Off, Blink Off
         self.lcd_byte(0x28, self.LCD_CMD) # 101000 Data length, number of lines, font size
         self.lcd_byte(0x01, self.LCD_CMD) # 000001 Clear display
+        time.sleep(self.CLEAR_DELAY)
+        self.shadow = [" " * self.LCD_WIDTH, " " * self.LCD_WIDTH]
 
     def lcd_byte(self, bits, mode):
         # Send byte to data pins
@@ -68,8 +81,24 @@ class LCD:
         self.bus.write_byte(self.I2C_ADDR,(bits & ~self.ENABLE))
         time.sleep(self.E_DELAY)
 
-    def message(self, string, line = 1):
-        # display message string on LCD line 1 or 2
+    def encode_byte(self, bits, mode):
+        # Expander states for one byte: each nibble is latched on the falling
+        # edge of ENABLE. A single bus byte at 100kHz takes ~90us, well above
+        # the HD44780 enable pulse width and 37us command time, so no sleeps.
+        bits_high = mode | (bits & 0xF0) | self.LCD_BACKLIGHT
+        bits_low = mode | ((bits<<4) & 0xF0) | self.LCD_BACKLIGHT
+        return [bits_high | self.ENABLE, bits_high,
+                bits_low | self.ENABLE, bits_low]
+
+    def send(self, data):
+        # The bus manager packs expander states into SMBus block writes
+        self.bus.write_raw(self.I2C_ADDR, data)
+        self.last_transactions += -(-len(data) // (self.bus.BLOCK_SIZE + 1))
+        self.last_bytes += len(data)
+
+    @metrics.timed('lcd_message')
+    def message(self, string, line = 1, force = False):
+        # display message string on LCD line 1 or 2, only changed cells are sent
         if line == 1:
             lcd_line = self.LCD_LINE_1
         elif line == 2:
@@ -77,13 +106,45 @@ class LCD:
         else:
             raise ValueError('line number must be 1 or 2')
 
-        string = string.ljust(self.LCD_WIDTH," ")
-
-        self.lcd_byte(lcd_line, self.LCD_CMD)
+        string = string.ljust(self.LCD_WIDTH," ")[:self.LCD_WIDTH]
+        shadow = self.shadow[line - 1]
+        if force or shadow is None:
+            shadow = "\0" * self.LCD_WIDTH
 
+        data = []
+        cursor = None
         for i in range(self.LCD_WIDTH):
-            self.lcd_byte(ord(string[i]), self.LCD_CHR)
+            if string[i] == shadow[i]:
+                continue
+            # A cursor-address command costs the same as one character, so
+            # only jump when skipping more than one unchanged cell
+            if cursor is None or i - cursor > 1:
+                data += self.encode_byte(lcd_line + i, self.LCD_CMD)
+            elif i - cursor == 1:
+                data += self.encode_byte(ord(string[cursor]), self.LCD_CHR)
+            data += self.encode_byte(ord(string[i]), self.LCD_CHR)
+            cursor = i + 1
+
+        self.last_bytes = 0
+        self.last_transactions = 0
+        if data:
+            self.send(data)
+        self.bytes_sent += self.last_bytes
+        self.transactions += self.last_transactions
+        metrics.count('lcd_bytes', self.last_bytes)
+        self.shadow[line - 1] = string
+
+    def get_stats(self):
+        """Returns bus bytes and transactions, in total and for the last message() call."""
+        return {
+            "bytes": self.bytes_sent,
+            "transactions": self.transactions,
+            "last_bytes": self.last_bytes,
+            "last_transactions": self.last_transactions,
+        }
 
     def clear(self):
         # clear LCD display
-        self.lcd_byte(0x01, self.LCD_CMD)
\ No newline at end of file
+        self.lcd_byte(0x01, self.LCD_CMD)
+        time.sleep(self.CLEAR_DELAY)
+        self.shadow = [" " * self.LCD_WIDTH, " " * self.LCD_WIDTH]
\ No newline at end of file
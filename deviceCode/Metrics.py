@@ -0,0 +1,345 @@
+import bisect
+import functools
+import json
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Histogram upper bounds in seconds, one more bucket catches everything above
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+           0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+SCHEMA_VERSION = 1
+MAX_PROFILE_SECONDS = 300
+
+
+class Histogram:
+    __slots__ = ('counts', 'count', 'sum')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        # Prometheus buckets are "less than or equal", bisect_left matches that
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def copy(self):
+        other = Histogram()
+        other.counts = list(self.counts)
+        other.count = self.count
+        other.sum = self.sum
+        return other
+
+
+class Span:
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.monotonic() - self.start)
+        return False
+
+
+class NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Profiler:
+    def __init__(self, seconds, interval=0.01, on_done=None, max_stacks=40, max_depth=16):
+        """
+        Samples every thread's stack for a while and counts identical stacks,
+        in collapsed "outer;inner" form as used by flame graph tools.
+
+        :param seconds: How long to sample.
+        :param interval: Seconds between samples.
+        :param on_done: Called with the result dict when sampling ends.
+        :param max_stacks: Most frequent stacks kept in the result.
+        :param max_depth: Innermost frames kept per stack.
+        """
+        self.seconds = seconds
+        self.interval = interval
+        self.on_done = on_done
+        self.max_stacks = max_stacks
+        self.max_depth = max_depth
+        self.stacks = Counter()
+        self.samples = 0
+        self.thread = threading.Thread(target=self.run, daemon=True, name="profiler")
+        self.thread.start()
+
+    def sample(self):
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == self.thread.ident:
+                continue
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def run(self):
+        start = time.monotonic()
+        end = start + self.seconds
+        while time.monotonic() < end:
+            self.sample()
+            time.sleep(self.interval)
+        result = {"seconds": round(time.monotonic() - start, 2), "samples": self.samples,
+                  "stacks": self.stacks.most_common(self.max_stacks)}
+        if self.on_done:
+            self.on_done(result)
+
+    def running(self):
+        return self.thread.is_alive()
+
+
+class Metrics:
+    def __init__(self):
+        """
+        Spans (timed sections) and counters for the device hot paths, aggregated
+        in memory and exported now and then. Disabled, a span or counter costs one
+        attribute check.
+        """
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.spans = {}
+        self.counters = {}
+        # State at the last MQTT export, messages carry the change since then
+        self.exported_spans = {}
+        self.exported_counters = {}
+        self.exported_at = time.time()
+
+        self.publish = None
+        self.textfile = None
+        self.device = None
+        self.interval = 60.0
+        self.exporter = None
+        self.profiler = None
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def span(self, name):
+        """Context manager timing its block under name."""
+        return Span(self, name) if self.enabled else NULL_SPAN
+
+    def timed(self, name):
+        """Decorator timing every call of the function under name."""
+        def decorate(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                start = time.monotonic()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.observe(name, time.monotonic() - start)
+            return wrapper
+        return decorate
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.spans.get(name)
+            if histogram is None:
+                histogram = self.spans[name] = Histogram()
+            histogram.observe(seconds)
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def to_message(self):
+        """
+        Compact JSON with what changed since the previous call: per span the call
+        count, total seconds and bucket counts (trailing empty buckets dropped).
+        """
+        now = time.time()
+        with self.lock:
+            spans = {name: h.copy() for name, h in self.spans.items()}
+            counters = dict(self.counters)
+        message = {"v": SCHEMA_VERSION, "time": int(now), "interval": round(now - self.exported_at, 1)}
+        if self.device:
+            message["device"] = self.device
+
+        changed = {}
+        for name, histogram in spans.items():
+            previous = self.exported_spans.get(name) or Histogram()
+            count = histogram.count - previous.count
+            if not count:
+                continue
+            buckets = [a - b for a, b in zip(histogram.counts, previous.counts)]
+            while buckets[-1] == 0:
+                buckets.pop()
+            changed[name] = {"n": count, "s": round(histogram.sum - previous.sum, 6), "b": buckets}
+        message["spans"] = changed
+        message["counters"] = {name: value - self.exported_counters.get(name, 0)
+                               for name, value in counters.items()
+                               if value != self.exported_counters.get(name, 0)}
+
+        self.exported_spans, self.exported_counters, self.exported_at = spans, counters, now
+        return json.dumps(message, separators=(',', ':')).encode()
+
+    def to_prometheus(self):
+        """Cumulative metrics in the Prometheus text format."""
+        with self.lock:
+            spans = {name: h.copy() for name, h in self.spans.items()}
+            counters = dict(self.counters)
+        lines = ["# TYPE smartsafe_span_seconds histogram"]
+        for name in sorted(spans):
+            histogram = spans[name]
+            total = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), histogram.counts):
+                total += count
+                lines.append(f'smartsafe_span_seconds_bucket{{span="{name}",le="{bound}"}} {total}')
+            lines.append(f'smartsafe_span_seconds_sum{{span="{name}"}} {histogram.sum:.6f}')
+            lines.append(f'smartsafe_span_seconds_count{{span="{name}"}} {histogram.count}')
+        for name in sorted(counters):
+            lines.append(f"# TYPE smartsafe_{name}_total counter")
+            lines.append(f"smartsafe_{name}_total {counters[name]}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self):
+        # The node_exporter textfile collector may read at any time, so replace atomically
+        tmp = self.textfile + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp, self.textfile)
+
+    def export(self):
+        if self.textfile:
+            try:
+                self.write_textfile()
+            except OSError as e:
+                print(f"metrics textfile failed: {e}")
+        if self.publish:
+            try:
+                self.publish(self.to_message())
+            except Exception as e:
+                print(f"metrics publish failed: {e}")
+
+    def start_export(self, publish=None, textfile=None, interval=60.0, device=None):
+        """
+        Export every interval seconds while enabled.
+
+        :param publish: Called with the compact JSON message bytes, e.g. an MQTT publish.
+        :param textfile: Path of a Prometheus textfile (node_exporter textfile collector).
+        :param interval: Seconds between exports.
+        :param device: Device id sent with every message.
+        """
+        self.publish = publish
+        self.textfile = textfile
+        self.interval = interval
+        self.device = device
+        if self.exporter is None:
+            self.exporter = threading.Thread(target=self.run_export, daemon=True, name="metrics")
+            self.exporter.start()
+
+    def run_export(self):
+        while True:
+            time.sleep(self.interval)
+            if self.enabled:
+                self.export()
+
+    def profile(self, seconds, interval=0.01):
+        """
+        Sample all threads for seconds (capped at MAX_PROFILE_SECONDS), the result
+        is published like the metrics. False if a profile is already running.
+        """
+        if self.profiler and self.profiler.running():
+            return False
+        self.profiler = Profiler(min(float(seconds), MAX_PROFILE_SECONDS), interval, self.profile_done)
+        return True
+
+    def profile_done(self, result):
+        print(f"profile: {result['samples']} samples in {result['seconds']} s")
+        if self.publish:
+            message = {"v": SCHEMA_VERSION, "time": int(time.time()), "profile": result}
+            if self.device:
+                message["device"] = self.device
+            try:
+                self.publish(json.dumps(message, separators=(',', ':')).encode())
+            except Exception as e:
+                print(f"profile publish failed: {e}")
+
+    def command(self, payload):
+        """
+        Remote control, payload is JSON such as {"metrics": true} to enable,
+        {"metrics": false} to disable or {"profile": 30} to profile for 30 s.
+        """
+        try:
+            command = json.loads(payload)
+        except ValueError:
+            command = None
+        if not isinstance(command, dict):
+            print(f"metrics: bad command {payload!r}")
+            return
+        if "metrics" in command:
+            if isinstance(command["metrics"], bool):
+                self.enable() if command["metrics"] else self.disable()
+            else:
+                print(f"metrics: ignoring metrics={command['metrics']!r}, expected true or false")
+        if "profile" in command:
+            seconds = command["profile"]
+            # bool is an int subclass, json true is not a duration
+            if isinstance(seconds, (int, float)) and not isinstance(seconds, bool) and 0 < seconds < math.inf:
+                self.profile(min(float(seconds), MAX_PROFILE_SECONDS))
+            else:
+                print(f"metrics: ignoring profile={seconds!r}, expected seconds > 0")
+
+
+# Shared by every module, instrumented code uses metrics.span(), metrics.timed() and metrics.count()
+metrics = Metrics()
+
+
+if __name__ == '__main__':
+    # Cost per call of an instrumented function, disabled and enabled
+    @metrics.timed('bench')
+    def instrumented():
+        pass
+
+    def plain():
+        pass
+
+    n = 1_000_000
+    results = {}
+    for label, fn in (("plain", plain), ("disabled", instrumented), ("enabled", instrumented)):
+        if label == "enabled":
+            metrics.enable()
+        start = time.perf_counter()
+        for _ in range(n):
+            fn()
+        results[label] = (time.perf_counter() - start) / n * 1e9
+    for label, ns in results.items():
+        print(f"{label}: {ns:.0f} ns/call")
+    print(metrics.to_message().decode())
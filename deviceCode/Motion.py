@@ -0,0 +1,170 @@
+import threading
+import time
+import numpy as np
+
+class MotionDetector:
+    def __init__(self, threshold=25, min_area=0.01, alpha=0.05, step=2, holdoff=1.0, on_motion=None,
+                 lighting=True):
+        """
+        Frame differencing against a running-average background, on greyscale frames.
+
+        :param threshold: Per-pixel difference (0-255) that counts as changed.
+        :param min_area: Fraction of changed pixels that counts as motion.
+        :param alpha: Background update rate per frame, higher adapts faster to light changes.
+        :param step: Use every step-th pixel in both directions.
+        :param holdoff: Min seconds between on_motion calls during continuous motion.
+        :param on_motion: Called with the changed fraction when motion starts, and then
+                          every holdoff seconds while it continues.
+        :param lighting: Ignore brightness changes of the whole frame, e.g. a light switched
+                         on, by subtracting the median difference before thresholding.
+        """
+        self.threshold = threshold
+        self.min_area = min_area
+        self.alpha = alpha
+        self.step = step
+        self.holdoff = holdoff
+        self.on_motion = on_motion
+        self.lighting = lighting
+
+        self.background = None
+        self.motion = False
+        self.last_event = 0.0
+
+        # Statistics, CPU seconds spent in process()
+        self.frames = 0
+        self.events = 0
+        self.cpu_total = 0.0
+        self.cpu_max = 0.0
+
+    def process(self, frame, now=None):
+        """
+        Feed one greyscale frame (2D uint8 array), returns True while there is motion.
+
+        :param now: Frame time in seconds, defaults to time.monotonic().
+        """
+        start = time.thread_time()
+        frame = frame[::self.step, ::self.step].astype(np.float32)
+        if self.background is None or self.background.shape != frame.shape:
+            self.background = frame
+            self.record_cost(start)
+            return False
+
+        diff = frame - self.background
+        if self.lighting:
+            # Median of a sparse grid, an object covering part of the frame does not move it
+            diff -= np.median(diff[::4, ::4])
+        changed = int(np.count_nonzero(np.abs(diff) > self.threshold)) / frame.size
+        # Background follows slow changes, in place to avoid another full-frame allocation
+        self.background *= 1 - self.alpha
+        self.background += self.alpha * frame
+        self.record_cost(start)
+
+        now = time.monotonic() if now is None else now
+        motion = changed >= self.min_area
+        if motion and (not self.motion or now - self.last_event >= self.holdoff):
+            self.last_event = now
+            self.events += 1
+            if self.on_motion:
+                self.on_motion(changed)
+        self.motion = motion
+        return motion
+
+    def record_cost(self, start):
+        cost = time.thread_time() - start
+        self.frames += 1
+        self.cpu_total += cost
+        self.cpu_max = max(self.cpu_max, cost)
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "events": self.events,
+            "cpu_ms_mean": 1000 * self.cpu_total / self.frames if self.frames else 0.0,
+            "cpu_ms_max": 1000 * self.cpu_max,
+        }
+
+
+class MotionMonitor:
+    def __init__(self, camera, detector, fps=5, report_interval=600):
+        """
+        Samples the lores stream of a Camera at a fixed rate and runs the detector on it.
+
+        :param camera: Camera configured with a lores stream.
+        :param fps: Detection frame rate, independent of the recording frame rate.
+        :param report_interval: Seconds between CPU cost reports, 0 disables them.
+        """
+        self.camera = camera
+        self.detector = detector
+        self.interval = 1.0 / fps
+        self.report_interval = report_interval
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        next_frame = time.monotonic()
+        last_report = next_frame
+        while self.running:
+            try:
+                self.detector.process(self.camera.capture_lores())
+            except Exception as e:
+                print(f"Motion capture failed: {e}")
+            now = time.monotonic()
+            if self.report_interval and now - last_report >= self.report_interval:
+                last_report = now
+                s = self.detector.stats()
+                print(f"motion: {s['frames']} frames, {s['events']} events, "
+                      f"{s['cpu_ms_mean']:.2f} ms CPU/frame (max {s['cpu_ms_max']:.2f})")
+            # Fixed rate, skipping missed frames instead of bursting to catch up
+            next_frame = max(next_frame + self.interval, now)
+            time.sleep(max(0.0, next_frame - time.monotonic()))
+
+    def stop(self):
+        self.running = False
+
+
+def load_sequence(path):
+    """Frames saved with save_sequence, as an array of shape (n, height, width)."""
+    with np.load(path) as data:
+        return data['frames']
+
+
+def save_sequence(frames, path):
+    np.savez_compressed(path, frames=np.asarray(frames, dtype=np.uint8))
+
+
+def record_sequence(camera, path, seconds=10, fps=5):
+    """Capture lores frames from a Camera to replay through the detector later."""
+    frames = []
+    for _ in range(int(seconds * fps)):
+        frames.append(camera.capture_lores())
+        time.sleep(1.0 / fps)
+    save_sequence(frames, path)
+
+
+if __name__ == '__main__':
+    # Replays a recorded sequence (python Motion.py frames.npz) through the detector,
+    # without a camera. Without a file, a synthetic 320x240 sequence with sensor noise
+    # and an object crossing the frame from frame 50 to 80 is used.
+    import sys
+
+    fps = 5
+    if len(sys.argv) > 1:
+        frames = load_sequence(sys.argv[1])
+    else:
+        rng = np.random.default_rng(1)
+        frames = np.clip(rng.normal(100, 4, (120, 240, 320)), 0, 255).astype(np.uint8)
+        for i in range(50, 80):
+            x = (i - 50) * 9
+            frames[i, 80:160, x:x + 40] = 220
+
+    events = []
+    detector = MotionDetector(on_motion=lambda changed: events.append((i, changed)))
+    for i, frame in enumerate(frames):
+        detector.process(frame, now=i / fps)
+    for i, changed in events:
+        print(f"frame {i}: motion, {changed * 100:.1f}% changed")
+    s = detector.stats()
+    print(f"{s['frames']} frames {frames.shape[2]}x{frames.shape[1]}, {s['events']} events, "
+          f"{s['cpu_ms_mean']:.3f} ms CPU/frame mean, {s['cpu_ms_max']:.3f} ms max, "
+          f"{s['cpu_ms_mean'] * fps / 10:.2f}% of one core at {fps} fps")
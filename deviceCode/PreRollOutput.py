@@ -0,0 +1,100 @@
+import threading
+import time
+from collections import deque
+from picamera2.outputs import Output
+
+class FileSink:
+    def __init__(self, filename):
+        """Clip target that writes the raw H.264 stream to a single file."""
+        self.file = open(filename, 'wb')
+
+    def write(self, frame, keyframe, captured):
+        self.file.write(frame)
+
+    def close(self):
+        self.file.close()
+
+
+class PreRollOutput(Output):
+    def __init__(self, seconds=5.0, max_bytes=16 * 1024 * 1024):
+        """
+        Encoder output that keeps the last few seconds of H.264 in memory and,
+        once a clip is started, writes that pre-roll followed by the live stream.
+
+        :param seconds: Length of pre-roll to keep.
+        :param max_bytes: Hard cap on buffered bytes, oldest frames are dropped first.
+        """
+        super().__init__()
+        self.seconds = seconds
+        self.max_bytes = max_bytes
+
+        # Ring of (frame, keyframe, monotonic time)
+        self.ring = deque()
+        self.ring_bytes = 0
+        self.lock = threading.Lock()
+
+        self.sink = None
+        self.trigger_time = None
+        self.first_frame_latency = None
+        self.preroll_covered = 0.0
+
+        # Encoder output counters
+        self.frames = 0
+        self.bytes = 0
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, *args, **kwargs):
+        now = time.monotonic()
+        with self.lock:
+            self.frames += 1
+            self.bytes += len(frame)
+            if self.sink is not None:
+                if self.first_frame_latency is None:
+                    self.first_frame_latency = now - self.trigger_time
+                self.sink.write(frame, keyframe, now)
+                return
+            frame = bytes(frame)
+            self.ring.append((frame, keyframe, now))
+            self.ring_bytes += len(frame)
+            self.trim(now)
+
+    def trim(self, now):
+        while self.ring and (self.ring_bytes > self.max_bytes or now - self.ring[0][2] > self.seconds):
+            self.drop()
+        # A clip must start on a keyframe to be decodable
+        while self.ring and not self.ring[0][1]:
+            self.drop()
+
+    def drop(self):
+        frame, _, _ = self.ring.popleft()
+        self.ring_bytes -= len(frame)
+
+    def reset(self):
+        """Drop the buffered pre-roll, e.g. after the stream configuration changed."""
+        with self.lock:
+            self.ring.clear()
+            self.ring_bytes = 0
+
+    def start_clip(self, target):
+        """
+        Write the pre-roll to target and keep appending live frames to it.
+
+        :param target: Filename, or a sink with write(frame, keyframe, captured) and close().
+        """
+        with self.lock:
+            self.trigger_time = time.monotonic()
+            self.sink = FileSink(target) if isinstance(target, str) else target
+            self.first_frame_latency = None
+            self.preroll_covered = 0.0
+            if self.ring:
+                self.preroll_covered = self.trigger_time - self.ring[0][2]
+                for frame, keyframe, captured in self.ring:
+                    self.sink.write(frame, keyframe, captured)
+                self.first_frame_latency = time.monotonic() - self.trigger_time
+            self.ring.clear()
+            self.ring_bytes = 0
+
+    def stop_clip(self):
+        with self.lock:
+            if self.sink is not None:
+                self.sink.close()
+                self.sink = None
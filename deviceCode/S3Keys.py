@@ -0,0 +1,79 @@
+import hashlib
+import time
+import uuid
+from datetime import datetime, date, timezone
+
+# S3 key layout shared by the Lambda and the device. deviceCode/S3Keys.py and
+# cloudCode/S3Keys.py are identical copies, each side deploys on its own.
+# Edit both, deviceCode/tests/test_s3_keys.py fails when they differ.
+#
+#   {kind}/{shard}/{device}/{YYYY-MM-DD}/{HH}/{name}_{epoch ms}_{unique}.{ext}
+#
+# shard is a stable hash of the device id, so writes from a fleet spread over
+# 256 prefixes (S3 request-rate limits apply per prefix) while all objects of
+# one device and day still share a single listable prefix.
+
+def shard(device):
+    return hashlib.md5(device.encode()).hexdigest()[:2]
+
+
+def to_datetime(timestamp):
+    # Accepts epoch seconds, datetime, date or 'YYYY-MM-DD', returns an aware UTC datetime
+    if isinstance(timestamp, str):
+        timestamp = date.fromisoformat(timestamp)
+    if isinstance(timestamp, datetime):
+        return timestamp if timestamp.tzinfo else timestamp.replace(tzinfo=timezone.utc)
+    if isinstance(timestamp, date):
+        return datetime(timestamp.year, timestamp.month, timestamp.day, tzinfo=timezone.utc)
+    return datetime.fromtimestamp(timestamp, timezone.utc)
+
+
+def day_prefix(kind, device, day):
+    """Prefix holding every object of one kind for one device and UTC day."""
+    return f"{kind}/{shard(device)}/{device}/{to_datetime(day).strftime('%Y-%m-%d')}/"
+
+
+def session_prefix(kind, device, timestamp=None, name=None):
+    """Unique key prefix (no extension) for an object, or a folder of objects such as segments."""
+    timestamp = time.time() if timestamp is None else timestamp
+    moment = to_datetime(timestamp)
+    millis = int(moment.timestamp() * 1000)
+    return f"{day_prefix(kind, device, moment)}{moment.strftime('%H')}/{name or device}_{millis}_{uuid.uuid4().hex[:8]}"
+
+
+def object_key(kind, device, timestamp=None, ext='json', name=None):
+    """Unique key for one object, timestamp defaults to now."""
+    return f"{session_prefix(kind, device, timestamp, name)}.{ext}"
+
+
+def parse_key(key):
+    """
+    Split a key built by object_key or session_prefix.
+
+    :return: Dict with kind, device, day, hour, name and time (epoch seconds), or None.
+    """
+    parts = key.split('/')
+    if len(parts) < 6:
+        return None
+    kind, _, device, day, hour, leaf = parts[:6]
+    fields = leaf.split('.')[0].rsplit('_', 2)
+    if len(fields) != 3 or not fields[1].isdigit():
+        return None
+    return {
+        "kind": kind,
+        "device": device,
+        "day": day,
+        "hour": hour,
+        "name": fields[0],
+        "time": int(fields[1]) / 1000,
+    }
+
+
+def list_device_day(s3, bucket, kind, device, day, start_after=None):
+    """Yield the S3 object summaries of one device and day, without scanning other prefixes."""
+    params = {"Bucket": bucket, "Prefix": day_prefix(kind, device, day)}
+    if start_after:
+        params["StartAfter"] = start_after
+    for page in s3.get_paginator('list_objects_v2').paginate(**params):
+        for obj in page.get('Contents', []):
+            yield obj
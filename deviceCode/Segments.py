@@ -0,0 +1,122 @@
+import json
+import threading
+import time
+from collections import namedtuple
+
+# Finished segment handed to the uploader, start is wall-clock time
+Segment = namedtuple('Segment', ['path', 'index', 'start', 'duration', 'size'])
+
+class SegmentWriter:
+    def __init__(self, basename, segment_seconds, on_segment):
+        """
+        Clip sink that cuts the H.264 stream into short files at keyframes.
+        Each segment starts with a keyframe and repeated SPS/PPS headers, so it
+        decodes on its own and the segments concatenate into the full clip.
+
+        Segments are raw H.264 (Annex B), not fragmented MP4 or HLS: the encoder
+        output goes to disk as is, with no muxer on the encoder thread. Browsers
+        do not play raw H.264, cloudCode/Playback.py remuxes a complete session
+        into one MP4 next to its manifest.
+
+        :param basename: Segment files are named {basename}_{index:05d}.h264.
+        :param segment_seconds: Minimum segment length, cut at the next keyframe after it.
+        :param on_segment: Called with each finished Segment. Runs on the encoder
+                           thread, so it must only queue work.
+        """
+        self.basename = basename
+        self.segment_seconds = segment_seconds
+        self.on_segment = on_segment
+
+        self.index = 0
+        self.file = None
+        self.path = None
+        self.start = 0.0
+        self.last = 0.0
+        self.size = 0
+
+    def write(self, frame, keyframe, captured):
+        if keyframe and (self.file is None or captured - self.start >= self.segment_seconds):
+            self.finish()
+            self.path = f'{self.basename}_{self.index:05d}.h264'
+            self.file = open(self.path, 'wb')
+            self.start = captured
+            self.size = 0
+        if self.file is None:
+            return  # Wait for the first keyframe
+        self.file.write(frame)
+        self.size += len(frame)
+        self.last = captured
+
+    def finish(self):
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        # Convert the monotonic capture time to wall-clock time
+        start = time.time() - (time.monotonic() - self.start)
+        self.on_segment(Segment(self.path, self.index, start, self.last - self.start, self.size))
+        self.index += 1
+
+    def close(self):
+        self.finish()
+
+
+class Manifest:
+    def __init__(self, session, camera, framerate, trigger_time):
+        """
+        Per-access-event index of segments, uploaded next to them after
+        every segment so a partial session is still discoverable.
+
+        :param trigger_time: time.monotonic() when the session started.
+        """
+        self.session = session
+        self.camera = camera
+        self.framerate = framerate
+        self.profile = None
+        self.trigger_time = trigger_time
+        self.started = time.time()
+        self.segments = []
+        self.complete = False
+        self.lock = threading.Lock()
+        self.upload_lock = threading.Lock()
+
+        # Upload metrics
+        self.first_segment_latency = None
+        self.upload_bytes = 0
+        self.upload_seconds = 0.0
+
+    def add(self, segment, key):
+        """List a segment once it is queued for upload."""
+        with self.lock:
+            self.segments.append({
+                "key": key,
+                "index": segment.index,
+                "start": segment.start,
+                "duration": round(segment.duration, 3),
+                "size": segment.size,
+            })
+
+    def uploaded(self, size, seconds):
+        """Record a finished segment upload."""
+        with self.lock:
+            if self.first_segment_latency is None:
+                self.first_segment_latency = time.monotonic() - self.trigger_time
+            self.upload_bytes += size
+            self.upload_seconds += seconds
+
+    def throughput(self):
+        """Mean segment upload throughput in bytes/second."""
+        return self.upload_bytes / self.upload_seconds if self.upload_seconds else 0.0
+
+    def to_json(self):
+        with self.lock:
+            return json.dumps({
+                "session": self.session,
+                "camera": self.camera,
+                "started": self.started,
+                "framerate": self.framerate,
+                "profile": self.profile._asdict() if self.profile else None,
+                "format": "h264",
+                "complete": self.complete,
+                "segments": sorted(self.segments, key=lambda s: s["index"]),
+            })
@@ -0,0 +1,525 @@
+import os
+import sys
+import threading
+import time
+import types
+from concurrent.futures import Future
+import numpy as np
+
+# Stand-ins for the safe's hardware and services, so SmartSafe runs on a laptop
+# or in CI. install() must be called before SmartSafe (or any module that
+# imports smbus, gpiozero, picamera2 or boto3) is imported.
+
+# I2C at 100 kHz: 9 bit times per byte, plus start, address and stop
+I2C_BYTE_TIME = 90e-6
+I2C_OVERHEAD = 110e-6
+
+
+class SimSMBus:
+    def __init__(self, devices, byte_time=I2C_BYTE_TIME, overhead=I2C_OVERHEAD):
+        """
+        smbus.SMBus replacement that routes transfers to simulated devices and
+        blocks for as long as the transfer would take on the wire.
+
+        :param devices: Dict of 7-bit address to device with write(data) and read(register, length).
+        """
+        self.devices = devices
+        self.byte_time = byte_time
+        self.overhead = overhead
+        self.lock = threading.Lock()
+        self.transactions = 0
+        self.bytes = 0
+        self.per_device = {}
+
+    def transfer(self, addr, nbytes):
+        device = self.devices.get(addr)
+        if device is None:
+            raise OSError(121, 'Remote I/O error')
+        with self.lock:
+            self.transactions += 1
+            self.bytes += nbytes + 1
+            self.per_device[addr] = self.per_device.get(addr, 0) + 1
+        time.sleep(self.overhead + (nbytes + 1) * self.byte_time)
+        return device
+
+    def write_byte(self, addr, value):
+        self.transfer(addr, 1).write([value])
+
+    def write_byte_data(self, addr, register, value):
+        self.transfer(addr, 2).write([register, value])
+
+    def read_byte_data(self, addr, register):
+        return self.transfer(addr, 2).read(register, 1)[0]
+
+    def read_i2c_block_data(self, addr, register, length):
+        return self.transfer(addr, 1 + length).read(register, length)
+
+    def write_i2c_block_data(self, addr, register, data):
+        self.transfer(addr, 1 + len(data)).write([register] + list(data))
+
+
+class SimMCP23017:
+    GPIOA = 0x12
+    GPIOB = 0x13
+    GPINTENA = 0x04
+
+    def __init__(self, key_mapping, int_pin=None):
+        """
+        MCP23017 with a 12-key keypad wired active low to A0-A7 and B0-B3.
+
+        :param key_mapping: Key for each input bit, in Keypad.key_mapping order.
+        :param int_pin: gpiozero mock pin wired to INTA, driven low while an interrupt is pending.
+        """
+        self.key_mapping = key_mapping
+        self.int_pin = int_pin
+        self.registers = [0] * 0x16
+        self.registers[0x00] = self.registers[0x01] = 0xFF
+        self.pressed = 0
+        self.lock = threading.Lock()
+        if int_pin is not None:
+            int_pin.drive_high()
+
+    def ports(self):
+        return ~self.pressed & 0xFF, (~(self.pressed >> 8) & 0x0F) | 0xF0
+
+    def write(self, data):
+        with self.lock:
+            for i, value in enumerate(data[1:]):
+                self.registers[(data[0] + i) % len(self.registers)] = value
+
+    def read(self, register, length):
+        with self.lock:
+            gpioa, gpiob = self.ports()
+            self.registers[self.GPIOA], self.registers[self.GPIOB] = gpioa, gpiob
+            values = [self.registers[(register + i) % len(self.registers)] for i in range(length)]
+            # Reading GPIO clears the interrupt
+            if self.int_pin is not None and self.GPIOA <= register + length - 1 and register <= self.GPIOB:
+                self.int_pin.drive_high()
+        return values
+
+    def set_key(self, key, pressed):
+        bit = 1 << self.key_mapping.index(key)
+        with self.lock:
+            before = self.pressed
+            self.pressed = self.pressed | bit if pressed else self.pressed & ~bit
+            enabled = self.registers[self.GPINTENA] | (self.registers[self.GPINTENA + 1] << 8)
+            interrupt = (before ^ self.pressed) & enabled
+        if interrupt and self.int_pin is not None:
+            self.int_pin.drive_low()
+
+    def press(self, key):
+        self.set_key(key, True)
+
+    def release(self, key):
+        self.set_key(key, False)
+
+
+class SimLCD:
+    def __init__(self, width=16):
+        """
+        HD44780 behind a PCF8574 backpack (RS = P0, E = P2, D4-D7 = P4-P7), in the
+        same wiring LCD.py drives. Keeps the visible text and a timestamped history.
+        """
+        self.width = width
+        self.ddram = bytearray(b' ' * 0x80)
+        self.address = 0
+        self.four_bit = False
+        self.high = None
+        self.last = 0
+        self.cond = threading.Condition()
+        self.lines = (" " * width, " " * width)
+        self.history = []
+        self.writes = 0
+
+    def write(self, data):
+        for value in data:
+            # The HD44780 latches D4-D7 on the falling edge of E
+            if self.last & 0x04 and not value & 0x04:
+                self.strobe(value)
+            self.last = value
+
+    def read(self, register, length):
+        return [self.last] * length
+
+    def strobe(self, value):
+        nibble = value >> 4
+        if not self.four_bit:
+            # 8-bit mode during initialisation, 0x2_ switches to 4-bit
+            self.four_bit = nibble == 0x2
+            return
+        if self.high is None:
+            self.high = nibble
+            return
+        byte = (self.high << 4) | nibble
+        self.high = None
+        if value & 0x01:
+            self.ddram[self.address & 0x7F] = byte
+            self.address += 1
+            self.writes += 1
+        elif byte == 0x01:
+            self.ddram[:] = b' ' * len(self.ddram)
+            self.address = 0
+        elif byte & 0x80:
+            self.address = byte & 0x7F
+        else:
+            return
+        self.update()
+
+    def update(self):
+        lines = (self.ddram[0:self.width].decode(errors='replace'),
+                 self.ddram[0x40:0x40 + self.width].decode(errors='replace'))
+        if lines != self.lines:
+            with self.cond:
+                self.lines = lines
+                self.history.append((time.monotonic(), lines))
+                self.cond.notify_all()
+
+    def wait_for(self, predicate, since=0.0, timeout=5.0):
+        """Time (monotonic) at which the display first matched predicate(lines) after since, or None."""
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            checked = 0
+            while True:
+                for changed, lines in self.history[checked:]:
+                    if changed >= since and predicate(lines):
+                        return changed
+                checked = len(self.history)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.cond.wait(remaining)
+
+
+class SimEncoder:
+    def __init__(self, bitrate=None, repeat=False, iperiod=None, **kwargs):
+        """picamera2 H264Encoder stand-in, only keeps the settings."""
+        self.bitrate = bitrate or 8_000_000
+        self.repeat = repeat
+        self.iperiod = iperiod or 30
+        self.output = None
+
+
+class SimOutput:
+    def __init__(self, pts=None):
+        self.recording = False
+
+    def start(self):
+        self.recording = True
+
+    def stop(self):
+        self.recording = False
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, *args, **kwargs):
+        pass
+
+
+class SimFfmpegOutput(SimOutput):
+    def __init__(self, output_filename, audio=False, **kwargs):
+        """Writes the synthetic stream to the file as is, there is no container."""
+        super().__init__()
+        self.filename = output_filename
+        self.file = None
+
+    def start(self):
+        self.file = open(self.filename, 'wb')
+        super().start()
+
+    def stop(self):
+        super().stop()
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, *args, **kwargs):
+        if self.file:
+            self.file.write(frame)
+
+
+class SimPicamera2:
+    # Draw a moving object in captured frames, for motion detection scenarios
+    motion = False
+    # Seconds to open a camera, a real one takes about a second
+    open_delay = 0.0
+
+    def __init__(self, camera_num=0):
+        """
+        Picamera2 stand-in. While started it produces frames at the configured
+        rate; with an encoder attached each frame becomes a synthetic H.264
+        access unit sized from the bitrate, with a larger keyframe every iperiod.
+        """
+        self.camera_num = camera_num
+        self.config = None
+        self.framerate = 30
+        self.started = False
+        self.encoder = None
+        self.frames = 0
+        self.lock = threading.Lock()
+        self.thread = None
+        self.rng = np.random.default_rng(camera_num)
+        time.sleep(self.open_delay)
+
+    def create_video_configuration(self, main=None, lores=None, controls=None, **kwargs):
+        config = {"main": dict({"format": "XBGR8888", "size": (1920, 1080)}, **(main or {})),
+                  "controls": dict(controls or {})}
+        if lores:
+            config["lores"] = dict({"format": "YUV420"}, **lores)
+        return config
+
+    def configure(self, config):
+        self.config = config
+        self.framerate = config["controls"].get("FrameRate", 30)
+
+    def start(self):
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        with self.lock:
+            self.started = False
+            thread, self.thread = self.thread, None
+        if thread and thread is not threading.current_thread():
+            thread.join()
+
+    def start_encoder(self, encoder, output):
+        output.start()
+        encoder.output = output
+        with self.lock:
+            self.encoder = encoder
+            self.encoded = 0
+
+    def stop_encoder(self):
+        with self.lock:
+            encoder, self.encoder = self.encoder, None
+        if encoder:
+            encoder.output.stop()
+
+    def start_recording(self, encoder, output):
+        self.start_encoder(encoder, output)
+        self.start()
+
+    def stop_recording(self):
+        self.stop()
+        self.stop_encoder()
+
+    def run(self):
+        next_frame = time.monotonic()
+        while self.started:
+            with self.lock:
+                encoder = self.encoder
+                if encoder:
+                    keyframe = self.encoded % encoder.iperiod == 0
+                    self.encoded += 1
+            self.frames += 1
+            if encoder:
+                size = int(encoder.bitrate / 8 / self.framerate * (4 if keyframe else 0.8))
+                encoder.output.outputframe(bytes(size), keyframe, int(time.monotonic() * 1e6))
+            next_frame = max(next_frame + 1.0 / self.framerate, time.monotonic())
+            time.sleep(max(0.0, next_frame - time.monotonic()))
+
+    def capture_array(self, name='main'):
+        if not self.started:
+            raise RuntimeError('Camera is not running')
+        width, height = self.config[name]["size"]
+        scene = np.full((height, width), 90, np.uint8)
+        scene += self.rng.integers(0, 6, (height, width), dtype=np.uint8)
+        if self.motion:
+            x = int(time.monotonic() * width / 2) % width
+            scene[height // 3:2 * height // 3, x:x + width // 8] = 230
+        if self.config[name]["format"] == "YUV420":
+            return np.vstack([scene, np.full((height // 2, width), 128, np.uint8)])
+        frame = np.empty((height, width, 4), np.uint8)
+        frame[:, :, :3] = scene[:, :, None]
+        frame[:, :, 3] = 255
+        return frame
+
+
+class SimClientError(Exception):
+    def __init__(self, error_response, operation_name):
+        super().__init__(f"{operation_name}: {error_response['Error']['Code']}")
+        self.response = error_response
+
+
+class SimNoCredentialsError(Exception):
+    pass
+
+
+class SimS3:
+    def __init__(self, bandwidth=2_000_000, latency=0.05):
+        """
+        In-memory S3 client: one uplink of bandwidth bytes/second shared evenly by
+        the transfers running at the time (like TCP flows), plus a fixed per-request
+        latency. Object bodies are not kept.
+
+        :param bandwidth: Uplink bytes/second.
+        :param latency: Seconds added to every request.
+        """
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.online = True
+        self.objects = {}
+        self.active = 0
+        self.lock = threading.Lock()
+        self.uploads = 0
+        self.bytes = 0
+        self.first_start = None
+        self.last_done = None
+
+    def transfer(self, key, size, metadata=None):
+        start = time.monotonic()
+        time.sleep(self.latency)
+        if not self.online:
+            raise SimClientError({"Error": {"Code": "RequestTimeout"}}, 'PutObject')
+        with self.lock:
+            self.active += 1
+        try:
+            # Progress in short steps at this transfer's share of the link
+            remaining = size
+            while remaining > 0:
+                with self.lock:
+                    share = self.bandwidth / self.active
+                step = min(0.01, remaining / share)
+                time.sleep(step)
+                remaining -= step * share
+        finally:
+            with self.lock:
+                self.active -= 1
+        with self.lock:
+            self.objects[key] = {"size": size, "metadata": metadata or {}, "time": time.time()}
+            self.uploads += 1
+            self.bytes += size
+            self.first_start = start if self.first_start is None else min(self.first_start, start)
+            self.last_done = time.monotonic()
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, Config=None, Callback=None):
+        self.transfer(Key, os.path.getsize(Filename), (ExtraArgs or {}).get("Metadata"))
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.transfer(Key, len(Body), kwargs.get("Metadata"))
+        return {"ETag": '"sim"'}
+
+    def throughput(self):
+        """Bytes/second over the span from the first upload start to the last finish."""
+        with self.lock:
+            if not self.uploads or self.last_done == self.first_start:
+                return 0.0
+            return self.bytes / (self.last_done - self.first_start)
+
+
+class SimMqttConnection:
+    def __init__(self, latency=0.02):
+        """AWS IoT MQTT connection stand-in, publishes are acknowledged after latency seconds."""
+        self.latency = latency
+        self.online = True
+        self.messages = []
+        self.waiting = []
+        self.packet_ids = iter(range(1, 1 << 31))
+        self.lock = threading.Lock()
+
+    def publish(self, topic, payload, qos=None):
+        future = Future()
+        with self.lock:
+            packet_id = next(self.packet_ids)
+            self.messages.append((time.monotonic(), topic, payload))
+            if not self.online:
+                self.waiting.append((future, packet_id))
+                return future, packet_id
+        threading.Timer(self.latency, future.set_result, [{"packet_id": packet_id}]).start()
+        return future, packet_id
+
+    def set_online(self, online):
+        """Offline publishes stay unacknowledged until the connection comes back."""
+        with self.lock:
+            self.online = online
+            waiting, self.waiting = (self.waiting, []) if online else ([], self.waiting)
+        for future, packet_id in waiting:
+            future.set_result({"packet_id": packet_id})
+
+    def connect(self):
+        future = Future()
+        future.set_result({"session_present": False})
+        return future
+
+    def disconnect(self):
+        return self.connect()
+
+
+class Simulation:
+    def __init__(self, keypad_address, lcd_address, keypad_int_pin, tilt_pin, solenoid_pin,
+                 s3_bandwidth, s3_latency, mqtt_latency):
+        from gpiozero import Device
+        from gpiozero.pins.mock import MockFactory
+        self.pins = MockFactory()
+        Device.pin_factory = self.pins
+
+        # Same mapping as Keypad.key_mapping
+        key_mapping = ["*", "7", "4", "1", "0", "8", "5", "2", "3", "6", "9", "#"]
+        int_pin = self.pins.pin(keypad_int_pin) if keypad_int_pin is not None else None
+        self.keypad = SimMCP23017(key_mapping, int_pin)
+        self.lcd = SimLCD()
+        self.bus = SimSMBus({keypad_address: self.keypad, lcd_address: self.lcd})
+        self.tilt_pin = self.pins.pin(tilt_pin)
+        self.solenoid_pin = self.pins.pin(solenoid_pin)
+        self.s3 = SimS3(s3_bandwidth, s3_latency)
+        self.mqtt = SimMqttConnection(mqtt_latency)
+
+    def tilt(self, tilted):
+        # The tilt switch closes to ground, gpiozero's Button sees low as pressed
+        if tilted:
+            self.tilt_pin.drive_low()
+        else:
+            self.tilt_pin.drive_high()
+
+    def solenoid_on(self):
+        return bool(self.solenoid_pin.state)
+
+    def modules(self):
+        smbus = types.ModuleType('smbus')
+        smbus.SMBus = lambda bus_number=1: self.bus
+
+        picamera2 = types.ModuleType('picamera2')
+        picamera2.Picamera2 = SimPicamera2
+        encoders = types.ModuleType('picamera2.encoders')
+        encoders.H264Encoder = SimEncoder
+        outputs = types.ModuleType('picamera2.outputs')
+        outputs.Output = SimOutput
+        outputs.FfmpegOutput = SimFfmpegOutput
+        picamera2.encoders, picamera2.outputs = encoders, outputs
+
+        boto3 = types.ModuleType('boto3')
+        boto3.client = lambda service, **kwargs: self.s3
+        boto3_s3 = types.ModuleType('boto3.s3')
+        transfer = types.ModuleType('boto3.s3.transfer')
+        transfer.TransferConfig = lambda **kwargs: kwargs
+        botocore = types.ModuleType('botocore')
+        config = types.ModuleType('botocore.config')
+        config.Config = lambda **kwargs: kwargs
+        exceptions = types.ModuleType('botocore.exceptions')
+        exceptions.ClientError = SimClientError
+        exceptions.NoCredentialsError = SimNoCredentialsError
+
+        return {
+            'smbus': smbus,
+            'picamera2': picamera2, 'picamera2.encoders': encoders, 'picamera2.outputs': outputs,
+            'boto3': boto3, 'boto3.s3': boto3_s3, 'boto3.s3.transfer': transfer,
+            'botocore': botocore, 'botocore.config': config, 'botocore.exceptions': exceptions,
+        }
+
+
+def install(keypad_address=0x27, lcd_address=0x26, keypad_int_pin=None, tilt_pin=27, solenoid_pin=17,
+            s3_bandwidth=2_000_000, s3_latency=0.05, mqtt_latency=0.02):
+    """
+    Replace smbus, picamera2 and boto3 with simulators and point gpiozero at
+    its mock pin factory. Defaults match SmartSafe's wiring.
+
+    :param keypad_int_pin: GPIO wired to the MCP23017 INTA, None for a polled keypad.
+    :param s3_bandwidth: Simulated uplink in bytes/second.
+    :return: The Simulation, to drive keys and the tilt switch and read the models.
+    """
+    sim = Simulation(keypad_address, lcd_address, keypad_int_pin, tilt_pin, solenoid_pin,
+                     s3_bandwidth, s3_latency, mqtt_latency)
+    sys.modules.update(sim.modules())
+    return sim
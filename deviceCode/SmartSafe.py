@@ -1,44 +1,104 @@
 import time
-from picamera2 import Picamera2
-from picamera2.encoders import H264Encoder
-from picamera2.outputs import FfmpegOutput
+from Segments import SegmentWriter, Manifest
 from LCD import LCD
+from Display import Display
 from Keypad import Keypad
-from threading import Thread
+from EventLoop import EventLoop
 from Solenoid import Solenoid
 from tilt_switch import TiltSwitch
 from signal import pause
 from datetime import datetime
 import os
-import boto3
-from botocore.exceptions import NoCredentialsError
+import socket
+import threading
+from Uploader import Uploader
+from Spool import Spool, URGENT
+from Metrics import metrics
+from Startup import Startup
+from AuditLog import AuditLog, PIN_ACCEPTED, PIN_REJECTED, PIN_LOCKED, OPENED, CLOSED, SOLENOID, \
+    RECORDING_STARTED, RECORDING_STOPPED
+from Credentials import CredentialEngine
+from S3Keys import object_key, session_prefix
 
 class SmartSafe:
-    def __init__(self, lcd_address=0x26, keypad_address=0x27):
+    def __init__(self, lcd_address=0x26, keypad_address=0x27, loop=None, keypad_int_pin=None,
+                 preroll_seconds=(0, 0), preroll_max_bytes=(16 * 1024 * 1024, 16 * 1024 * 1024),
+                 clip_seconds=10, quiet_period=5, max_session=300, segment_seconds=0, device_id=None,
+                 motion_fps=0, camera_process=False, encoding_profile=None, adaptive_encoding=False,
+                 startup=None):
+
+        # Lock, keypad and LCD come up first so a PIN is accepted as early as possible.
+        # Cameras and the S3 client start in background stages, picamera2, numpy
+        # and boto3 are only imported there.
+        self.startup = startup or Startup()
+
+        # Local record of PIN attempts, opens, unlocks and recordings, synced to S3 on close
+        with self.startup.stage("audit"):
+            self.audit = AuditLog(os.getenv('SMARTSAFE_AUDIT_DIR', os.path.expanduser('~/smartsafe_audit')))
+
+        # Per-user hashed PINs and one-time codes, loaded in the background.
+        # A PIN entered before they are ready waits for them in check_pin.
+        self.credentials = None
+        self.startup.background("credentials", self.load_credentials)
+
+        with self.startup.stage("lock"):
+            self.solenoid = Solenoid(17)
+            self.tswitch = TiltSwitch(27)
+
+        with self.startup.stage("lcd"):
+            self.lcd = LCD(2, lcd_address, True)
+            # All screen output goes through the compositor, which owns the LCD
+            self.display = Display(self.lcd)
+
+        with self.startup.stage("keypad"):
+            # keypad_int_pin is the GPIO wired to MCP23017 INTA, None keeps I2C polling
+            self.keypad = Keypad(keypad_address, int_pin=keypad_int_pin)
 
         self.AWS_ACCESS_KEY = os.getenv('AWS_ACCESS_KEY_ID')
         self.AWS_SECRET_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
         self.BUCKET_NAME = 'smartsafe-logs'
-
-
-        self.keypad = Keypad(keypad_address)
-        self.lcd = LCD(2, lcd_address, True)
-
-        self.picam1 = Picamera2(camera_num=0)
-        self.picam2 = Picamera2(camera_num=1)
-
-        self.video_config1 = self.picam1.create_video_configuration(main={"size": (1920, 1080)})
-        self.picam1.configure(self.video_config1)
-
-        self.video_config2 = self.picam2.create_video_configuration(main={"size": (1920, 1080)})
-        self.picam2.configure(self.video_config2)
-
-        self.encoder1 = H264Encoder()
-        self.encoder2 = H264Encoder()
-
-        self.solenoid = Solenoid(17)
-
-        self.tswitch = TiltSwitch(27)
+        # Identifies this safe in S3 keys and telemetry
+        self.device_id = device_id or os.getenv('SMARTSAFE_DEVICE_ID') or socket.gethostname()
+
+        # Shared S3 client and upload pool, SMARTSAFE_S3_ENDPOINT points it at a local stand-in.
+        # The client is created by the "uploads" stage, spooled uploads wait for it.
+        # One of the three upload workers is kept for snapshots, see Spool reserved
+        self.uploader = Uploader(self.BUCKET_NAME, workers=3, access_key=self.AWS_ACCESS_KEY,
+                                 secret_key=self.AWS_SECRET_KEY,
+                                 endpoint_url=os.getenv('SMARTSAFE_S3_ENDPOINT'),
+                                 connect=False)
+        self.startup.background("uploads", self.uploader.connect)
+
+        # Finished clips wait in an on-disk spool until uploaded, so footage
+        # survives network loss and reboots
+        upload_budget = os.getenv('SMARTSAFE_UPLOAD_BYTES_PER_SEC')
+        self.spool = Spool(os.getenv('SMARTSAFE_SPOOL_DIR', os.path.expanduser('~/smartsafe_spool')),
+                           self.uploader,
+                           bytes_per_sec=float(upload_budget) if upload_budget else None,
+                           quota_bytes=int(os.getenv('SMARTSAFE_SPOOL_QUOTA_MB', '2048')) * 1024 * 1024)
+
+        # Pre-roll length and memory cap are set per camera, 0 seconds disables it
+        # segment_seconds > 0 cuts clips into segments uploaded while still recording
+        # motion_fps > 0 runs motion detection on a 320x240 lores stream at that rate
+        # camera_process runs both cameras and their encoders in a separate process
+        # encoding_profile names an Encoding.PROFILES entry, adaptive_encoding steps it with load
+        self.segment_seconds = segment_seconds
+        lores_size = (320, 240) if motion_fps > 0 else None
+        configs = [{"camera_num": i, "preroll_seconds": preroll_seconds[i],
+                    "preroll_max_bytes": preroll_max_bytes[i], "segmented": segment_seconds > 0,
+                    "lores_size": lores_size, "profile": encoding_profile} for i in range(2)]
+        # Set by the "cameras" stage, recordings are not triggered before it is ready
+        self.camera_worker = None
+        self.camera1 = self.camera2 = None
+        self.picam1 = self.picam2 = None
+        self.encoding_controller = None
+        self.motion_monitors = []
+
+        # Recording sessions: at least clip_seconds long, closed quiet_period
+        # after the last trigger, split into a new clip after max_session
+        self.clip_seconds = clip_seconds
+        self.quiet_period = quiet_period
+        self.max_session = max_session
 
         self.state = 0
 
@@ -46,15 +106,8 @@ class SmartSafe:
 
         self.access = False
 
-        self.picam1_recording = False
-        self.picam2_recording = False
-
         self.password_limit = 16
 
-        self.password = "12345678"
-
-        self.message_displaying = False
-
         self.key_pressed = None
 
         self.monitoring = False
@@ -65,113 +118,283 @@ class SmartSafe:
 
         self.delete_buffer = []
 
+        # Fixed worker pool and dispatcher, replaces per-pass Thread spawns
+        self.loop = loop or EventLoop(workers=6, report_interval=0)
+        self.event_mode = False
+        self.ticking = False
+        self.cam1_future = None
+        self.cam2_future = None
+
+        # Called with the alert fields once a trigger snapshot is in S3
+        self.on_snapshot = None
+        self.snapshot_latencies = []
+
+        # One audit sync at a time, a close during a sync runs another one after it
+        self.audit_sync_lock = threading.Lock()
+        self.audit_syncing = False
+        self.audit_sync_again = False
+
+        self.startup.background("cameras", self.start_cameras, configs, camera_process,
+                                encoding_profile, adaptive_encoding, motion_fps,
+                                # A safe opened while the cameras were starting is recorded now
+                                on_ready=lambda: self.post('tilt', self.tswitch.get_state()))
+
+    def start_cameras(self, configs, camera_process, encoding_profile, adaptive_encoding, motion_fps):
+        # Runs in the background at startup, opening and configuring the cameras takes seconds
+        if camera_process:
+            from CameraWorker import CameraWorker
+            self.camera_worker = CameraWorker(configs)
+            camera1, camera2 = self.camera_worker.cameras
+        else:
+            from Camera import Camera
+            camera1, camera2 = [Camera(**config) for config in configs]
+        self.camera1, self.camera2 = camera1, camera2
+        self.picam1 = self.camera1.picam
+        self.picam2 = self.camera2.picam
+
+        if adaptive_encoding:
+            from Encoding import EncodingController
+            self.encoding_controller = EncodingController([self.camera1, self.camera2], spool=self.spool,
+                                                           start=encoding_profile or "high")
+
+        if motion_fps > 0:
+            from Motion import MotionDetector, MotionMonitor
+            for index, camera in enumerate((self.camera1, self.camera2)):
+                detector = MotionDetector(on_motion=lambda changed, index=index: self.post('motion', index))
+                self.motion_monitors.append(MotionMonitor(camera, detector, fps=motion_fps))
+
+    @property
+    def cameras_ready(self):
+        return self.startup.ready("cameras")
+
     def key_check(self):
         self.key_pressed = self.keypad.get_key()
         if self.key_pressed:
+            self.startup.mark("first_key")
             self.access = True
         else:
             self.access = False
 
     
+    @metrics.timed('password_system')
     def password_system(self):
         if self.state == 0:
-            self.lcd.message("Enter Password:", 1)
-            self.lcd.message(self.buffer, 2)
             key = self.key_pressed
             if key:
                 if key != '#' and key != '*':
                     if len(self.buffer) < self.password_limit:
                         self.buffer += key
-                        self.lcd.message(self.buffer, 2)
 
                 elif key == '#':
-                    if self.buffer == self.password:
-                        Thread(target=self.solenoid.turn_on).start()
-                        Thread(target=self.password_accepted).start()
-                        self.buffer = ""
-
-                    else:
-                        Thread(target=self.password_error).start()
-                        self.buffer = ""
+                    # The slow hash runs on the worker pool, the result comes back as a 'pin' event.
+                    # '#' on an empty buffer is ignored.
+                    if self.buffer:
+                        self.loop.submit(self.check_pin, self.buffer)
+                    self.buffer = ""
 
                 else:
                     if len(self.buffer) > 0:
                         self.buffer = self.buffer[:-1]
-                        self.lcd.message(self.buffer, 2)
-        
+            self.display.set_screen("Enter Password:", self.buffer)
+
         else:
-            self.lcd.message("Authorized:", 1)
-            self.lcd.message("Safe Open", 2)
+            self.display.set_screen("Authorized:", "Safe Open")
+
+    def load_credentials(self):
+        # The index key is kept apart from the hashes
+        credentials = CredentialEngine(
+            os.getenv('SMARTSAFE_CREDENTIALS', os.path.expanduser('~/smartsafe_credentials.json')),
+            os.getenv('SMARTSAFE_PIN_INDEX_KEY', os.path.expanduser('~/.smartsafe_pin_index.key')))
+        if not credentials.users:
+            # First start: SMARTSAFE_DEFAULT_PIN becomes the only user, without it the keypad stays disarmed
+            pin = os.getenv('SMARTSAFE_DEFAULT_PIN')
+            if pin:
+                print("No credentials enrolled, enrolling SMARTSAFE_DEFAULT_PIN")
+                credentials.enroll("default", pin, name="Default")
+            else:
+                print("No credentials enrolled and SMARTSAFE_DEFAULT_PIN not set, keypad disarmed")
+        self.credentials = credentials
+
+    def check_pin(self, entered):
+        """Verify on a worker thread, the PBKDF2 hash would otherwise hold up the event loop."""
+        if self.startup.wait("credentials", 30.0) and self.credentials.users:
+            result = self.credentials.verify(entered, source='keypad')
+        else:
+            result = None
+        if self.event_mode:
+            self.post('pin', (result, len(entered)))
+        else:
+            self.handle_pin((result, len(entered)))
+
+    def handle_pin(self, data):
+        result, length = data
+        if result is None:
+            # No credentials to check against
+            self.audit.append(PIN_REJECTED, length)
+            self.display.show("denied", "Keypad disarmed:", "No users", duration=5, priority=1)
+        elif result.accepted:
+            self.audit.append(PIN_ACCEPTED, length, data=result.user.id.encode()[:20])
+            self.audit.append(SOLENOID, 1)
+            self.loop.submit(self.solenoid.turn_on)
+            self.password_accepted()
+        else:
+            # Only the length of a rejected PIN is kept
+            self.audit.append(PIN_LOCKED if result.retry_after > 0 else PIN_REJECTED, length,
+                              arg=min(int(result.retry_after), 0xFFFF))
+            if result.retry_after > 0:
+                self.display.show("denied", "Locked out:", f"Wait {int(result.retry_after) + 1} s",
+                                  duration=5, blink=0.5, priority=1)
+            else:
+                self.password_error()
+
+    @property
+    def message_displaying(self):
+        return self.display.overlay_active()
 
-    
     def password_error(self):
-        self.message_displaying = True
-        self.lcd.message("Unauthorized:", 1)
-        for i in range(5):
-            #self.lcd.message("Incorrect", 1)
-            self.lcd.message("Access Denied", 2)
-            time.sleep(0.5)
-            self.lcd.message("", 2)
-            time.sleep(0.5)
-        self.message_displaying = False
+        self.display.show("denied", "Unauthorized:", "Access Denied", duration=5, blink=0.5, priority=1)
 
     def password_accepted(self):
-        self.message_displaying = True
-        self.lcd.message("Authorized:", 1)
-        self.lcd.message("Access Granted", 2)
-        
-        time.sleep(5)
-        self.message_displaying = False
-        
+        self.display.show("granted", "Authorized:", "Access Granted", duration=5, priority=1)
 
     def camera_monitoring_system(self):
+        if not self.cameras_ready:
+            return
         self.monitoring = True
         if self.state == 0:
             if self.access:
-                #self.access = False
-                if not self.picam1_recording:
-                    print("camera 1 recording")
-                    Thread(target=self.picam1_record, daemon=True).start()
+                self.cam1_future = self.trigger_recording(self.camera1, self.cam1_future, self.picam1_record)
         if self.state == 1:
-            if not self.picam1_recording:
-                print("camera 1 recording")
-                Thread(target=self.picam1_record,daemon=True).start()
-            if not self.picam2_recording:
-                print("camera 2 recording")
-                Thread(target=self.picam2_record, daemon=True).start()
+            self.cam1_future = self.trigger_recording(self.camera1, self.cam1_future, self.picam1_record)
+            self.cam2_future = self.trigger_recording(self.camera2, self.cam2_future, self.picam2_record)
         self.monitoring = False
-                    
 
+    def camera_idle(self, future):
+        return future is None or future.done()
 
-    def picam1_record(self, duration=10):
-        if not self.picam1_recording:
-            self.picam1_recording = True
-            current_time = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-            filename = f'picam1_log_{current_time}.mp4'
-            output = FfmpegOutput(filename, audio=False)
-            self.picam1.start_recording(self.encoder1, output)
-            time.sleep(duration)
-            self.picam1.stop_recording()
-            print("camera 1 stopped recording")
-            self.upload_to_s3(filename, self.BUCKET_NAME, f'picamera1/{filename}')
-            if os.path.exists(filename): 
-                os.remove(filename)
-            self.picam1_recording = False
-
-    def picam2_record(self, duration=10):
-        if not self.picam2_recording:
-            self.picam2_recording = True
+    def trigger_recording(self, camera, future, record):
+        # Start a session, or extend the one already open
+        if self.camera_idle(future):
+            return self.loop.submit(record, time.monotonic())
+        camera.extend(self.quiet_period)
+        return future
+
+    @property
+    def picam1_recording(self):
+        return self.cameras_ready and self.camera1.recording
+
+    @property
+    def picam2_recording(self):
+        return self.cameras_ready and self.camera2.recording
+
+    @metrics.timed('picam1_record')
+    def picam1_record(self, triggered=None):
+        self.record(self.camera1, 'picam1', 'picamera1', triggered)
+
+    @metrics.timed('picam2_record')
+    def picam2_record(self, triggered=None):
+        self.record(self.camera2, 'picam2', 'picamera2', triggered)
+
+    def record(self, camera, name, prefix, triggered=None):
+        if not camera.recording:
+            print(f"{name} recording")
+            started = time.time()
             current_time = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-            filename = f'picam2_log_{current_time}.mp4'
-            output = FfmpegOutput(filename, audio=False)
-            self.picam2.start_recording(self.encoder2, output)
-            time.sleep(duration)
-            self.picam2.stop_recording()
-            print("camera 2 stopped recording")
-            self.upload_to_s3(filename, self.BUCKET_NAME, f'picamera2/{filename}')
-            if os.path.exists(filename): 
-                os.remove(filename)
-            self.picam2_recording = False
+            filename = f'{name}_log_{current_time}.mp4'
+            manifest = None
+            writer = None
+            if self.segment_seconds:
+                session = os.path.splitext(filename)[0]
+                folder = session_prefix(prefix, self.device_id, started, name)
+                manifest = Manifest(session, name, camera.framerate, time.monotonic())
+                writer = SegmentWriter(session, self.segment_seconds,
+                                       lambda segment: self.upload_segment(segment, folder, manifest))
+            try:
+                profile = camera.start_clip(filename, writer)
+                self.audit.append(RECORDING_STARTED, arg=camera is self.camera2, data=name.encode())
+                if manifest:
+                    manifest.profile = profile
+                    manifest.framerate = profile.framerate
+                camera.extend(self.clip_seconds)
+                self.loop.submit(self.snapshot, camera, name, started, triggered or time.monotonic())
+                self.post('camera')
+                camera.wait_until_quiet(self.max_session)
+                filename = camera.stop_clip()
+                self.audit.append(RECORDING_STOPPED, arg=camera is self.camera2, data=name.encode())
+                print(f"{name} stopped recording, trigger latency {camera.trigger_latency}")
+                if manifest:
+                    manifest.complete = True
+                    self.loop.submit(self.upload_manifest, folder, manifest)
+                elif filename:
+                    # .h264 when remuxing to .mp4 failed
+                    extension = os.path.splitext(filename)[1][1:]
+                    self.upload_clip(filename, object_key(prefix, self.device_id, started, extension, name),
+                                     profile, started, time.time())
+            finally:
+                # The display and telemetry follow the camera state even if the clip failed
+                self.post('camera')
+
+    def snapshot(self, camera, name, started, triggered):
+        # Still from the running camera, spooled ahead of segments and clips
+        try:
+            jpeg = camera.snapshot()
+        except Exception as e:
+            print(f"{name} snapshot failed: {e}")
+            return
+        path = f'{name}_snapshot_{int(started * 1000)}.jpg'
+        with open(path, 'wb') as f:
+            f.write(jpeg)
+        key = object_key('snapshots', self.device_id, started, 'jpg', name)
+        # The event id and key go in both the object metadata and the telemetry alert,
+        # which carries the status record of the moment the snapshot reached S3
+        alert = {"event": f"{self.device_id}_{name}_{int(started * 1000)}", "camera": name, "snapshot": key}
+        self.spool.add(path, key, priority=URGENT, metadata=dict(alert, started=round(started, 3)),
+                       callback=lambda result: self.snapshot_uploaded(alert, triggered))
+
+    def snapshot_uploaded(self, alert, triggered):
+        latency = time.monotonic() - triggered
+        self.snapshot_latencies.append(latency)
+        print(f"{alert['camera']} snapshot in S3 {latency:.2f} s after trigger")
+        if self.on_snapshot:
+            self.on_snapshot(alert)
+
+    def upload_clip(self, filename, object_name, profile=None, started=None, ended=None):
+        # Spooled to disk, the camera is free for the next session while this uploads.
+        # The recorded start and end let the cloud index place the clip without the upload time.
+        metadata = {}
+        if started is not None and ended is not None:
+            metadata.update(started=round(started, 3), ended=round(ended, 3))
+        if profile:
+            metadata.update(profile=profile.name, size=f"{profile.size[0]}x{profile.size[1]}",
+                            framerate=profile.framerate, bitrate=profile.bitrate)
+        self.spool.add(filename, object_name, priority=0, metadata=metadata)
+
+    def upload_segment(self, segment, folder, manifest):
+        # Called on the encoder thread, spooling (with its fsync) runs on the worker pool
+        key = f'{folder}/{os.path.basename(segment.path)}'
+        manifest.add(segment, key)
+        self.loop.submit(self.spool_segment, segment, key, folder, manifest)
+
+    def spool_segment(self, segment, key, folder, manifest):
+        self.spool.add(segment.path, key, priority=1,
+                       callback=lambda result: self.segment_uploaded(result, segment, manifest))
+        self.upload_manifest(folder, manifest)
+
+    def segment_uploaded(self, result, segment, manifest):
+        manifest.uploaded(result.size, result.seconds)
+        if segment.index == 0:
+            print(f"{manifest.camera} first segment in S3 after {manifest.first_segment_latency:.2f} s")
+        print(f"{manifest.camera} segment {segment.index} uploaded at "
+              f"{result.size / max(result.seconds, 1e-6) / 1024:.0f} KiB/s, session mean "
+              f"{manifest.throughput() / 1024:.0f} KiB/s")
+
+    def upload_manifest(self, folder, manifest):
+        # Serialized per manifest; replace=True leaves only the newest version queued
+        with manifest.upload_lock:
+            path = f'{manifest.session}_manifest.json'
+            with open(path, 'w') as f:
+                f.write(manifest.to_json())
+            self.spool.add(path, f'{folder}/manifest.json', priority=1, replace=True)
 
     def get_state(self):
         return self.state
@@ -188,51 +411,150 @@ class SmartSafe:
         else:
             return 0
 
+    @metrics.timed('upload_to_s3')
     def upload_to_s3(self, file_name, bucket, object_name=None):
+        from botocore.exceptions import NoCredentialsError
         if object_name is None:
             object_name = file_name
 
-        s3 = boto3.client(
-            's3',
-            aws_access_key_id=self.AWS_ACCESS_KEY,
-            aws_secret_access_key=self.AWS_SECRET_KEY
-        )
-
         try:
-            s3.upload_file(file_name, bucket, object_name)
+            self.uploader.upload(file_name, object_name, bucket=bucket)
             print(f"Upload Successful: {object_name}")
+            return True
         except FileNotFoundError:
             print("The file was not found")
         except NoCredentialsError:
             print("Credentials not available")
+        return False
 
 
 
     def run(self):
+        self.startup.mark("accepting_keys")
         self.key_check()
         if not self.message_displaying:
             self.password_system()
         
         if not self.monitoring:
-            #self.camera_monitoring_system()
-            self.cameraThread = Thread(target=self.camera_monitoring_system, daemon=True).start()
+            self.camera_monitoring_system()
 
         if self.tswitch.get_state():
-            self.state = 1
+            self.set_state(1)
         else:
-            self.state = 0
-    
+            self.set_state(0)
+
+    def start(self):
+        """
+        Switch to event-driven mode. Keypad and tilt switch callbacks post
+        events to the loop, which must then be run with self.loop.run().
+        Keys are accepted from here on, the cameras may still be starting.
+        """
+        self.event_mode = True
+        self.loop.register('key', self.handle_key)
+        self.loop.register('tilt', self.handle_tilt)
+        self.loop.register('tick', self.handle_tick)
+        self.loop.register('motion', self.handle_motion)
+        self.loop.register('pin', self.handle_pin)
+        self.keypad.on_key = lambda key: self.loop.post('key', key)
+        self.tswitch.on_change = lambda tilted: self.loop.post('tilt', tilted)
+        self.handle_tilt(self.tswitch.get_state())
+        self.startup.mark("accepting_keys")
+
+    def set_state(self, state):
+        if state != self.state:
+            self.audit.append(OPENED if state == 1 else CLOSED)
+            if state == 0:
+                self.loop.submit(self.sync_audit)
+        self.state = state
+
+    def sync_audit(self):
+        # Spools the audit records not yet in S3, they count as synced once uploaded
+        with self.audit_sync_lock:
+            if self.audit_syncing:
+                self.audit_sync_again = True
+                return
+            next_seq, blob = self.audit.export(self.audit.synced)
+            if next_seq <= self.audit.synced:
+                return
+            self.audit_syncing = True
+        try:
+            path = f'audit_{self.audit.synced}_{next_seq}.bin'
+            with open(path, 'wb') as f:
+                f.write(blob)
+            self.spool.add(path, object_key('audit', self.device_id, time.time(), 'bin', 'audit'), priority=1,
+                           callback=lambda result: self.audit_synced(next_seq),
+                           on_drop=lambda reason: self.audit_synced(None))
+        except Exception:
+            self.audit_synced(None)
+            raise
+
+    def audit_synced(self, next_seq):
+        # next_seq is None when the export never reached S3, the same range is exported again
+        if next_seq is not None:
+            self.audit.mark_synced(next_seq)
+        with self.audit_sync_lock:
+            self.audit_syncing = False
+            again, self.audit_sync_again = self.audit_sync_again, False
+        if again:
+            self.loop.submit(self.sync_audit)
+
+    def post(self, event, data=None):
+        if self.event_mode:
+            self.loop.post(event, data)
+
+    def handle_key(self, key):
+        self.startup.mark("first_key")
+        self.key_pressed = key
+        self.access = True
+        if not self.message_displaying:
+            self.password_system()
+        self.camera_monitoring_system()
+        self.key_pressed = None
+        self.access = False
+
+    def handle_tilt(self, tilted):
+        self.set_state(1 if tilted else 0)
+        self.handle_refresh()
+        if self.state == 1 and self.motion_monitors:
+            # Motion events keep the sessions going, a static scene is not re-armed every second
+            self.camera_monitoring_system()
+        elif self.state == 1 and not self.ticking:
+            self.handle_tick()
+
+    def handle_tick(self, data=None):
+        # Re-arm recordings once a second while the safe stays open
+        self.camera_monitoring_system()
+        self.ticking = self.state == 1
+        if self.ticking:
+            self.loop.call_later(1.0, 'tick')
+
+    def handle_motion(self, index):
+        # Motion starts a session on that camera, or extends the open one
+        if index == 0:
+            self.cam1_future = self.trigger_recording(self.camera1, self.cam1_future, self.picam1_record)
+        else:
+            self.cam2_future = self.trigger_recording(self.camera2, self.cam2_future, self.picam2_record)
+
+    def handle_refresh(self, data=None):
+        # No key is pending here, so this only updates the base screen
+        self.password_system()
+
 
     def cleanup(self):
-        try:
-            self.picam1.stop_recording()
-        except:
-            pass
-        try:
-            self.picam2.stop_recording()
-        except:
-            pass
+        if self.encoding_controller:
+            self.encoding_controller.stop()
+        for monitor in self.motion_monitors:
+            monitor.stop()
+        if self.cameras_ready:
+            self.camera1.stop()
+            self.camera2.stop()
+        if self.camera_worker:
+            self.camera_worker.shutdown()
+        self.uploader.shutdown(wait=False)
+        self.loop.stop()
+        self.display.stop()
         self.lcd.clear()
+        self.audit.close()
         print("Resources cleaned up.")
             
         
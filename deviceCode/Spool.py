@@ -0,0 +1,268 @@
+import itertools
+import json
+import os
+import random
+import shutil
+import threading
+import time
+from Metrics import metrics
+
+# Priority of entries that must not wait behind running uploads, e.g. alert snapshots
+URGENT = 2
+
+class Spool:
+    def __init__(self, directory, uploader, bytes_per_sec=None, quota_bytes=2 * 1024 ** 3,
+                 base_backoff=1.0, max_backoff=300.0, reserved=1):
+        """
+        Disk-backed upload queue. Files are moved into directory and listed in an
+        append-only index, so pending uploads survive crashes and reboots. Ready
+        entries are handed to the uploader's pool, at most uploader.workers at a time.
+
+        :param directory: Spool directory, created if missing.
+        :param uploader: Uploader whose pool runs the transfers.
+        :param bytes_per_sec: Upload bandwidth budget, None for unlimited.
+        :param quota_bytes: Disk quota, lowest priority then oldest files are evicted above it.
+        :param base_backoff: First retry delay in seconds, doubled on every failure.
+        :param max_backoff: Retry delay cap in seconds.
+        :param reserved: Upload slots only URGENT entries may use, so they start at once
+                         even while large clips are uploading.
+        """
+        self.directory = directory
+        self.uploader = uploader
+        self.bytes_per_sec = bytes_per_sec
+        self.quota_bytes = quota_bytes
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self.index_path = os.path.join(directory, 'index.log')
+        self.entries = {}
+        self.callbacks = {}
+        self.drop_callbacks = {}
+        self.in_flight = set()
+        self.slots = uploader.workers
+        self.reserved = min(reserved, self.slots - 1)
+        self.ids = itertools.count()
+        self.cond = threading.Condition()
+        self.next_allowed = 0.0
+
+        # Statistics
+        self.uploaded = 0
+        self.failures = 0
+        self.evicted = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self.load()
+
+        self.thread = threading.Thread(target=self.drain, daemon=True)
+        self.thread.start()
+
+    def load(self):
+        # Replay the index instead of scanning the directory, then compact it
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # Torn write from a crash
+                    if record["op"] == "add":
+                        self.entries[record["id"]] = record["entry"]
+                    elif record["op"] == "retry" and record["id"] in self.entries:
+                        self.entries[record["id"]]["attempts"] = record["attempts"]
+                    else:
+                        self.entries.pop(record["id"], None)
+
+        # An add is journaled before its file is moved in, drop entries whose move never happened
+        for entry_id, entry in list(self.entries.items()):
+            if not os.path.exists(entry["path"]):
+                del self.entries[entry_id]
+            else:
+                entry["next_try"] = 0.0
+
+        self.index = None
+        self.compact()
+
+    def compact(self):
+        # Rewrite the index with one add per live entry, atomically
+        if self.index:
+            self.index.close()
+        tmp = self.index_path + '.tmp'
+        with open(tmp, 'w') as f:
+            for entry_id, entry in self.entries.items():
+                f.write(json.dumps({"op": "add", "id": entry_id, "entry": entry}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.index_path)
+        self.index = open(self.index_path, 'a')
+        self.index_records = len(self.entries)
+
+    def journal(self, record):
+        self.index.write(json.dumps(record) + "\n")
+        self.index.flush()
+        os.fsync(self.index.fileno())
+        self.index_records += 1
+
+    def add(self, file_name, object_name, priority=0, metadata=None, replace=False, callback=None,
+            on_drop=None):
+        """
+        Move a finished file into the spool and queue it for upload.
+
+        :param priority: Higher priorities are uploaded first and evicted last.
+        :param metadata: Dict stored as S3 object metadata.
+        :param replace: Drop pending entries for the same object_name, e.g. older manifests.
+        :param callback: Called with the UploadResult once uploaded. Not persisted.
+        :param on_drop: Called with the reason ("evict", "missing" or "replace") if the entry
+                        is dropped without being uploaded. Runs under the spool lock. Not persisted.
+        """
+        entry_id = f"{time.time_ns()}-{next(self.ids)}"
+        path = os.path.join(self.directory, entry_id + os.path.splitext(file_name)[1])
+        entry = {
+            "path": path,
+            "key": object_name,
+            "priority": priority,
+            "size": os.path.getsize(file_name),
+            "added": time.time(),
+            "metadata": metadata or {},
+            "attempts": 0,
+            "next_try": 0.0,
+        }
+        with self.cond:
+            if replace:
+                for old_id in [i for i, e in self.entries.items() if e["key"] == object_name]:
+                    self.remove(old_id, op="replace")
+            self.journal({"op": "add", "id": entry_id, "entry": entry})
+            shutil.move(file_name, path)
+            self.entries[entry_id] = entry
+            if callback:
+                self.callbacks[entry_id] = callback
+            if on_drop:
+                self.drop_callbacks[entry_id] = on_drop
+            self.enforce_quota()
+            self.cond.notify()
+        return entry_id
+
+    def remove(self, entry_id, op="done"):
+        entry = self.entries.pop(entry_id)
+        self.callbacks.pop(entry_id, None)
+        on_drop = self.drop_callbacks.pop(entry_id, None)
+        self.journal({"op": op, "id": entry_id})
+        if os.path.exists(entry["path"]):
+            os.remove(entry["path"])
+        if on_drop and op != "done":
+            on_drop(op)
+
+    def enforce_quota(self):
+        total = sum(e["size"] for e in self.entries.values())
+        victims = sorted(self.entries, key=lambda i: (self.entries[i]["priority"], self.entries[i]["added"]))
+        for entry_id in victims:
+            if total <= self.quota_bytes:
+                break
+            total -= self.entries[entry_id]["size"]
+            print(f"Spool over quota, evicting {self.entries[entry_id]['key']}")
+            self.remove(entry_id, op="evict")
+            self.evicted += 1
+
+    def next_entry(self):
+        # Highest priority first, then oldest, among entries not backing off
+        now = time.monotonic()
+        if len(self.in_flight) >= self.slots:
+            return None, None
+        waiting = [i for i in self.entries if i not in self.in_flight]
+        regular = sum(1 for i in self.in_flight if self.entries.get(i, {}).get("priority", 0) < URGENT)
+        if regular >= self.slots - self.reserved:
+            # Only the reserved slots are free
+            waiting = [i for i in waiting if self.entries[i]["priority"] >= URGENT]
+        ready = [i for i in waiting if self.entries[i]["next_try"] <= now]
+        if ready:
+            return min(ready, key=lambda i: (-self.entries[i]["priority"], self.entries[i]["added"])), None
+        waits = [self.entries[i]["next_try"] - now for i in waiting]
+        return None, min(waits) if waits else None
+
+    def throttle(self, size, urgent=False):
+        # Pace uploads so the average rate stays under the byte budget,
+        # urgent entries count against it but do not wait
+        if not self.bytes_per_sec:
+            return
+        now = time.monotonic()
+        start = max(self.next_allowed, now)
+        self.next_allowed = start + size / self.bytes_per_sec
+        if start > now and not urgent:
+            time.sleep(start - now)
+
+    def drain(self):
+        # Picks entries and hands them to the upload pool, completions come back in finished()
+        while True:
+            with self.cond:
+                entry_id, wait = self.next_entry()
+                while entry_id is None:
+                    self.cond.wait(wait)
+                    entry_id, wait = self.next_entry()
+                entry = dict(self.entries[entry_id])
+                self.in_flight.add(entry_id)
+
+            self.throttle(entry["size"], entry["priority"] >= URGENT)
+            metadata = {k: str(v) for k, v in entry["metadata"].items()}
+            future = self.uploader.submit(entry["path"], entry["key"],
+                                          extra_args={"Metadata": metadata} if metadata else None)
+            started = time.monotonic()
+            future.add_done_callback(lambda f, i=entry_id, e=entry, t=started: self.finished(f, i, e, t))
+
+    def finished(self, future, entry_id, entry, started):
+        if metrics.enabled:
+            metrics.observe('spool_upload', time.monotonic() - started)
+        error = future.exception()
+        if isinstance(error, FileNotFoundError):
+            # Retrying cannot bring the file back, drop the entry for good
+            print(f"Spool file missing, dropping {entry['key']}")
+            with self.cond:
+                self.in_flight.discard(entry_id)
+                if entry_id in self.entries:
+                    self.remove(entry_id, op="missing")
+                self.cond.notify()
+            return
+        if error is not None:
+            metrics.count('upload_failures')
+            self.retry(entry_id, error)
+            return
+        metrics.count('upload_bytes', entry["size"])
+
+        with self.cond:
+            self.in_flight.discard(entry_id)
+            callback = self.callbacks.get(entry_id)
+            if entry_id in self.entries:
+                self.remove(entry_id)
+            self.uploaded += 1
+            if self.index_records > 1000 + 4 * len(self.entries):
+                self.compact()
+            self.cond.notify()
+        print(f"Upload Successful: {entry['key']}")
+        if callback:
+            try:
+                callback(future.result())
+            except Exception as e:
+                print(f"Spool callback failed for {entry['key']}: {e!r}")
+
+    def retry(self, entry_id, error):
+        with self.cond:
+            self.in_flight.discard(entry_id)
+            self.cond.notify()
+            entry = self.entries.get(entry_id)
+            if entry is None:
+                return
+            entry["attempts"] += 1
+            delay = min(self.max_backoff, self.base_backoff * 2 ** (entry["attempts"] - 1))
+            entry["next_try"] = time.monotonic() + delay * random.uniform(0.5, 1.0)
+            self.journal({"op": "retry", "id": entry_id, "attempts": entry["attempts"]})
+            self.failures += 1
+        print(f"Upload failed, retry {entry['attempts']} in {delay:.0f} s: {entry['key']}: {error}")
+
+    def stats(self):
+        with self.cond:
+            return {
+                "pending": len(self.entries),
+                "uploading": len(self.in_flight),
+                "pending_bytes": sum(e["size"] for e in self.entries.values()),
+                "uploaded": self.uploaded,
+                "failures": self.failures,
+                "evicted": self.evicted,
+            }
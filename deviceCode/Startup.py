@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+def process_age():
+    """Seconds since this process was started, from /proc. 0 where that is unavailable."""
+    try:
+        with open('/proc/self/stat') as f:
+            # Field 22 is the start time in clock ticks since boot, the command name may contain spaces
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return 0.0
+    return max(0.0, uptime - start_ticks / os.sysconf('SC_CLK_TCK'))
+
+
+class Startup:
+    def __init__(self, target=1.0):
+        """
+        Startup stages with readiness states and timings. The keypad, LCD and lock
+        come up in the foreground; cameras, the S3 client and MQTT run as
+        background stages the rest of the code checks or waits for.
+
+        :param target: Seconds from process start until keys are accepted.
+        """
+        # Times are relative to process start, so interpreter start-up and imports count
+        self.origin = time.monotonic() - process_age()
+        self.target = target
+        self.cond = threading.Condition()
+        self.stages = {}
+        self.milestones = {}
+
+    def now(self):
+        return time.monotonic() - self.origin
+
+    @contextmanager
+    def stage(self, name):
+        """Time a block as a startup stage. A failure marks the stage failed and is re-raised."""
+        with self.cond:
+            self.stages[name] = {"state": "starting", "start": self.now(), "end": None}
+        try:
+            yield
+        except BaseException as e:
+            self.finish(name, "failed", e)
+            raise
+        self.finish(name, "ready")
+
+    def finish(self, name, state, error=None):
+        with self.cond:
+            stage = self.stages[name]
+            stage["state"] = state
+            stage["end"] = self.now()
+            if error is not None:
+                stage["error"] = repr(error)
+            self.cond.notify_all()
+        duration = stage["end"] - stage["start"]
+        print(f"startup: {name} {state} at {stage['end']:.2f} s ({duration:.2f} s)"
+              + (f": {error}" if error is not None else ""))
+
+    def background(self, name, fn, *args, on_ready=None):
+        """
+        Run fn(*args) as a stage on its own thread, failures are logged and leave the rest running.
+
+        :param on_ready: Called once the stage is ready.
+        """
+        with self.cond:
+            self.stages[name] = {"state": "pending", "start": self.now(), "end": None}
+
+        def run():
+            try:
+                with self.stage(name):
+                    fn(*args)
+            except Exception:
+                return
+            if on_ready:
+                on_ready()
+
+        thread = threading.Thread(target=run, daemon=True, name=f"startup-{name}")
+        thread.start()
+        return thread
+
+    def ready(self, name):
+        stage = self.stages.get(name)
+        return stage is not None and stage["state"] == "ready"
+
+    def wait(self, name, timeout=None):
+        """Block until the stage has finished, True if it is ready."""
+        with self.cond:
+            self.cond.wait_for(lambda: self.stages.get(name, {}).get("end") is not None, timeout)
+        return self.ready(name)
+
+    def mark(self, name):
+        """Record a milestone the first time it is reached."""
+        with self.cond:
+            if name in self.milestones:
+                return
+            self.milestones[name] = self.now()
+        if name == "accepting_keys":
+            verdict = "within" if self.milestones[name] <= self.target else "MISSED"
+            print(f"startup: accepting keys at {self.milestones[name]:.2f} s, "
+                  f"{verdict} the {self.target:.2f} s target")
+        else:
+            print(f"startup: {name} at {self.milestones[name]:.2f} s")
+
+    def report(self):
+        """Stage states and times in seconds since process start, for logs and benchmarks."""
+        with self.cond:
+            stages = {name: dict(stage, seconds=None if stage["end"] is None else stage["end"] - stage["start"])
+                      for name, stage in self.stages.items()}
+            milestones = dict(self.milestones)
+        accepting = milestones.get("accepting_keys")
+        return {"target": self.target, "met": accepting is not None and accepting <= self.target,
+                "milestones": milestones, "stages": stages}
@@ -0,0 +1,264 @@
+import json
+import threading
+import time
+from Metrics import metrics
+
+# Bump when the meaning or order of FIELDS changes
+SCHEMA_VERSION = 1
+
+# Field order of a record in the compact array form
+FIELDS = ("time", "status", "cam1", "cam2", "last opened")
+
+class Telemetry:
+    def __init__(self, publish, heartbeat=300, coalesce=0.5, encoding='json', report_interval=3600,
+                 journal=None, replay_rate=5.0, batch_size=50, device=None):
+        """
+        Publishes safe status on state transitions, plus a slow heartbeat.
+
+        :param publish: Called with the encoded payload bytes. May return a future
+                        that completes when the broker acknowledges the message.
+        :param heartbeat: Seconds without a message before the current state is re-sent.
+        :param coalesce: Transitions within this window go out as one batched message.
+        :param encoding: 'json' (compact), 'cbor' or 'msgpack'.
+        :param report_interval: Seconds between message and byte rate reports.
+        :param journal: Optional Journal. Transitions are stored there first and
+                        only committed once acknowledged, so outages lose nothing.
+        :param replay_rate: Max messages/second while sending journal backlog.
+        :param batch_size: Max records per message when sending journal backlog.
+        :param device: Device id sent with every message, used by the cloud side for S3 keys.
+        """
+        self.publish = publish
+        self.heartbeat = heartbeat
+        self.coalesce = coalesce
+        self.encoding = encoding
+        self.report_interval = report_interval
+        self.journal = journal
+        self.replay_interval = 1.0 / replay_rate
+        self.batch_size = batch_size
+        self.device = device
+
+        if encoding == 'cbor':
+            import cbor2
+            self.dumps = cbor2.dumps
+        elif encoding == 'msgpack':
+            import msgpack
+            self.dumps = msgpack.packb
+        elif encoding == 'json':
+            self.dumps = lambda body: json.dumps(body, separators=(',', ':')).encode()
+        else:
+            raise ValueError('encoding must be json, cbor or msgpack')
+
+        self.cond = threading.Condition()
+        self.state = None
+        self.last_opened = 0
+        self.pending = []
+        self.alerts = []
+        self.flush_at = None
+        self.next_heartbeat = time.monotonic() + heartbeat
+
+        # Journal send state: next sequence to send and unacknowledged ranges
+        self.connected = True
+        self.sent = journal.committed if journal else 0
+        self.inflight = {}
+        self.next_send = 0.0
+
+        # Statistics
+        self.started = time.monotonic()
+        self.messages = 0
+        self.bytes = 0
+        self.last_report = self.started
+
+    def update(self, status, cam1, cam2):
+        """Record the current state, queueing a message if it changed. Cheap to call often."""
+        with self.cond:
+            if (status, cam1, cam2) == self.state:
+                return
+            if status == 1 and (self.state is None or self.state[0] != 1):
+                self.last_opened = int(time.time())
+            self.state = (status, cam1, cam2)
+            self.pending.append(self.record())
+            if self.flush_at is None:
+                self.flush_at = time.monotonic() + self.coalesce
+                self.cond.notify()
+
+    def alert(self, fields):
+        """
+        Publish an out-of-band message as soon as possible, e.g. a snapshot key. Not journaled.
+        The message is a status record of the current state with the fields under "alert".
+        """
+        with self.cond:
+            record = self.record() if self.state is not None else None
+            # Bounded while offline, the oldest alerts go first
+            self.alerts = self.alerts[-99:] + [(record, fields)]
+            self.cond.notify()
+
+    def set_connected(self, connected):
+        """Call from the MQTT interrupted/resumed callbacks."""
+        with self.cond:
+            self.connected = connected
+            if connected and self.journal:
+                # Resend everything the broker has not acknowledged
+                self.sent = self.journal.committed
+                self.inflight = {}
+            self.cond.notify()
+
+    def record(self):
+        status, cam1, cam2 = self.state
+        return (int(time.time()), status, cam1, cam2, self.last_opened)
+
+    def to_dict(self, record):
+        time_, status, cam1, cam2, last_opened = record
+        return {
+            "time": time_,
+            "status": 'open' if status == 1 else 'closed',
+            "cam1": 'recording' if cam1 == 1 else 'standby',
+            "cam2": 'recording' if cam2 == 1 else 'standby',
+            "last opened": last_opened,
+        }
+
+    def encode(self, records):
+        records = [self.to_dict(r) for r in records]
+        header = {"v": SCHEMA_VERSION}
+        if self.device:
+            header["device"] = self.device
+        if self.encoding != 'json':
+            # Binary encodings send each record as an array in FIELDS order
+            return self.dumps(dict(header, e=[[r[f] for f in FIELDS] for r in records]))
+        if len(records) == 1:
+            # Same shape as the original status message, plus the schema version and device
+            return self.dumps(dict(records[0], **header))
+        return self.dumps(dict(header, events=records))
+
+    def send(self, records):
+        payload = self.encode(records)
+        with metrics.span('mqtt_publish'):
+            result = self.publish(payload)
+        self.messages += 1
+        self.bytes += len(payload)
+        metrics.count('mqtt_messages')
+        metrics.count('mqtt_bytes', len(payload))
+        self.next_heartbeat = time.monotonic() + self.heartbeat
+        return result
+
+    def send_alert(self, record, fields):
+        header = {"v": SCHEMA_VERSION}
+        if self.device:
+            header["device"] = self.device
+        body = self.to_dict(record) if record else {}
+        payload = self.dumps(dict(body, **header, alert=fields))
+        try:
+            with metrics.span('mqtt_publish'):
+                self.publish(payload)
+        except Exception as e:
+            print(f"telemetry alert failed: {e}")
+            return
+        self.messages += 1
+        self.bytes += len(payload)
+        metrics.count('mqtt_messages')
+        metrics.count('mqtt_bytes', len(payload))
+
+    def drain(self):
+        # Send journal records from self.sent on, rate limited, returns when
+        # caught up, disconnected or the rate limit says wait
+        while self.connected and self.sent < self.journal.head:
+            if time.monotonic() < self.next_send:
+                return
+            batch = self.journal.read(self.sent, self.batch_size)
+            if not batch:
+                # A whole batch failed its CRC check, skip just that run
+                self.sent = min(self.sent + self.batch_size, self.journal.head)
+                continue
+            start, end = self.sent, batch[-1][0] + 1
+            self.sent = end
+            self.inflight[start] = [end, False]
+            self.next_send = time.monotonic() + self.replay_interval
+            try:
+                future = self.send([record for _, record in batch])
+            except Exception as e:
+                print(f"telemetry publish failed: {e}")
+                self.sent = start
+                del self.inflight[start]
+                return
+            if future is None:
+                self.acked(start)
+            else:
+                future.add_done_callback(lambda f, start=start: f.exception() is None and self.acked(start))
+
+    def acked(self, start):
+        # Commit the journal up to the end of the contiguous acknowledged ranges
+        with self.cond:
+            if start not in self.inflight:
+                return
+            self.inflight[start][1] = True
+            committed = self.journal.committed
+            for key in sorted(self.inflight):
+                end, done = self.inflight[key]
+                if not done:
+                    break
+                committed = max(committed, end)
+                del self.inflight[key]
+            self.journal.commit(committed)
+
+    def run(self):
+        """Publish loop, blocks forever."""
+        while True:
+            with self.cond:
+                now = time.monotonic()
+                deadlines = [self.next_heartbeat, self.last_report + self.report_interval]
+                if self.flush_at is not None:
+                    deadlines.append(self.flush_at)
+                if self.journal and self.connected and self.sent < self.journal.head:
+                    deadlines.append(self.next_send)
+                if self.alerts and self.connected:
+                    deadlines.append(now)
+                if min(deadlines) > now:
+                    self.cond.wait(min(deadlines) - now)
+                    continue
+
+                if self.alerts and self.connected:
+                    alerts, self.alerts = self.alerts, []
+                    for record, fields in alerts:
+                        self.send_alert(record, fields)
+
+                if self.flush_at is not None and now >= self.flush_at:
+                    records, self.pending, self.flush_at = self.pending, [], None
+                    if self.journal:
+                        for record in records:
+                            self.journal.append(*record)
+                    elif self.connected:
+                        self.send(records)
+
+                if self.journal:
+                    self.drain()
+
+                if now >= self.next_heartbeat:
+                    backlog = self.journal.head - self.sent if self.journal else 0
+                    if self.state is not None and self.connected and not backlog:
+                        self.send([self.record()])
+                    else:
+                        self.next_heartbeat = now + self.heartbeat
+
+            if time.monotonic() - self.last_report >= self.report_interval:
+                self.report()
+
+    def stats(self):
+        """
+        Returns message and byte rates per hour, next to what the original
+        once-a-second indent=2 JSON status would have cost.
+        """
+        hours = max(time.monotonic() - self.started, 1.0) / 3600
+        legacy_size = len(json.dumps(self.to_dict(self.record()) if self.state else {}, indent=2))
+        return {
+            "messages_per_hour": self.messages / hours,
+            "bytes_per_hour": self.bytes / hours,
+            "legacy_messages_per_hour": 3600,
+            "legacy_bytes_per_hour": 3600 * legacy_size,
+            "journal_backlog": self.journal.backlog() if self.journal else 0,
+        }
+
+    def report(self):
+        self.last_report = time.monotonic()
+        s = self.stats()
+        print(f"telemetry: {s['messages_per_hour']:.0f} msg/h, {s['bytes_per_hour']:.0f} B/h "
+              f"(was {s['legacy_messages_per_hour']} msg/h, {s['legacy_bytes_per_hour']} B/h), "
+              f"journal backlog {s['journal_backlog']}")
@@ -0,0 +1,125 @@
+import os
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# Result of a finished upload, seconds is wall time spent in the transfer
+UploadResult = namedtuple('UploadResult', ['key', 'size', 'seconds'])
+
+class Uploader:
+    def __init__(self, bucket, workers=2, access_key=None, secret_key=None, endpoint_url=None,
+                 chunk_size=8 * 1024 * 1024, part_concurrency=2, connect=True):
+        """
+        Long-lived S3 client with a bounded worker pool.
+
+        :param bucket: Target bucket.
+        :param workers: Uploads running at the same time.
+        :param endpoint_url: Alternate S3 endpoint, e.g. a local MinIO or moto server for testing.
+        :param chunk_size: Multipart threshold and part size. Clips below it go up in one PUT.
+        :param part_concurrency: Parts of one multipart upload sent in parallel.
+        :param connect: Create the client now. With False, call connect() later, e.g. in a
+                        background startup stage; uploads wait for it.
+        """
+        self.bucket = bucket
+        self.workers = workers
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.endpoint_url = endpoint_url
+        self.chunk_size = chunk_size
+        self.part_concurrency = part_concurrency
+        self.client = None
+        self.transfer_config = None
+        self.connect_lock = threading.Lock()
+        self.connected = threading.Event()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="s3-upload")
+
+        # Statistics
+        self.lock = threading.Lock()
+        self.uploads = 0
+        self.failures = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.latencies = deque(maxlen=100)
+
+        if connect:
+            self.connect()
+
+    def connect(self):
+        """Import boto3 and create the client, slow on a Pi so startup runs it in the background."""
+        with self.connect_lock:
+            try:
+                if self.client is not None:
+                    return
+                import boto3
+                from boto3.s3.transfer import TransferConfig
+                from botocore.config import Config
+                # One client and one connection pool for the life of the process,
+                # sized so every worker's parts get a kept-alive connection
+                self.transfer_config = TransferConfig(multipart_threshold=self.chunk_size,
+                                                      multipart_chunksize=self.chunk_size,
+                                                      max_concurrency=self.part_concurrency)
+                self.client = boto3.client(
+                    's3',
+                    aws_access_key_id=self.access_key,
+                    aws_secret_access_key=self.secret_key,
+                    endpoint_url=self.endpoint_url,
+                    config=Config(max_pool_connections=self.workers * self.part_concurrency,
+                                  retries={'max_attempts': 3, 'mode': 'standard'},
+                                  tcp_keepalive=True))
+            finally:
+                self.connected.set()
+
+    def ensure_client(self):
+        # Wait for a connect() in progress, retry here if it failed
+        self.connected.wait()
+        if self.client is None:
+            self.connect()
+
+    def upload(self, file_name, object_name, delete=False, extra_args=None, bucket=None):
+        """Upload a file on the calling thread, raising on failure."""
+        self.ensure_client()
+        size = os.path.getsize(file_name)
+        start = time.monotonic()
+        try:
+            self.client.upload_file(file_name, bucket or self.bucket, object_name,
+                                    ExtraArgs=extra_args, Config=self.transfer_config)
+        except Exception:
+            with self.lock:
+                self.failures += 1
+            raise
+        seconds = time.monotonic() - start
+        self.record(size, seconds)
+        if delete and os.path.exists(file_name):
+            os.remove(file_name)
+        return UploadResult(object_name, size, seconds)
+
+    def submit(self, file_name, object_name, delete=False, extra_args=None, bucket=None):
+        """
+        Queue a file upload without blocking.
+
+        :param delete: Remove the local file once it is uploaded.
+        :return: Future resolving to an UploadResult, or raising the upload error.
+        """
+        return self.pool.submit(self.upload, file_name, object_name, delete, extra_args, bucket)
+
+    def record(self, size, seconds):
+        with self.lock:
+            self.uploads += 1
+            self.bytes += size
+            self.seconds += seconds
+            self.latencies.append(seconds)
+
+    def stats(self):
+        """Returns upload counts, bytes, mean latency and throughput in bytes/s."""
+        with self.lock:
+            return {
+                "uploads": self.uploads,
+                "failures": self.failures,
+                "bytes": self.bytes,
+                "mean_latency": sum(self.latencies) / len(self.latencies) if self.latencies else 0.0,
+                "bytes_per_sec": self.bytes / self.seconds if self.seconds else 0.0,
+            }
+
+    def shutdown(self, wait=True):
+        self.pool.shutdown(wait=wait)
@@ -1,16 +1,22 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: Apache-2.0.
 
-from awscrt import mqtt, http
-from awsiot import mqtt_connection_builder
 import sys
 import threading
 import time
 import json
+import os
 from utils.command_line_utils import CommandLineUtils
 from SmartSafe import SmartSafe
+from Telemetry import Telemetry
+from Journal import Journal
+from Metrics import metrics
+from Startup import Startup
 from threading import Thread
 
+# Bound by import_mqtt(), awscrt is slow to import so it loads on the MQTT thread
+mqtt = http = mqtt_connection_builder = None
+
 # This sample uses the Message Broker for AWS IoT to send and receive messages
 # through an MQTT connection. On startup, the device connects to the server,
 # subscribes to a topic, and begins publishing messages to that topic.
@@ -31,15 +37,28 @@ cam2 = 0
 time_opened = 0
 prev_stat = 0
 last_closed = 0
+telemetry = None
+startup = None
+
+
+def import_mqtt():
+    global mqtt, http, mqtt_connection_builder
+    from awscrt import mqtt, http
+    from awsiot import mqtt_connection_builder
 
 # Callback when connection is accidentally lost.
 def on_connection_interrupted(connection, error, **kwargs):
     print("Connection interrupted. error: {}".format(error))
+    if telemetry:
+        telemetry.set_connected(False)
 
 
 # Callback when an interrupted connection is re-established.
 def on_connection_resumed(connection, return_code, session_present, **kwargs):
     print("Connection resumed. return_code: {} session_present: {}".format(return_code, session_present))
+    if telemetry:
+        # Replays the journal backlog from the last acknowledged record
+        telemetry.set_connected(True)
 
     if return_code == mqtt.ConnectReturnCode.ACCEPTED and not session_present:
         print("Session did not persist. Resubscribing to existing topics...")
@@ -82,6 +101,15 @@ def on_connection_closed(connection, callback_data):
     print("Connection closed")
 
 def mqtt_message_manager():
+    # Runs as the "mqtt" startup stage until connected, the keypad is already usable
+    with startup.stage("mqtt"):
+        mqtt_connection = connect_mqtt()
+    publish_status(mqtt_connection)
+
+
+def connect_mqtt():
+    import_mqtt()
+
     # Create the proxy options if the data is present in cmdData
     proxy_options = None
     if cmdData.input_proxy_host is not None and cmdData.input_proxy_port != 0:
@@ -115,11 +143,56 @@ def mqtt_message_manager():
     # Future.result() waits until a result is available
     connect_future.result()
     print("Connected!")
+    return mqtt_connection
+
 
+def publish_status(mqtt_connection):
     message_count = cmdData.input_count
     message_topic = "devices/smartsafe/status"
     message_string = cmdData.input_message
 
+    # Metrics go out on their own topic, the status topic feeds the S3 pipeline.
+    # {"metrics": true|false} or {"profile": seconds} on the command topic
+    # switches instrumentation or runs the sampling profiler remotely.
+    metrics.start_export(
+        lambda payload: mqtt_connection.publish(
+            topic="devices/smartsafe/metrics",
+            payload=payload,
+            qos=mqtt.QoS.AT_MOST_ONCE),
+        textfile=os.getenv('SMARTSAFE_METRICS_TEXTFILE') or None,
+        interval=float(os.getenv('SMARTSAFE_METRICS_INTERVAL', '60')),
+        device=smartsafe.device_id)
+    subscribe_future, _ = mqtt_connection.subscribe(
+        topic=f"devices/smartsafe/{smartsafe.device_id}/commands",
+        qos=mqtt.QoS.AT_LEAST_ONCE,
+        callback=lambda topic, payload, **kwargs: metrics.command(payload))
+    subscribe_future.result()
+
+    # SMARTSAFE_TELEMETRY=legacy restores the once-a-second status message
+    if os.getenv('SMARTSAFE_TELEMETRY', 'change') == 'legacy':
+        legacy_status_loop(mqtt_connection, message_topic)
+
+    # Status transitions are journaled on disk until the broker acknowledges them
+    journal = Journal(os.getenv('SMARTSAFE_JOURNAL', os.path.expanduser('~/smartsafe_status.journal')))
+
+    global telemetry
+    telemetry = Telemetry(
+        lambda payload: mqtt_connection.publish(
+            topic=message_topic,
+            payload=payload,
+            qos=mqtt.QoS.AT_LEAST_ONCE)[0],
+        journal=journal,
+        device=smartsafe.device_id,
+        heartbeat=float(os.getenv('SMARTSAFE_HEARTBEAT', '300')),
+        coalesce=float(os.getenv('SMARTSAFE_COALESCE', '0.5')),
+        encoding=os.getenv('SMARTSAFE_TELEMETRY_ENCODING', 'json'))
+    telemetry.update(status, cam1, cam2)
+    # Snapshot keys go out right away, linked to the status by time and device
+    smartsafe.on_snapshot = telemetry.alert
+    telemetry.run()
+
+
+def legacy_status_loop(mqtt_connection, message_topic):
     global status
     global cam1
     global cam2
@@ -160,22 +233,67 @@ def mqtt_message_manager():
                 "last opened": time_opened,
             }, indent=2
         )
-        mqtt_connection.publish(
-            topic=message_topic,
-            payload=message_json,
-            qos=mqtt.QoS.AT_LEAST_ONCE)   
+        with metrics.span('mqtt_publish'):
+            mqtt_connection.publish(
+                topic=message_topic,
+                payload=message_json,
+                qos=mqtt.QoS.AT_LEAST_ONCE)
         time.sleep(1)
         #print(message_json)
 
 
+def sync_status(event=None, data=None):
+    global status
+    global cam1
+    global cam2
+    status = smartsafe.get_state()
+    cam1 = smartsafe.get_cam1()
+    cam2 = smartsafe.get_cam2()
+    if telemetry:
+        telemetry.update(status, cam1, cam2)
+
+
 if __name__ == '__main__':
+    # SMARTSAFE_LOOP=poll restores the original busy loop
+    loop_mode = os.getenv('SMARTSAFE_LOOP', 'event')
+    # GPIO connected to the keypad MCP23017 INTA pin, unset keeps I2C polling
+    keypad_int_pin = os.getenv('SMARTSAFE_KEYPAD_INT_PIN')
+    # Seconds of pre-roll kept in memory for both cameras, 0 disables it
+    preroll = float(os.getenv('SMARTSAFE_PREROLL', '0'))
+    # Segment length for streaming clip upload, 0 uploads one file per clip
+    segment_seconds = float(os.getenv('SMARTSAFE_SEGMENT_SECONDS', '0'))
+    # Motion detection frames per second on the lores streams, 0 disables it
+    motion_fps = float(os.getenv('SMARTSAFE_MOTION_FPS', '0'))
+    # SMARTSAFE_CAMERA_PROCESS=1 moves capture and encoding out of this process
+    camera_process = os.getenv('SMARTSAFE_CAMERA_PROCESS', '0') == '1'
+    # Encoding profile (high, medium, low, minimal), unset keeps 1080p30 encoder defaults
+    encoding_profile = os.getenv('SMARTSAFE_PROFILE') or None
+    # SMARTSAFE_ADAPTIVE_ENCODING=1 steps the profile down under CPU, frame drop or upload pressure
+    adaptive_encoding = os.getenv('SMARTSAFE_ADAPTIVE_ENCODING', '0') == '1'
+    # SMARTSAFE_METRICS=1 turns on hot-path spans and counters from the start
+    if os.getenv('SMARTSAFE_METRICS', '0') == '1':
+        metrics.enable()
+    # Seconds from process start until the keypad accepts a PIN, reported at startup
+    startup = Startup(target=float(os.getenv('SMARTSAFE_STARTUP_TARGET', '1.0')))
     try:
-        smartsafe = SmartSafe()
+        smartsafe = SmartSafe(startup=startup,
+                              keypad_int_pin=int(keypad_int_pin) if keypad_int_pin else None,
+                              preroll_seconds=(preroll, preroll),
+                              segment_seconds=segment_seconds,
+                              motion_fps=motion_fps,
+                              camera_process=camera_process,
+                              encoding_profile=encoding_profile,
+                              adaptive_encoding=adaptive_encoding)
         mqttThread = Thread(target=mqtt_message_manager, daemon=True).start()
-        while True:
-            smartsafe.run()
-            status = smartsafe.get_state()
-            cam1 = smartsafe.get_cam1()
-            cam2 = smartsafe.get_cam2()
+        if loop_mode == 'poll':
+            while True:
+                smartsafe.run()
+                sync_status()
+        else:
+            smartsafe.loop.report_interval = 60
+            smartsafe.loop.add_listener(sync_status)
+            smartsafe.start()
+            sync_status()
+            smartsafe.loop.run()
     except KeyboardInterrupt:
             smartsafe.cleanup()
\ No newline at end of file
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Device modules import each other by file name, as when run from deviceCode
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,96 @@
+import pytest
+
+import AuditLog as audit_module
+from AuditLog import AuditLog, INDEX_EVERY, OPENED, CLOSED, PIN_REJECTED, decode_export
+
+
+class Clock:
+    """Stands in for the time module inside AuditLog."""
+
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock(1_000_000.0)
+    monkeypatch.setattr(audit_module, 'time', clock)
+    return clock
+
+
+def fill(log, clock, count, start=1_000_000.0):
+    # One event per second from start, value is the event number
+    for i in range(count):
+        clock.now = start + i
+        log.append(OPENED if i % 2 else CLOSED, i)
+
+
+def test_query_bounds_are_inclusive(tmp_path, clock):
+    log = AuditLog(str(tmp_path), capacity=64, max_segments=8, sync=False)
+    fill(log, clock, 300)
+
+    events = log.query(1_000_100.0, 1_000_199.0)
+    assert [e.value for e in events] == list(range(100, 200))
+    # Bounds between events
+    assert [e.value for e in log.query(1_000_099.5, 1_000_100.5)] == [100]
+    assert log.query(1_000_100.2, 1_000_100.8) == []
+    # Open ends
+    assert [e.value for e in log.query(None, 1_000_002.0)] == [0, 1, 2]
+    assert [e.value for e in log.query(1_000_297.0)] == [297, 298, 299]
+    # Outside the log
+    assert log.query(2_000_000.0) == []
+    assert log.query(None, 999_999.0) == []
+
+
+def test_query_filters_types(tmp_path, clock):
+    log = AuditLog(str(tmp_path), sync=False)
+    fill(log, clock, 10)
+    clock.now = 1_000_010.0
+    log.append(PIN_REJECTED, 4)
+    assert [e.value for e in log.query(types={PIN_REJECTED})] == [4]
+    assert [e.value for e in log.query(1_000_004.0, 1_000_008.0, types={OPENED})] == [5, 7]
+
+
+def test_last_is_relative_to_now(tmp_path, clock):
+    log = AuditLog(str(tmp_path), sync=False)
+    fill(log, clock, 3 * INDEX_EVERY)
+    clock.now = 1_000_000.0 + 3 * INDEX_EVERY - 1
+    assert [e.value for e in log.last(4)] == list(range(3 * INDEX_EVERY - 5, 3 * INDEX_EVERY))
+
+
+def test_clock_step_back_does_not_hide_events(tmp_path, clock):
+    log = AuditLog(str(tmp_path), sync=False)
+    fill(log, clock, 2 * INDEX_EVERY)
+    # Clock set back an hour, later events carry earlier times
+    fill(log, clock, 2 * INDEX_EVERY, start=1_000_000.0 - 3600)
+    assert len(log.query(1_000_000.0 - 3600, 1_000_000.0 - 3600 + 2 * INDEX_EVERY)) == 2 * INDEX_EVERY
+
+
+def test_rotation_drops_old_segments(tmp_path, clock):
+    log = AuditLog(str(tmp_path), capacity=64, max_segments=2, sync=False)
+    fill(log, clock, 300)
+    assert log.first == 3 * 64
+    events = log.query()
+    assert [e.seq for e in events] == list(range(3 * 64, 300))
+    assert log.events(0, 10) == []
+
+
+def test_reopen_and_export(tmp_path, clock):
+    log = AuditLog(str(tmp_path), capacity=64, sync=False)
+    fill(log, clock, 100)
+    next_seq, blob = log.export(40)
+    assert next_seq == 100
+    assert [e.seq for e in decode_export(blob)] == list(range(40, 100))
+    log.mark_synced(next_seq)
+    log.close()
+
+    reopened = AuditLog(str(tmp_path), capacity=64, sync=False)
+    assert reopened.head == 100 and reopened.synced == 100
+    assert [e.value for e in reopened.query(1_000_050.0, 1_000_052.0)] == [50, 51, 52]
+    assert reopened.export(reopened.synced) == (100, blob[:8])
@@ -0,0 +1,69 @@
+import time
+
+import pytest
+
+from CameraWorker import CameraWorker
+
+
+class SlowCamera:
+    """Runs in the camera process, every call takes as long as asked."""
+
+    def __init__(self, **kwargs):
+        self.lores_size = None
+        self.recording = False
+        self.trigger_latency = None
+
+    def encoded(self):
+        return 0, 0
+
+    def snapshot(self, seconds):
+        time.sleep(seconds)
+        return b'jpeg'
+
+    def extend(self, seconds):
+        time.sleep(seconds)
+
+    def exit(self):
+        import os
+        os._exit(1)
+
+    def stop(self):
+        pass
+
+
+@pytest.fixture
+def worker():
+    worker = CameraWorker([{}], camera_class=SlowCamera)
+    yield worker
+    worker.shutdown()
+
+
+def test_call_returns_result(worker):
+    assert worker.call(0, 'snapshot', 0) == b'jpeg'
+
+
+def test_call_times_out(worker):
+    begin = time.monotonic()
+    with pytest.raises(RuntimeError, match='timed out'):
+        worker.call(0, 'snapshot', 2, timeout=0.5)
+    assert time.monotonic() - begin < 1.5
+    assert worker.pending == {}
+
+
+def test_extend_does_not_wait(worker):
+    begin = time.monotonic()
+    worker.cameras[0].extend(1)
+    assert time.monotonic() - begin < 0.5
+
+
+def test_process_exit_fails_pending_and_later_calls(worker):
+    worker.call(0, 'snapshot', 0)
+    begin = time.monotonic()
+    with pytest.raises(RuntimeError, match='exited|not running'):
+        # The first call kills the camera process, the second waits for a reply that never comes
+        worker.cast(0, 'exit')
+        worker.call(0, 'snapshot', 30)
+    assert time.monotonic() - begin < 5
+    with pytest.raises(RuntimeError, match='not running'):
+        worker.call(0, 'snapshot', 0)
+    worker.cameras[0].extend(1)
@@ -0,0 +1,123 @@
+import pytest
+
+from Credentials import CredentialEngine, totp
+
+SECRET = b'0123456789abcdef0123'
+NOW = 1_700_000_000.0
+
+
+def engine(tmp_path, **kwargs):
+    return CredentialEngine(str(tmp_path / 'credentials.json'), str(tmp_path / 'index.key'),
+                            iterations=1000, **kwargs)
+
+
+@pytest.fixture
+def credentials(tmp_path):
+    credentials = engine(tmp_path)
+    credentials.enroll("alice", "12345678", name="Alice", totp_secret=SECRET)
+    credentials.enroll("bob", "24681357")
+    return credentials
+
+
+def test_pin_accepts_the_right_user(credentials):
+    result = credentials.verify("24681357", now=NOW)
+    assert result.accepted and result.user.id == "bob" and result.method == 'pin'
+    assert not credentials.verify("11112222", now=NOW).accepted
+
+
+def test_duplicate_and_short_pins_are_refused(credentials):
+    with pytest.raises(ValueError):
+        credentials.enroll("carol", "12345678")
+    with pytest.raises(ValueError):
+        credentials.enroll("carol", "123")
+
+
+def test_lockout_after_failures_doubles_and_persists(tmp_path, credentials):
+    for i in range(2):
+        assert credentials.verify("00000000", now=NOW + i).retry_after == 0
+    locked = credentials.verify("00000000", now=NOW + 2)
+    assert locked.retry_after == pytest.approx(30.0)
+
+    # The right PIN is refused while locked, without counting as another failure
+    during = credentials.verify("12345678", now=NOW + 10)
+    assert not during.accepted and during.retry_after == pytest.approx(22.0)
+
+    # A fresh engine reads the lockout back from disk
+    reloaded = engine(tmp_path)
+    assert reloaded.verify("12345678", now=NOW + 10).retry_after == pytest.approx(22.0)
+
+    # The next failure after the lockout doubles it
+    assert reloaded.verify("00000000", now=NOW + 40).retry_after == pytest.approx(60.0)
+    assert reloaded.verify("12345678", now=NOW + 101).accepted
+    assert "keypad" not in reloaded.failures
+
+
+def test_lockout_is_per_source(credentials):
+    for i in range(3):
+        credentials.verify("00000000", source='keypad', now=NOW + i)
+    assert credentials.verify("12345678", source='keypad', now=NOW + 3).retry_after > 0
+    assert credentials.verify("12345678", source='app', now=NOW + 3).accepted
+
+
+def test_short_entries_do_not_count(credentials):
+    for code in ("", "1", "12", "123") * 3:
+        assert not credentials.verify(code, now=NOW).accepted
+    assert credentials.failures == {}
+    assert credentials.verify("12345678", now=NOW).accepted
+
+
+def test_totp_is_accepted_once(credentials):
+    code = totp(SECRET, int(NOW // 30), 8)
+    result = credentials.verify(code, now=NOW)
+    assert result.accepted and result.user.id == "alice" and result.method == 'totp'
+    assert not credentials.verify(code, now=NOW + 1).accepted
+
+
+def test_totp_window_allows_clock_drift(credentials):
+    previous = totp(SECRET, int(NOW // 30) - 1, 8)
+    assert credentials.verify(previous, now=NOW).accepted
+    too_old = totp(SECRET, int(NOW // 30) - 3, 8)
+    assert not credentials.verify(too_old, now=NOW).accepted
+
+
+def test_totp_replay_after_restart_is_refused(tmp_path, credentials):
+    code = totp(SECRET, int(NOW // 30), 8)
+    assert credentials.verify(code, now=NOW).accepted
+    reloaded = engine(tmp_path)
+    assert not reloaded.verify(code, now=NOW + 1).accepted
+    # A later code still works
+    assert reloaded.verify(totp(SECRET, int(NOW // 30) + 1, 8), now=NOW + 30).accepted
+
+
+def test_users_and_index_survive_reload(tmp_path, credentials):
+    credentials.remove("bob")
+    reloaded = engine(tmp_path)
+    assert sorted(reloaded.users) == ["alice"]
+    assert reloaded.verify("12345678", now=NOW).user.id == "alice"
+    assert not reloaded.verify("24681357", now=NOW).accepted
+
+
+def test_failures_decay_after_a_quiet_window(tmp_path):
+    credentials = engine(tmp_path, failure_window=600.0)
+    credentials.enroll("alice", "12345678")
+    for i in range(2):
+        credentials.verify("00000000", now=NOW + i)
+    # Two stray failures long ago do not bring the next one to a lockout
+    assert credentials.verify("00000000", now=NOW + 700).retry_after == 0
+    assert credentials.failures["keypad"][0] == 1
+
+    # Nor does a lockout double forever, the count starts over after the window
+    for i in range(1, 3):
+        credentials.verify("00000000", now=NOW + 700 + i)
+    assert credentials.retry_after("keypad", NOW + 702) == pytest.approx(30.0)
+    assert credentials.verify("00000000", now=NOW + 740).retry_after == pytest.approx(60.0)
+    assert credentials.verify("00000000", now=NOW + 800 + 600).retry_after == 0
+    assert credentials.failures["keypad"][0] == 1
+
+
+def test_failures_saved_without_the_last_time_still_load(tmp_path, credentials):
+    with open(credentials.lockout_path, 'w') as f:
+        f.write('{"failures": {"keypad": [3, %r]}, "totp_used": {}}' % (NOW + 30))
+    reloaded = engine(tmp_path)
+    assert reloaded.verify("12345678", now=NOW + 10).retry_after == pytest.approx(20.0)
+    assert reloaded.verify("00000000", now=NOW + 40).retry_after == pytest.approx(60.0)
@@ -0,0 +1,35 @@
+import pytest
+
+from Metrics import Metrics, MAX_PROFILE_SECONDS
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    metrics = Metrics()
+    metrics.profiles = []
+    monkeypatch.setattr(metrics, "profile", lambda seconds: metrics.profiles.append(seconds))
+    return metrics
+
+
+def test_enable_disable_and_profile(metrics):
+    metrics.command(b'{"metrics": true, "profile": 30}')
+    assert metrics.enabled
+    assert metrics.profiles == [30.0]
+    metrics.command(b'{"metrics": false}')
+    assert not metrics.enabled
+
+
+def test_profile_is_bounded(metrics):
+    metrics.command(b'{"profile": 1e9}')
+    assert metrics.profiles == [MAX_PROFILE_SECONDS]
+
+
+@pytest.mark.parametrize("payload", [
+    b'not json', b'[1, 2]', b'"profile"', b'30', b'null',
+    b'{"profile": "30"}', b'{"profile": true}', b'{"profile": -5}', b'{"profile": 0}',
+    b'{"profile": NaN}', b'{"profile": Infinity}', b'{"profile": [30]}', b'{"metrics": "false"}',
+])
+def test_bad_commands_are_ignored(metrics, payload):
+    metrics.command(payload)
+    assert not metrics.enabled
+    assert metrics.profiles == []
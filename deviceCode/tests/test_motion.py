@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+
+import Motion
+from Motion import MotionDetector, load_sequence, record_sequence, save_sequence
+
+FPS = 5
+
+
+class ReplayCamera:
+    """Serves prepared lores frames the way Camera.capture_lores does."""
+
+    def __init__(self, frames):
+        self.frames = iter(frames)
+
+    def capture_lores(self):
+        return next(self.frames)
+
+
+def noise(count, level=100, sigma=4, seed=1):
+    rng = np.random.default_rng(seed)
+    return np.clip(rng.normal(level, sigma, (count, 240, 320)), 0, 255).astype(np.uint8)
+
+
+def crossing(frames, first, last, size=(80, 40), speed=9, brightness=220, top=80):
+    # A bright block moving left to right on frames first..last
+    for i in range(first, last + 1):
+        x = (i - first) * speed
+        frames[i, top:top + size[0], x:x + size[1]] = brightness
+    return frames
+
+
+def replay(frames, **kwargs):
+    """Motion state per frame and the frames on_motion fired on."""
+    fired = []
+    detector = MotionDetector(on_motion=lambda changed: fired.append(index), **kwargs)
+    states = []
+    for index, frame in enumerate(frames):
+        states.append(detector.process(frame, now=index / FPS))
+    return states, fired
+
+
+@pytest.fixture
+def recorded(tmp_path, monkeypatch):
+    # A sequence recorded from a (replayed) camera and saved, as done on the device
+    monkeypatch.setattr(Motion.time, 'sleep', lambda seconds: None)
+    path = str(tmp_path / 'crossing.npz')
+    record_sequence(ReplayCamera(crossing(noise(120), 50, 79)), path, seconds=120 / FPS, fps=FPS)
+    return load_sequence(path)
+
+
+def test_sequence_round_trip(tmp_path):
+    frames = noise(3)
+    path = str(tmp_path / 'frames.npz')
+    save_sequence(list(frames), path)
+    loaded = load_sequence(path)
+    assert loaded.dtype == np.uint8 and loaded.shape == (3, 240, 320)
+    assert np.array_equal(loaded, frames)
+
+
+def test_crossing_object_triggers_and_clears(recorded):
+    assert recorded.shape == (120, 240, 320)
+    states, fired = replay(recorded)
+    # Motion on exactly the frames the object is in view
+    assert [i for i, motion in enumerate(states) if motion] == list(range(50, 80))
+    # Once when it starts, then every holdoff second (5 frames) while it lasts
+    assert fired == [50, 55, 60, 65, 70, 75]
+
+
+def test_holdoff_spaces_events(recorded):
+    _, fired = replay(recorded, holdoff=2.0)
+    assert fired == [50, 60, 70]
+
+
+def test_motion_restarts_after_quiet():
+    frames = crossing(crossing(noise(100), 20, 29, top=20), 60, 69, top=140)
+    states, fired = replay(frames)
+    # The background takes in part of a short crossing, motion clears one frame after it
+    assert [i for i, motion in enumerate(states) if motion] == list(range(20, 31)) + list(range(60, 71))
+    assert fired == [20, 25, 30, 60, 65, 70]
+
+
+def test_sensor_noise_does_not_trigger():
+    states, fired = replay(noise(120, sigma=6))
+    assert not any(states) and fired == []
+
+
+def test_small_object_below_min_area_does_not_trigger():
+    # 20x20 of 320x240 is 0.5%, under the 1% default
+    states, fired = replay(crossing(noise(60), 20, 40, size=(20, 20), speed=4))
+    assert not any(states) and fired == []
+
+
+def test_lighting_step_does_not_trigger():
+    frames = noise(100)
+    frames[50:] = np.clip(frames[50:].astype(np.int16) + 60, 0, 255).astype(np.uint8)
+    states, fired = replay(frames)
+    assert not any(states) and fired == []
+
+
+def test_lighting_step_triggers_without_compensation():
+    frames = noise(100)
+    frames[50:] = np.clip(frames[50:].astype(np.int16) + 60, 0, 255).astype(np.uint8)
+    states, fired = replay(frames, lighting=False)
+    assert states[50] and fired[0] == 50
+
+
+def test_object_after_lighting_step_still_triggers():
+    frames = noise(100)
+    frames[30:] = np.clip(frames[30:].astype(np.int16) + 60, 0, 255).astype(np.uint8)
+    states, fired = replay(crossing(frames, 60, 79, brightness=255))
+    assert [i for i, motion in enumerate(states) if motion] == list(range(60, 80))
+    assert fired[0] == 60
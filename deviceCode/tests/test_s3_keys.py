@@ -0,0 +1,23 @@
+import os
+
+import pytest
+
+import S3Keys
+
+DEVICE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLOUD = os.path.join(os.path.dirname(DEVICE), 'cloudCode', 'S3Keys.py')
+
+
+@pytest.mark.skipif(not os.path.exists(CLOUD), reason="deviceCode deployed without cloudCode")
+def test_device_and_cloud_copies_are_identical():
+    device = os.path.join(DEVICE, 'S3Keys.py')
+    assert not os.path.islink(device)
+    with open(device, 'rb') as a, open(CLOUD, 'rb') as b:
+        assert a.read() == b.read(), "deviceCode/S3Keys.py and cloudCode/S3Keys.py differ"
+
+
+def test_key_round_trip():
+    key = S3Keys.object_key('picamera1', 'safe-01', 1_760_000_000.25, 'mp4', 'picam1')
+    assert key.startswith(S3Keys.day_prefix('picamera1', 'safe-01', '2025-10-09') + '08/picam1_1760000000250_')
+    assert S3Keys.parse_key(key) == {"kind": "picamera1", "device": "safe-01", "day": "2025-10-09",
+                                     "hour": "08", "name": "picam1", "time": 1_760_000_000.25}
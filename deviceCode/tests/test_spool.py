@@ -0,0 +1,151 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from Spool import Spool, URGENT
+from Uploader import UploadResult
+
+
+class FakeUploader:
+    """Hands out futures the test completes by hand."""
+
+    def __init__(self, workers=2):
+        self.workers = workers
+        self.submitted = []
+        self.lock = threading.Lock()
+
+    def submit(self, file_name, object_name, delete=False, extra_args=None, bucket=None):
+        future = Future()
+        with self.lock:
+            self.submitted.append((object_name, file_name, future))
+        return future
+
+    def wait_for(self, count, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.lock:
+                if len(self.submitted) >= count:
+                    return list(self.submitted)
+            time.sleep(0.005)
+        raise AssertionError(f"expected {count} uploads, got {len(self.submitted)}")
+
+
+def write(path, size=10):
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    return path
+
+
+def records(spool):
+    with open(spool.index_path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_recovers_pending_entries_from_index(tmp_path):
+    directory = tmp_path / 'spool'
+    directory.mkdir()
+    kept = write(str(directory / 'a.mp4'))
+    retried = write(str(directory / 'b.mp4'))
+    write(str(directory / 'c.mp4'))
+
+    def add(entry_id, path, key):
+        return {"op": "add", "id": entry_id, "entry": {
+            "path": path, "key": key, "priority": 0, "size": 10, "added": 1.0,
+            "metadata": {}, "attempts": 0, "next_try": 123.0}}
+
+    lines = [add("a", kept, "clips/a"),
+             add("b", retried, "clips/b"),
+             {"op": "retry", "id": "b", "attempts": 3},
+             add("c", str(directory / 'c.mp4'), "clips/c"),
+             {"op": "done", "id": "c"},
+             # Journaled, but the file was never moved in
+             add("d", str(directory / 'd.mp4'), "clips/d")]
+    with open(directory / 'index.log', 'w') as f:
+        for line in lines:
+            f.write(json.dumps(line) + "\n")
+        f.write('{"op": "add", "id": "e", "ent')  # Torn by a crash
+
+    uploader = FakeUploader(workers=1)
+    spool = Spool(str(directory), uploader)
+
+    assert sorted(spool.entries) == ["a", "b"]
+    assert spool.entries["b"]["attempts"] == 3
+    assert all(entry["next_try"] == 0.0 for entry in spool.entries.values())
+    # The index is compacted to one add per live entry
+    assert [(r["op"], r["id"]) for r in records(spool)] == [("add", "a"), ("add", "b")]
+
+
+def test_upload_removes_entry_and_runs_callback(tmp_path):
+    uploader = FakeUploader()
+    spool = Spool(str(tmp_path / 'spool'), uploader)
+    results = []
+    entry_id = spool.add(write(str(tmp_path / 'clip.mp4')), 'clips/clip', callback=results.append)
+
+    (key, path, future), = uploader.wait_for(1)
+    future.set_result(UploadResult(key, 10, 0.1))
+
+    assert results == [UploadResult('clips/clip', 10, 0.1)]
+    assert entry_id not in spool.entries
+    assert not os.path.exists(path)
+    assert records(spool)[-1] == {"op": "done", "id": entry_id}
+
+
+def test_missing_file_is_dropped_not_retried(tmp_path):
+    uploader = FakeUploader()
+    spool = Spool(str(tmp_path / 'spool'), uploader)
+    dropped = []
+    entry_id = spool.add(write(str(tmp_path / 'clip.mp4')), 'clips/clip', on_drop=dropped.append)
+
+    (_, path, future), = uploader.wait_for(1)
+    os.remove(path)
+    future.set_exception(FileNotFoundError(path))
+
+    assert entry_id not in spool.entries
+    assert dropped == ["missing"]
+    assert records(spool)[-1] == {"op": "missing", "id": entry_id}
+    assert spool.stats()["failures"] == 0
+
+
+def test_failed_upload_backs_off_and_is_journaled(tmp_path):
+    uploader = FakeUploader()
+    spool = Spool(str(tmp_path / 'spool'), uploader, base_backoff=60.0)
+    entry_id = spool.add(write(str(tmp_path / 'clip.mp4')), 'clips/clip')
+
+    (_, _, future), = uploader.wait_for(1)
+    future.set_exception(ConnectionError("offline"))
+
+    assert spool.entries[entry_id]["attempts"] == 1
+    assert spool.entries[entry_id]["next_try"] > time.monotonic() + 20
+    assert records(spool)[-1] == {"op": "retry", "id": entry_id, "attempts": 1}
+    assert spool.stats()["uploading"] == 0
+
+
+def test_reserved_slot_is_kept_for_urgent_entries(tmp_path):
+    uploader = FakeUploader(workers=2)
+    spool = Spool(str(tmp_path / 'spool'), uploader, reserved=1)
+    for i in range(3):
+        spool.add(write(str(tmp_path / f'clip{i}.mp4')), f'clips/{i}')
+    uploader.wait_for(1)
+    time.sleep(0.05)
+    # One regular upload at a time, the other slot stays free
+    assert len(uploader.submitted) == 1
+
+    spool.add(write(str(tmp_path / 'snapshot.jpg')), 'snapshots/s', priority=URGENT)
+    assert [key for key, _, _ in uploader.wait_for(2)] == ['clips/0', 'snapshots/s']
+
+
+def test_eviction_reports_drop(tmp_path):
+    uploader = FakeUploader(workers=1)
+    spool = Spool(str(tmp_path / 'spool'), uploader, quota_bytes=25)
+    dropped = []
+    spool.add(write(str(tmp_path / 'a.mp4')), 'clips/a')
+    spool.add(write(str(tmp_path / 'b.mp4')), 'clips/b', on_drop=dropped.append)
+    spool.add(write(str(tmp_path / 'c.mp4')), 'clips/c', priority=1)
+    spool.add(write(str(tmp_path / 'd.mp4')), 'clips/d', priority=1)
+
+    # Lowest priority, then oldest, goes first: a then b
+    assert sorted(e["key"] for e in spool.entries.values()) == ['clips/c', 'clips/d']
+    assert dropped == ["evict"]
+    assert spool.stats()["evicted"] == 2
@@ -0,0 +1,57 @@
+import json
+
+from Journal import Journal, RECORD
+from Telemetry import Telemetry
+
+
+def published(payloads):
+    times = []
+    for payload in payloads:
+        body = json.loads(payload)
+        times += [e["time"] for e in body.get("events", [body])]
+    return times
+
+
+def drain(telemetry):
+    for _ in range(1000):
+        if telemetry.sent >= telemetry.journal.head:
+            return
+        telemetry.next_send = 0.0
+        telemetry.drain()
+
+
+def test_drain_skips_only_the_corrupt_run(tmp_path):
+    journal = Journal(str(tmp_path / "telemetry.journal"), capacity=64)
+    for i in range(100):
+        journal.append(1000 + i, 1, 0, 0, 0)
+    journal.commit(40)
+
+    # Seqs 60..79 sit in the middle of the ring, two whole batches of 10
+    for seq in range(60, 80):
+        offset = journal.offset(seq)
+        journal.map[offset + 8:offset + RECORD.size] = bytes(RECORD.size - 8)
+
+    payloads = []
+    telemetry = Telemetry(payloads.append, journal=journal, batch_size=10, replay_rate=1e9)
+    drain(telemetry)
+
+    assert published(payloads) == [1000 + i for i in range(40, 100) if not 60 <= i < 80]
+    assert journal.committed == 100
+    journal.close()
+
+
+def test_drain_skips_a_run_that_starts_mid_batch(tmp_path):
+    journal = Journal(str(tmp_path / "telemetry.journal"), capacity=64)
+    for i in range(30):
+        journal.append(1000 + i, 1, 0, 0, 0)
+    for seq in range(5, 25):
+        offset = journal.offset(seq)
+        journal.map[offset + 8:offset + RECORD.size] = bytes(RECORD.size - 8)
+
+    payloads = []
+    telemetry = Telemetry(payloads.append, journal=journal, batch_size=10, replay_rate=1e9)
+    drain(telemetry)
+
+    assert published(payloads) == [1000 + i for i in range(30) if not 5 <= i < 25]
+    assert journal.committed == 30
+    journal.close()
@@ -13,6 +13,9 @@ class TiltSwitch:
         self.state = False  # Default state
         self.last_change_time = time()
 
+        # Optional callback called with the new state on every change
+        self.on_change = None
+
         # Set up callbacks for state changes
         self.switch.when_pressed = self._tilt
         self.switch.when_released = self._stable
@@ -23,6 +26,8 @@ class TiltSwitch:
         """
         self.state = True
         self.last_change_time = time()
+        if self.on_change:
+            self.on_change(True)
 
     def _stable(self):
         """
@@ -30,6 +35,8 @@ class TiltSwitch:
         """
         self.state = False
         self.last_change_time = time()
+        if self.on_change:
+            self.on_change(False)
 
     def get_state(self):
         """